@@ -0,0 +1,231 @@
+"""
+Time every puzzle and guide sample, and catch encodings that got slower.
+
+    python benchmark.py -n 5 --out bench.json
+    python benchmark.py -n 5 --baseline bench.json      # exits 1 if anything regressed
+    python benchmark.py --encodings                     # compare make_func() encodings
+
+Each run of each puzzle happens in a fresh process (see runner.py), since a puzzle cannot declare its
+EnumSorts twice in one Z3 context.   The puzzles are not written to report their own timings, so while a
+puzzle runs the name `Solver` is swapped for `TimedSolver` in the puzzle modules and in z3 itself (which is
+where `solve()` and `prove()` find it).   The time of a run is then split three ways:
+
+    build    from the start of the puzzle function to its first check()
+    check    time spent inside check(), summed over every check
+    extract  the rest: reading models, printing, and any clues added between checks
+
+The statistics counters of every check (conflicts, decisions, memory, ...) are summed, except for the
+memory counters which keep the largest value seen.  The counters do not depend on the speed of the machine,
+so comparing them against a baseline catches an encoding change that makes Z3 work harder.
+"""
+import argparse
+import io
+import json
+import statistics
+import sys
+import time
+from contextlib import contextmanager, redirect_stdout
+from functools import partial
+
+import z3
+import z3.z3
+from z3 import Solver
+
+import dave_cook_poker_sample
+import dave_cook_skiing_comments
+import dave_cook_skiing_puzzle
+import dave_cook_tv_puzzle
+import logic_puzzles
+import z3_guide_code_samples
+from logic_puzzles import Struct
+from runner import run_puzzles
+
+PUZZLE_MODULES = [logic_puzzles, dave_cook_poker_sample, dave_cook_skiing_puzzle, dave_cook_skiing_comments,
+                  dave_cook_tv_puzzle, z3_guide_code_samples]
+
+MEMORY_COUNTERS = {"memory", "max memory"}
+
+
+def benchmarks():
+    # (name, function) pairs, in report order.  Every section_* function of the guide is its own benchmark.
+    found = [
+        ("podcast_puzzle", logic_puzzles.podcast_puzzle),
+        ("hero_puzzle", logic_puzzles.hero_puzzle),
+        ("coral_city_puzzle", logic_puzzles.coral_city_puzzle),
+        ("poker_puzzle", dave_cook_poker_sample.poker_puzzle),
+        ("skiing_puzzle", dave_cook_skiing_puzzle.skiing_puzzle),
+        ("skiing_comments", dave_cook_skiing_comments.skiing_puzzle),
+        ("television_puzzle", dave_cook_tv_puzzle.television_puzzle),
+    ]
+    for name in dir(z3_guide_code_samples):
+        if name.startswith("section_"):
+            found.append((name, getattr(z3_guide_code_samples, name)))
+    return found
+
+
+def encoding_benchmarks():
+    # Each make_func() encoding on the two 7x4 grids:  solve, then prove the solution unique (or not).
+    return [(f"{builder.__name__}[{encoding}]", partial(solve_puzzle, builder, encoding))
+            for builder in (logic_puzzles.build_hero_puzzle, logic_puzzles.build_coral_city_puzzle)
+            for encoding in logic_puzzles.ENCODINGS]
+
+
+def solve_puzzle(builder, encoding):
+    p = builder(encoding=encoding)
+    return logic_puzzles.is_unique(p.solver, p.primary_consts, p.helper_fn)
+
+
+# The run in progress in this process; benchmark runs never share a process.
+_current = None
+
+
+class TimedSolver(Solver):
+    def check(self, *assumptions):
+        start = time.perf_counter()
+        result = super().check(*assumptions)
+        seconds = time.perf_counter() - start
+        if _current is not None:
+            _current.record(start, seconds, self.statistics())
+        return result
+
+
+class Run:
+    def __init__(self, name):
+        self.name = name
+        self.first_check = None
+        self.check = 0.0
+        self.checks = 0
+        self.stats = dict()
+
+    def record(self, start, seconds, stats):
+        if self.first_check is None:
+            self.first_check = start
+        self.check += seconds
+        self.checks += 1
+        for key, value in stats:
+            if not isinstance(value, (int, float)):
+                continue
+            if key in MEMORY_COUNTERS:
+                self.stats[key] = max(self.stats.get(key, 0), value)
+            else:
+                self.stats[key] = self.stats.get(key, 0) + value
+
+
+@contextmanager
+def timed_solvers(modules=PUZZLE_MODULES):
+    # Swap Solver for TimedSolver in each module, and put the originals back afterwards.
+    targets = list(modules) + [z3.z3]
+    saved = [(module, module.Solver) for module in targets]
+    try:
+        for module in targets:
+            module.Solver = TimedSolver
+        yield
+    finally:
+        for module, original in saved:
+            module.Solver = original
+
+
+def bench_one(item):
+    # Runs in a worker process, like runner.run_one().
+    global _current
+    name, fn = item
+    _current = Run(name)
+    result = Struct()
+    result.name = name
+    result.error = None
+    with redirect_stdout(io.StringIO()), timed_solvers():
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            result.error = repr(e)
+        end = time.perf_counter()
+    first_check = _current.first_check if _current.first_check is not None else end
+    result.total = end - start
+    result.build = first_check - start
+    result.check = _current.check
+    result.extract = result.total - result.build - result.check
+    result.checks = _current.checks
+    result.stats = _current.stats
+    return result
+
+
+def summarize(values):
+    return dict(median=statistics.median(values), min=min(values), max=max(values))
+
+
+def run_benchmarks(items, runs=3, processes=None):
+    results = run_puzzles([item for item in items for _ in range(runs)], processes=processes, worker=bench_one)
+    report = dict(z3_version=z3.get_version_string(), runs=runs, benchmarks=dict())
+    for name, _ in items:
+        mine = [r for r in results if r.name == name]
+        entry = {phase: summarize([getattr(r, phase) for r in mine])
+                 for phase in ("total", "build", "check", "extract")}
+        entry["checks"] = mine[0].checks
+        entry["stats"] = {key: statistics.median([r.stats.get(key, 0) for r in mine])
+                          for key in sorted(set().union(*[r.stats for r in mine]))}
+        entry["errors"] = [r.error for r in mine if r.error]
+        report["benchmarks"][name] = entry
+    return report
+
+
+def compare(report, baseline, tolerance=0.25, min_seconds=0.005):
+    """ List the ways report is worse than baseline.  Small absolute differences are ignored as noise. """
+    regressions = []
+    for name, entry in report["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        base = baseline["benchmarks"][name]
+        for phase in ("total", "check"):
+            now, then = entry[phase]["median"], base[phase]["median"]
+            if now > then * (1 + tolerance) and now - then > min_seconds:
+                regressions.append(f"{name}: {phase} time {then:.4f}s -> {now:.4f}s")
+        for counter in ("conflicts", "decisions"):
+            now, then = entry["stats"].get(counter, 0), base["stats"].get(counter, 0)
+            if now > then * (1 + tolerance) and now - then > 10:
+                regressions.append(f"{name}: {counter} {then:g} -> {now:g}")
+        if entry["errors"] and not base["errors"]:
+            regressions.append(f"{name}: now fails with {entry['errors'][0]}")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'benchmark':36} {'total':>9} {'build':>9} {'check':>9} {'extract':>9} {'checks':>6} "
+          f"{'conflicts':>9} {'decisions':>9}")
+    for name, entry in report["benchmarks"].items():
+        print(f"{name:36} " + " ".join(f"{entry[phase]['median']:9.4f}"
+                                        for phase in ("total", "build", "check", "extract")) +
+              f" {entry['checks']:6} {entry['stats'].get('conflicts', 0):9g} {entry['stats'].get('decisions', 0):9g}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the puzzles and guide samples.")
+    parser.add_argument("-n", "--runs", type=int, default=3, help="runs of each benchmark (default 3)")
+    parser.add_argument("--only", action="append", help="only benchmarks whose name contains this text")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    parser.add_argument("--baseline", help="compare against a report written earlier with --out")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument("--encodings", action="store_true",
+                        help="compare the make_func() encodings instead of benchmarking the puzzles")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+
+    items = encoding_benchmarks() if args.encodings else benchmarks()
+    if args.only:
+        items = [(name, fn) for name, fn in items if any(text in name for text in args.only)]
+    report = run_benchmarks(items, runs=args.runs, processes=args.processes)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), tolerance=args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Check bit tricks at every width at once, and remember what broke them.
+
+section_bit_tricks() of z3_guide_code_samples.py proves `x & (x - 1) == 0` is the power of two test at
+32 bits, with one prove() call.   A trick that works at 32 bits can still fail at 8 (an overflow) or 64
+(a constant that was really 32 bits wide), so here a trick is written once as a template over the width:
+a module level function taking the width and returning the fast and the slow expression, which should
+always be equal.
+
+    def power_of_two(width):
+        x = BitVec("x", width)
+        return And(x != 0, x & (x - 1) == 0), Or([x == 2 ** i for i in range(width)])
+
+    verify([power_of_two, opposite_signs, ...])        # widths 8, 16, 32 and 64
+
+Every width of every trick is its own solver run in its own worker process (see runner.py), all in parallel.
+Counterexamples are kept in a small JSON file.  Before any solver runs, each trick is tried on every
+counterexample kept so far, and on the usual suspects (0, 1, -1, the smallest and largest numbers), by
+substituting the values and simplifying, which takes microseconds.   A wrong trick nearly always fails on one
+of those, since wrong tricks tend to fail in the same few ways, so most never reach the solver.
+Values are kept as signed numbers and cut down to each width, so -1 is all ones at every width.
+"""
+import json
+import os
+from functools import partial
+
+from z3 import (And, BitVec, BitVecVal, Extract, If, LShR, Not, Or, ZeroExt, is_false, sat,
+                simplify, substitute, unsat)
+from z3.z3util import get_vars
+
+import instrument
+from logic_puzzles import Struct
+from runner import run_puzzles
+from tuning import set_timeout, tuned_solver
+
+WIDTHS = (8, 16, 32, 64)
+CACHE_FILE = os.environ.get("BIT_TRICK_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            ".bit_trick_cache.json"))
+CACHE_LIMIT = 1000     # counterexamples kept, newest first
+
+
+def trick_name(trick):
+    return f"{trick.__module__}.{trick.__qualname__}"
+
+
+def load_cache(path=CACHE_FILE):
+    if path is None or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cache(counterexamples, path=CACHE_FILE):
+    if path is None:
+        return
+    with open(path + ".tmp", "w") as f:
+        json.dump(counterexamples[:CACHE_LIMIT], f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def usual_suspects(names, width):
+    # The same value for every variable, then each variable alone at each value with the rest 0.
+    values = (0, 1, -1, 2, 1 << (width - 1), (1 << (width - 1)) - 1)
+    found = [{name: value for name in names} for value in values]
+    found += [{**{other: 0 for other in names}, name: value} for name in names for value in values]
+    return found
+
+
+def replay(trick, width, counterexamples):
+    """ The first of counterexamples (dicts of variable name to int) the trick fails on at width, else None. """
+    fast, slow = trick(width)
+    claim = fast == slow
+    variables = {str(v): v for v in get_vars(claim)}
+    mask = (1 << width) - 1
+    tried = set()
+    for values in counterexamples + usual_suspects(sorted(variables), width):
+        assignment = tuple((name, values.get(name, 0) & mask) for name in sorted(variables))
+        if assignment in tried:
+            continue
+        tried.add(assignment)
+        pairs = [(variables[name], BitVecVal(value, width)) for name, value in assignment]
+        if is_false(simplify(substitute(claim, *pairs))):
+            return {name: signed(value, width) for name, value in assignment}
+    return None
+
+
+def signed(value, width):
+    return value - (1 << width) if value >> (width - 1) else value
+
+
+def prove_width(trick, width, timeout=None):
+    # Runs in a worker process.  Returns ("proved", None), ("counterexample", {name: value}) or ("unknown", None).
+    fast, slow = trick(width)
+    s = tuned_solver("bitvector")
+    if timeout:
+        set_timeout(s, int(timeout * 1000))
+    s.add(Not(fast == slow))
+    result = instrument.check(s, family="bitvector")
+    if result == unsat:
+        return "proved", None
+    if result == sat:
+        m = s.model()
+        return "counterexample", {str(v): m.eval(v, model_completion=True).as_signed_long()
+                                  for v in get_vars(fast == slow)}
+    return "unknown", None
+
+
+def verify(tricks, widths=WIDTHS, cache_file=CACHE_FILE, processes=None, timeout=60):
+    """
+    Check each trick at each width.  Returns a list of Structs with trick (its name), width, status ("proved",
+    "counterexample" or "unknown"), counterexample and how ("cache" when replaying settled it, else "solver").
+    """
+    counterexamples = load_cache(cache_file)
+    results, jobs = [], []
+    for trick in tricks:
+        for width in widths:
+            result = Struct()
+            result.trick, result.width = trick_name(trick), width
+            found = replay(trick, width, counterexamples)
+            if found is not None:
+                result.status, result.counterexample, result.how = "counterexample", found, "cache"
+            else:
+                jobs.append((result, (f"{result.trick}[{width}]", partial(prove_width, trick, width, timeout))))
+            results.append(result)
+    if jobs:
+        for (result, _), run in zip(jobs, run_puzzles([job for _, job in jobs], processes=processes)):
+            result.how = "solver"
+            if run.error:
+                result.status, result.counterexample = "unknown", None
+            else:
+                result.status, result.counterexample = run.value
+                if result.counterexample and result.counterexample not in counterexamples:
+                    counterexamples.insert(0, result.counterexample)
+        save_cache(counterexamples, cache_file)
+    return results
+
+
+# -- tricks, the two from the guide first
+
+def power_of_two(width):
+    x = BitVec("x", width)
+    return And(x != 0, x & (x - 1) == 0), Or([x == 2 ** i for i in range(width)])
+
+
+def power_of_two_buggy(width):
+    # The guide's "buggy version":  it thinks 0 is a power of two.
+    x = BitVec("x", width)
+    return x & (x - 1) == 0, Or([x == 2 ** i for i in range(width)])
+
+
+def opposite_signs(width):
+    x, y = BitVec("x", width), BitVec("y", width)
+    return (x ^ y) < 0, Or(And(x < 0, y >= 0), And(x >= 0, y < 0))
+
+
+def average(width):
+    # Unsigned floor((x + y) / 2) without overflow.  The slow way adds in one more bit.
+    x, y = BitVec("x", width), BitVec("y", width)
+    wide = LShR(ZeroExt(1, x) + ZeroExt(1, y), 1)
+    return (x & y) + LShR(x ^ y, 1), Extract(width - 1, 0, wide)
+
+
+def average_buggy(width):
+    x, y = BitVec("x", width), BitVec("y", width)
+    wide = LShR(ZeroExt(1, x) + ZeroExt(1, y), 1)
+    return LShR(x + y, 1), Extract(width - 1, 0, wide)
+
+
+def absolute(width):
+    x = BitVec("x", width)
+    sign = x >> (width - 1)
+    return (x ^ sign) - sign, If(x < 0, -x, x)
+
+
+def minimum(width):
+    x, y = BitVec("x", width), BitVec("y", width)
+    return y ^ ((x ^ y) & -If(x < y, BitVecVal(1, width), BitVecVal(0, width))), If(x < y, x, y)
+
+
+def lowest_bit_buggy(width):
+    # x & -x keeps the lowest set bit;  x & ~x - 1 does not (precedence: it is x & (~x - 1)).
+    x = BitVec("x", width)
+    return x & ~x - 1, x & -x
+
+
+def round_up(x, shifts):
+    v = x - 1
+    for shift in shifts:
+        v = v | LShR(v, shift)
+    return v + 1
+
+
+def round_up_power_of_two_buggy(width):
+    # Smearing the bits down by 1, 2, 4, 8 and 16 is enough for 32 bits, but 64 bits needs 32 as well.
+    x = BitVec("x", width)
+    every = [shift for shift in (1, 2, 4, 8, 16, 32) if shift < width]
+    return round_up(x, [shift for shift in every if shift <= 16]), round_up(x, every)
+
+
+TRICKS = [power_of_two, power_of_two_buggy, opposite_signs, average, average_buggy, absolute, minimum,
+          lowest_bit_buggy, round_up_power_of_two_buggy]
+
+
+if __name__ == "__main__":
+    import time
+
+    for run in ("first run", "second run"):
+        start = time.perf_counter()
+        results = verify(TRICKS)
+        by_cache = sum(1 for r in results if r.how == "cache")
+        print(f"\n{run}:  {len(results)} checks in {time.perf_counter() - start:.1f}s, {by_cache} settled without "
+              f"a solver")
+        for r in results:
+            detail = f" {r.counterexample}" if r.counterexample else ""
+            print(f"   {r.trick.split('.')[-1]:28} {r.width:3} bits  {r.status:15} ({r.how}){detail}")
@@ -0,0 +1,289 @@
+"""
+A little language for logic puzzle clues, compiled straight to Z3 expressions over a Puzzle's labels.
+
+This is the `p.clue("...")` idea from logic_puzzles.py, done with a tokenizer and a recursive descent parser
+instead of an `eval()`.   The clues of the Coral City puzzle read like this:
+
+    Kyrgzstan.Month == Jamaica.Month + 3         # 1. ... held 3 months after the exhibit from Jamaica
+    February == (6910 or Firearms)               # 2. February's exhibit is either 6,910 or the firearms
+    8880 != Norway                               # 3. ... 8,880 visitors wasn't from Norway
+    (9500, Glassware) == (June, Kyrgzstan)       # 4. Of 9,500 and glassware, one took place in June and
+                                                 #    the other was from Kyrgyzstan
+    7525.Month < 6425.Month                      # 7. ... sometime before ...
+    distinct(2010, Deep, Libertyville)           #    all different people
+
+A label (Firearms, 6910) stands for the entity it describes, that is, the member of the primary group that
+goes with it.  Labels are matched ignoring case, and any unique prefix will do, so "Ky" finds the oft
+misspelled "Kyrgzstan".   `Label.Group` is that entity's value in another group:  the number itself for
+a numeric group, or the 1-based position in the list for a named group, so months can be compared and
+offset.  `Label.num` is the position in the primary group.
+
+"A == (B or C)" is the puzzles' "either":  exactly one holds.   "A != (B or C)" is "neither".  The words
+and, or, not join whole clauses.   Offsets after + and - are always plain numbers, never labels.
+
+Parsing only depends on the text, so parsed clues are kept in an LRU cache and shared between puzzles.
+"""
+import functools
+import itertools
+import re
+
+from z3 import And, Distinct, Not, Or, PbEq, Xor
+
+
+class ClueError(ValueError):
+    pass
+
+
+TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<number>\d+(?:\.\d+)?)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_']*)
+    | (?P<op>==|!=|<=|>=|<|>|\+|-|\(|\)|,|\.)
+    )""", re.VERBOSE)
+
+KEYWORDS = {"and", "or", "not", "distinct"}
+COMPARISONS = {"==", "!=", "<", "<=", ">", ">="}
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise ClueError(f"cannot read clue at {text[position:]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "name" and value.lower() in KEYWORDS:
+            kind, value = "op", value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    # Grammar, loosest binding first:
+    #   clause     := conjunct ('or' conjunct)*
+    #   conjunct   := negation ('and' negation)*
+    #   negation   := 'not' negation | comparison
+    #   comparison := sum (COMPARISON sum)?
+    #   sum        := atom (('+' | '-') NUMBER)*
+    #   atom       := (NAME | NUMBER) ('.' NAME)? | 'distinct' '(' list ')' | '(' list ')'
+    # A parenthesized list of one clause is just that clause; of several, a tuple.
+    # The AST is nested tuples, so parsed clues can be cached and shared.
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def take(self, value=None):
+        kind, text = self.peek()
+        if kind is None or (value is not None and text != value):
+            raise ClueError(f"expected {value or 'more'} in clue {self.text!r}")
+        self.position += 1
+        return kind, text
+
+    def parse(self):
+        node = self.clause()
+        if self.position != len(self.tokens):
+            raise ClueError(f"unexpected {self.peek()[1]!r} in clue {self.text!r}")
+        return node
+
+    def joined(self, word, part):
+        parts = [part()]
+        while self.peek() == ("op", word):
+            self.take()
+            parts.append(part())
+        return parts[0] if len(parts) == 1 else (word, tuple(parts))
+
+    def clause(self):
+        return self.joined("or", self.conjunct)
+
+    def conjunct(self):
+        return self.joined("and", self.negation)
+
+    def negation(self):
+        if self.peek() == ("op", "not"):
+            self.take()
+            return ("not", self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        left = self.sum()
+        kind, text = self.peek()
+        if kind == "op" and text in COMPARISONS:
+            self.take()
+            return ("compare", text, left, self.sum())
+        return left
+
+    def sum(self):
+        node = self.atom()
+        offset = 0
+        while self.peek()[1] in ("+", "-"):
+            sign = 1 if self.take()[1] == "+" else -1
+            kind, number = self.take()
+            if kind != "number":
+                raise ClueError(f"offsets must be numbers in clue {self.text!r}")
+            offset += sign * (float(number) if "." in number else int(number))
+        return ("offset", node, offset) if offset else node
+
+    def listed(self):
+        self.take("(")
+        items = [self.clause()]
+        while self.peek() == ("op", ","):
+            self.take()
+            items.append(self.clause())
+        self.take(")")
+        return tuple(items)
+
+    def atom(self):
+        kind, text = self.peek()
+        if (kind, text) == ("op", "distinct"):
+            self.take()
+            return ("distinct", self.listed())
+        if (kind, text) == ("op", "("):
+            items = self.listed()
+            return items[0] if len(items) == 1 else ("tuple", items)
+        if kind is None:
+            raise ClueError(f"clue {self.text!r} ends too soon")
+        if kind not in ("name", "number"):
+            raise ClueError(f"unexpected {text!r} in clue {self.text!r}")
+        self.take()
+        node = ("label", text)
+        if self.peek() == ("op", "."):
+            self.take()
+            attribute_kind, attribute = self.take()
+            if attribute_kind != "name":
+                raise ClueError(f"expected a group name after '.' in clue {self.text!r}")
+            node = ("attribute", node, attribute)
+        return node
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_clue(text):
+    return Parser(text).parse()
+
+
+def find(text, choices, what):
+    # Exact match ignoring case, else the one choice starting with text.
+    folded = text.lower()
+    for choice in choices:
+        if choice.lower() == folded:
+            return choice
+    matches = [choice for choice in choices if choice.lower().startswith(folded)]
+    if len(matches) == 1:
+        return matches[0]
+    if matches:
+        raise ClueError(f"{text!r} could be any {what} of {', '.join(matches)}")
+    raise ClueError(f"no {what} called {text!r}")
+
+
+class Compiler:
+    # Turns an AST into Z3 over one puzzle.  Expressions come back tagged with what they are:
+    #   ("entity", e)  a member of the primary group
+    #   ("value", e)   a number
+    #   ("bool", e)    a clause
+    #   ("either", [..]), ("tuple", [..])  groups of entities, only meaningful beside == and !=
+    def __init__(self, puzzle):
+        self.puzzle = puzzle
+
+    def clause(self, node):
+        kind, expr = self.compile(node)
+        if kind != "bool":
+            raise ClueError("a clue must be a comparison or a combination of comparisons")
+        return expr
+
+    def compile(self, node, want=None):
+        tag = node[0]
+        if tag == "label":
+            return self.label(node[1], want)
+        if tag == "attribute":
+            entity = self.entity(node[1])
+            return "value", self.puzzle.value(entity, self.group(node[2]))
+        if tag == "offset":
+            kind, expr = self.compile(node[1], want="value")
+            if kind != "value":
+                raise ClueError("only numbers, such as Label.Group, can be offset")
+            return "value", expr + node[2]
+        if tag == "compare":
+            return "bool", self.compare(*node[1:])
+        if tag in ("and", "or"):
+            if tag == "or" and want == "entity":
+                return "either", [self.entity(part) for part in node[1]]
+            parts = [self.clause(part) for part in node[1]]
+            return "bool", (And if tag == "and" else Or)(parts)
+        if tag == "not":
+            return "bool", Not(self.clause(node[1]))
+        if tag == "distinct":
+            return "bool", Distinct([self.entity(part) for part in node[1]])
+        if tag == "tuple":
+            return "tuple", [self.entity(part) for part in node[1]]
+        raise ClueError(f"cannot compile {tag}")
+
+    def entity(self, node):
+        kind, expr = self.compile(node, want="entity")
+        if kind != "entity":
+            raise ClueError("expected a label")
+        return expr
+
+    def label(self, text, want):
+        if text[0].isdigit():   # numbers must match a label exactly, or they are just numbers
+            number = float(text) if "." in text else int(text)
+            if want == "value" or str(number) not in self.puzzle.labels:
+                return "value", number
+            return "entity", self.puzzle.entity(str(number))
+        return "entity", self.puzzle.entity(find(text, self.puzzle.labels, "label"))
+
+    def group(self, text):
+        if text.lower() == "num":
+            return self.puzzle.primary
+        return find(text, self.puzzle.groups, "group")
+
+    def compare(self, op, left_node, right_node):
+        left = self.compile(left_node, want="entity")
+        right = self.compile(right_node, want="value" if left[0] == "value" else "entity")
+        if left[0] == "value" and right[0] != "value":
+            right = self.compile(right_node, want="value")
+        if right[0] == "value" and left[0] != "value":
+            left = self.compile(left_node, want="value")
+        if op not in ("==", "!="):
+            if left[0] != "value" or right[0] != "value":
+                raise ClueError(f"{op} compares numbers; use Label.Group to pick which number")
+            return {"<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+                    ">": lambda a, b: a > b, ">=": lambda a, b: a >= b}[op](left[1], right[1])
+        if left[0] in ("either", "tuple"):
+            left, right = right, left
+        equal = self.equal(left, right)
+        if op == "==":
+            return equal
+        if right[0] == "either":   # "neither"
+            return And([left[1] != other for other in right[1]])
+        return Not(equal)
+
+    def equal(self, left, right):
+        (left_kind, a), (right_kind, b) = left, right
+        if left_kind == "entity" and right_kind == "either":
+            if len(b) == 2:
+                return Xor(a == b[0], a == b[1])
+            return PbEq([(a == other, 1) for other in b], 1)
+        if left_kind == "tuple" and right_kind == "tuple":
+            if len(a) != len(b):
+                raise ClueError("both sides of a tuple clue need the same number of labels")
+            if len(a) == 2:   # "of A and B, one is X and the other is Y"
+                return Xor(And(a[0] == b[0], a[1] == b[1]), And(a[0] == b[1], a[1] == b[0]))
+            return And(Distinct(a), Or([And([x == y for x, y in zip(a, order)])
+                                        for order in itertools.permutations(b)]))
+        if left_kind == right_kind and left_kind in ("entity", "value", "bool"):
+            return a == b
+        raise ClueError(f"cannot compare {left_kind} with {right_kind}")
+
+
+def compile_clue(puzzle, text):
+    # puzzle needs .labels, .groups, .primary, .entity(label) and .value(entity, group), as Puzzle has.
+    return Compiler(puzzle).clause(parse_clue(text))
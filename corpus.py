@@ -0,0 +1,136 @@
+"""
+Solve a whole corpus of logic puzzles, one puzzle per line of a JSONL file.
+
+    python corpus.py puzzles.jsonl -o results.jsonl -j 8
+
+Each input line is a puzzle written for Puzzle and the clue language of clues.py:
+
+    {"id": "coral-city", "categories": "Month: January, ...; Visitors: 6425, ...; ...",
+     "clues": ["Kyrgzstan.Month == Jamaica.Month + 3", "February == (6910 or Firearms)", ...]}
+
+"categories" may also be a dictionary of group name to list of values.   Each output line has the id, a
+status of "unique", "multiple", "contradiction", "unknown" (Z3 gave up, as it may under a tuning.py timeout)
+or "error", the solution as {primary: {group: value}}, and timings.   Results are written in the order they finish, so use the id to match them up.
+With --presolve, puzzles the grid pre-solver of presolve.py finishes on its own are marked "presolved".
+
+The file is read a line at a time and only a few puzzles per worker are in flight at once, so memory stays
+flat however long the corpus is.   Every puzzle is built in its own z3 Context, so puzzles that share group
+names ("Month" is popular) can run one after another in the same worker.   Each worker builds the skeleton of
+each puzzle shape once, and copies it for every puzzle of that shape (see templates.py).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from z3 import Context, sat, unsat
+
+import instrument
+from logic_puzzles import CACHE_DIR, Puzzle, alternate_solution, first_model
+from presolve import Contradiction, presolve
+from templates import shape_of, template_for
+
+
+def solve_record(line, cache_dir=CACHE_DIR, use_presolve=False):
+    # Runs in a worker.  Takes and returns text, so nothing from z3 crosses between processes.
+    result = dict(id=None, status="error")
+    try:
+        record = json.loads(line)
+        result["id"] = record.get("id")
+        start = time.perf_counter()
+        groups = record["categories"]
+        if isinstance(groups, str):
+            groups = Puzzle.parse_groups(groups)
+        domains = None
+        if use_presolve:
+            try:
+                grid = presolve(groups, record["clues"])
+            except Contradiction:
+                result["status"] = "contradiction"
+                result["presolved"] = True
+                return json.dumps(result)
+            if grid.understood and grid.solved():
+                result.update(status="unique", solution=grid.solution(), presolved=True,
+                              build_seconds=time.perf_counter() - start, solve_seconds=0.0)
+                return json.dumps(result)
+            domains = grid.domains()
+        template = None if domains else template_for(shape_of(groups))
+        with instrument.puzzle(str(result["id"]), family="logic_grid"):
+            p = Puzzle(groups, cache_dir=cache_dir, ctx=Context(), domains=domains, template=template)
+            for number, text in enumerate(record["clues"], 1):
+                p.clue(text, number)
+            built = time.perf_counter()
+            checked, m = first_model(p.solver, p.primary_consts, p.helper_fn)
+            if checked == sat:
+                result["solution"] = solution_dict(p, m)
+                checked, _ = alternate_solution(p.solver, p.primary_consts, p.helper_fn, m)
+                result["status"] = "unique" if checked == unsat else "multiple" if checked == sat else "unknown"
+            else:
+                result["status"] = "contradiction" if checked == unsat else "unknown"
+        result["build_seconds"] = built - start
+        result["solve_seconds"] = time.perf_counter() - built
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return json.dumps(result)
+
+
+def solution_dict(p, m):
+    groups = [group for group in p.groups if group != p.primary]
+    return {str(primary): {group: str(m.eval(fn(primary))) for group, fn in zip(groups, p.helper_fn)}
+            for primary in p.primary_consts}
+
+
+def solve_corpus(lines, out, workers=None, in_flight=None, cache_dir=CACHE_DIR, use_presolve=False):
+    """ Solve each JSON line of lines, writing one JSON result line to out as each finishes. """
+    workers = workers or os.cpu_count()
+    in_flight = in_flight or 2 * workers
+    counts = dict()
+    mp = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp) as pool:
+        pending = set()
+
+        def drain(until):
+            nonlocal pending
+            while len(pending) > until:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    text = future.result()
+                    status = json.loads(text)["status"]
+                    counts[status] = counts.get(status, 0) + 1
+                    out.write(text + "\n")
+
+        for line in lines:
+            if not line.strip():
+                continue
+            drain(in_flight - 1)   # backpressure:  wait for a free slot before reading any further
+            pending.add(pool.submit(solve_record, line, cache_dir, use_presolve))
+        drain(0)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve a JSONL corpus of logic puzzles.")
+    parser.add_argument("corpus", help="JSONL file of puzzles, or - for stdin")
+    parser.add_argument("-o", "--out", help="JSONL file for results (default stdout)")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--in-flight", type=int, help="puzzles queued at once (default: two per worker)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the compiled skeleton cache")
+    parser.add_argument("--presolve", action="store_true",
+                        help="run the grid pre-solver of presolve.py first, and skip Z3 when it is enough")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.corpus == "-" else open(args.corpus)
+    out = sys.stdout if args.out is None else open(args.out, "w")
+    start = time.perf_counter()
+    with source, out:
+        counts = solve_corpus(source, out, workers=args.workers, in_flight=args.in_flight,
+                              cache_dir=None if args.no_cache else CACHE_DIR, use_presolve=args.presolve)
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(f"{sum(counts.values())} puzzles in {time.perf_counter() - start:.1f}s: {summary}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,8 @@ from z3 import (
     unsat,
 )
 
+import instrument
+
 ORDINALS = {
     1: "1st",
     2: "2nd",
@@ -23,16 +25,16 @@ ORDINALS = {
 }
 
 
-def poker_puzzle():
-    solver = Solver()
+def poker_puzzle(ctx=None):
+    solver = Solver(ctx=ctx)
 
     Player, player_consts = EnumSort("Player",
-                                 ["Usain", "Terry", "Oliver", "Neil", "Ian"])
+                                 ["Usain", "Terry", "Oliver", "Neil", "Ian"], ctx=ctx)
     usain, terry, oliver, neil, ian = player_consts
 
     # ??? Source had an error here, reusing "Player"
     Card, card_consts = EnumSort("Card",
-                                 ["2", "5", "6", "7", "J", "Q", "K"])
+                                 ["2", "5", "6", "7", "J", "Q", "K"], ctx=ctx)
     card_2, card_5, card_6, card_7, card_J, card_Q, card_K = card_consts
 
     left = Function("left", Player, Card)
@@ -53,7 +55,7 @@ def poker_puzzle():
                       right(name) == card_Q,
                       right(name) == card_K))
 
-    fold = Function("fold", Player, IntSort())
+    fold = Function("fold", Player, IntSort(ctx))
     solver.add(Distinct([fold(name) for name in player_consts]))
     for name in player_consts:
         solver.add(fold(name) >= 1, fold(name) <= 5)
@@ -92,7 +94,7 @@ def poker_puzzle():
     # Neil folded next after Usain, refusing to chase an inside straight...
     solver.add(fold(neil) == fold(usain) + 1)
 
-    if solver.check() == sat:
+    if instrument.check(solver) == sat:
         m = solver.model()
         for name in player_consts:
             print("{} had {}{} and folded {}"
@@ -106,11 +108,13 @@ def poker_puzzle():
             expressions.append(left(name) != m.eval(left(name)))
             expressions.append(right(name) != m.eval(right(name)))
             expressions.append(fold(name) != m.eval(fold(name)))
+        solver.push()
         solver.add(Or(expressions))
-        if solver.check() == unsat:
+        if instrument.check(solver) == unsat:
             print("Solution is unique")
         else:
             print("Solution is not unique")
+        solver.pop()
 
 
 if __name__ == "__main__":
@@ -168,15 +168,19 @@ def skiing_puzzle():
         # We do this by adding the constraint "And this exact solution is not it", meaning one of
         # the functions in the above grid returned a different value.
         # If we can still solve with this new constraint, then the solution was not unique.
+        # push() opens a scope and pop() throws away everything added since, so the solver is back to the
+        # puzzle itself afterwards.  Without them, every later check would also exclude this solution.
         expressions = []
         for name in skier_consts:
             expressions.append(points(name) != m.eval(points(name)))
             expressions.append(distance(name) != m.eval(distance(name)))
+        solver.push()
         solver.add(Or(expressions))
         if solver.check() == unsat:
             print("Solution is unique")
         else:
             print("Solution is not unique")
+        solver.pop()
     else:
         print("Contradiction!  No solution possible.")  # solver.check() returned unsat
 
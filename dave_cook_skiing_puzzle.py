@@ -14,6 +14,8 @@ from z3 import (
     unsat,
 )
 
+import instrument
+
 """
 points: 82, 89, 96, 103
 jumpers: Denise, Madeline, Patti, Shawna
@@ -28,18 +30,18 @@ jumped 102.9 meters.
 """
 
 
-def skiing_puzzle():
+def skiing_puzzle(ctx=None):
     # create an EnumSort for names
     # store points/distances as ints/floats (so we can do relations later)
     # make functions from name to points and name to distance
     # handle clues that don't use names by making up a constant for it
-    solver = Solver()
+    solver = Solver(ctx=ctx)
 
     Skier, skier_consts = EnumSort("Skier",
-                                 ["Denise", "Madeline", "Patti", "Shawna"])
+                                 ["Denise", "Madeline", "Patti", "Shawna"], ctx=ctx)
     denise, madeline, patti, shawna = skier_consts
 
-    points = Function("points", Skier, IntSort())
+    points = Function("points", Skier, IntSort(ctx))
     solver.add(Distinct([points(name) for name in skier_consts]))
     for name in skier_consts:
         solver.add(Or(points(name) == 82,
@@ -47,7 +49,7 @@ def skiing_puzzle():
                       points(name) == 96,
                       points(name) == 103))
 
-    distance = Function("distance", Skier, RealSort())
+    distance = Function("distance", Skier, RealSort(ctx))
     solver.add(Distinct([distance(name) for name in skier_consts]))
     for name in skier_consts:
         solver.add(Or(distance(name) == 90.1,
@@ -79,7 +81,7 @@ def skiing_puzzle():
     # 5. Denise scored 89 points.
     solver.add(points(denise) == 89)
 
-    if solver.check() == sat:
+    if instrument.check(solver) == sat:
         m = solver.model()
         for name in skier_consts:
             print("{}: {} points, {}m"
@@ -91,11 +93,13 @@ def skiing_puzzle():
         for name in skier_consts:
             expressions.append(points(name) != m.eval(points(name)))
             expressions.append(distance(name) != m.eval(distance(name)))
+        solver.push()
         solver.add(Or(expressions))
-        if solver.check() == unsat:
+        if instrument.check(solver) == unsat:
             print("Solution is unique")
         else:
             print("Solution is not unique")
+        solver.pop()
     else:
         print("Contradiction!")
 
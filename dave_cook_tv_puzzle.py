@@ -13,17 +13,19 @@ from z3 import (
     unsat,
 )
 
+import instrument
 
-def television_puzzle():
-    solver = Solver()
+
+def television_puzzle(ctx=None):
+    solver = Solver(ctx=ctx)
 
     Station, station_consts = EnumSort("Station",
-                                 ["BNRG", "CVT", "KWTM", "PCR", "TWL"])
+                                 ["BNRG", "CVT", "KWTM", "PCR", "TWL"], ctx=ctx)
     bnrg, cvt, kwtm, pcr, twl = station_consts
 
     Show, show_consts = EnumSort("Show",
                                  ["Moneygab", "Ponyville", "Powertrips",
-                                  "Soap_Suds", "Top_Chow"])
+                                  "Soap_Suds", "Top_Chow"], ctx=ctx)
     moneygab, ponyville, powertrips, soapsuds, topchow = show_consts
 
     show = Function("show", Station, Show)
@@ -35,12 +37,12 @@ def television_puzzle():
                       show(name) == soapsuds,
                       show(name) == topchow))
 
-    viewers = Function("viewers", Station, IntSort())
+    viewers = Function("viewers", Station, IntSort(ctx))
     solver.add(Distinct([viewers(name) for name in station_consts]))
     for name in station_consts:
         solver.add(viewers(name) >= 1, viewers(name) <= 5)
 
-    channel = Function("channel", Station, IntSort())
+    channel = Function("channel", Station, IntSort(ctx))
     solver.add(Distinct([channel(name) for name in station_consts]))
     for name in station_consts:
         solver.add(Or(channel(name) == 15,
@@ -99,7 +101,7 @@ def television_puzzle():
     # 7. CVT isn't carried on channel 62.
     solver.add(channel(cvt) != 62)
 
-    if solver.check() == sat:
+    if instrument.check(solver) == sat:
         m = solver.model()
         for name in station_consts:
             print("{}: {} million, {}, #{}"
@@ -113,11 +115,13 @@ def television_puzzle():
             expressions.append(viewers(name) != m.eval(viewers(name)))
             expressions.append(channel(name) != m.eval(channel(name)))
             expressions.append(show(name) != m.eval(show(name)))
+        solver.push()
         solver.add(Or(expressions))
-        if solver.check() == unsat:
+        if instrument.check(solver) == unsat:
             print("Solution is unique")
         else:
             print("Solution is not unique")
+        solver.pop()
     else:
         print("Contradiction!")
 
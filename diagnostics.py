@@ -0,0 +1,275 @@
+"""
+Find the bad clue without re-running the puzzle after every clue.
+
+While writing coral_city_puzzle() I found mistakes "because I was running the program to see output between
+adding clues".   That is one full solve per clue, and it only says where the trouble starts, not which
+earlier clue it is fighting with.   Z3 can say that itself.   Each clue is added with assert_and_track()
+under a Bool named for its clue number.  When the clues contradict each other, one check gives an unsat core,
+the clue numbers that cannot all hold together, minimized by Z3 so that dropping any one of them makes the
+rest satisfiable.
+
+The other kind of mistake is a puzzle that solves, but to the wrong answer.   Given the expected answer (from
+the back of the book), one check with the answer fixed shows which clues it breaks, as written.   Those are
+the clues to re-read.
+
+Both work on anything with .solver and .clues (number -> z3 expression), which is what Puzzle.clue() and
+add_clue() in logic_puzzles.py keep:
+
+    report = diagnose(p)                       # a contradiction:  report.core is e.g. [6, 15]
+    report = diagnose(p, expected=ANSWER)      # a wrong answer:  report.violated lists clue numbers
+
+A finished puzzle can have clues it does not need.  "The solution is unique" is the same as "the clues, plus
+at least one cell differing from the solution, are unsat", so the clues that uniqueness needs are an unsat core
+of that, and with core.minimize Z3 hands back a minimal one:  every clue left in it is needed, since without it
+another solution gets in.   So three checks find a minimal sufficient set of clues however many clues there
+are, where trying each clue's removal takes a full solve per clue.   Each clue sits behind a selector literal
+passed as an assumption, so the checks share one solver.
+
+    analysis = clue_redundancy(p)              # analysis.redundant is [13] for Coral City
+
+The third check measures how hard the puzzle is:  it proves the solution unique from the needed clues alone, in a
+fresh solver, and counts the conflicts, that is, the guesses that Z3 had to take back.   The difficulty score is
+log2(1 + conflicts), so each point means twice the backtracking.  A score of 0 means propagation alone settles
+the grid, and nothing has to be guessed.
+"""
+import math
+
+from z3 import Bool, Implies, Solver, is_false, sat, unsat
+
+import instrument
+from logic_puzzles import Struct, blocking_clause
+
+
+def skeleton(p):
+    # Everything in p.solver that is not a clue:  the sorts, functions and their one-to-one constraints.
+    clue_ids = {expr.get_id() for expr in p.clues.values()}
+    return [a for a in p.solver.assertions() if a.get_id() not in clue_ids]
+
+
+def tracked_solver(p):
+    # A solver with the skeleton asserted, and each clue tracked as "clue_<number>".
+    ctx = p.solver.ctx
+    s = Solver(ctx=ctx)
+    s.set("core.minimize", True)
+    s.add(skeleton(p))
+    for number, expr in p.clues.items():
+        s.assert_and_track(expr, Bool(f"clue_{number}", ctx))
+    return s
+
+
+def unsat_core(p):
+    # The clue numbers of a minimal contradiction, or None if the clues are consistent.  One check.
+    s = tracked_solver(p)
+    if instrument.check(s, family="logic_grid") != unsat:
+        return None
+    names = {f"clue_{number}": number for number in p.clues}
+    return sorted(names[str(name)] for name in s.unsat_core())
+
+
+def selector_solver(p):
+    # A solver with the skeleton asserted, and each clue behind a selector literal "clue_<number>".  Returns the
+    # solver and a dict of clue number -> selector, for check(*selectors).
+    ctx = p.solver.ctx
+    s = Solver(ctx=ctx)
+    s.set("core.minimize", True)
+    s.add(skeleton(p))
+    selectors = dict()
+    for number, expr in p.clues.items():
+        selectors[number] = Bool(f"clue_{number}", ctx)
+        s.add(Implies(selectors[number], expr))
+    return s, selectors
+
+
+def core_numbers(s, selectors):
+    core = {str(name) for name in s.unsat_core()}
+    return [number for number, selector in selectors.items() if str(selector) in core]
+
+
+def clue_redundancy(p, verify=False):
+    """
+    Which clues the puzzle could do without.  Returns a Struct with:
+        status      "unique", "multiple" (not enough clues) or "contradiction"
+        needed      a minimal set of clue numbers that still give the one solution
+        redundant   the other clue numbers
+        core        for a contradiction, the clue numbers that cannot all hold
+        difficulty  a Struct of score, conflicts and decisions, see above
+        checks      how many solves it took
+    verify=True checks that no clue of needed can be dropped after all, one more check per needed clue.
+    """
+    analysis = Struct()
+    analysis.needed = analysis.redundant = analysis.core = analysis.difficulty = None
+    s, selectors = selector_solver(p)
+    assumptions = list(selectors.values())
+    analysis.checks = 1
+    if instrument.check(s, *assumptions, family="logic_grid") != sat:
+        analysis.status = "contradiction"
+        analysis.core = core_numbers(s, selectors)
+        return analysis
+    block = blocking_clause(s.model(), p.primary_consts, p.helper_fn)
+    s.add(block)
+    analysis.checks += 1
+    if instrument.check(s, *assumptions, family="logic_grid") != unsat:
+        analysis.status = "multiple"
+        return analysis
+    analysis.status = "unique"
+    analysis.needed = core_numbers(s, selectors)
+    if verify:
+        for number in list(analysis.needed):
+            analysis.checks += 1
+            trial = [selectors[other] for other in analysis.needed if other != number]
+            if instrument.check(s, *trial, family="logic_grid") == unsat:
+                analysis.needed = core_numbers(s, selectors)
+    analysis.redundant = [number for number in p.clues if number not in analysis.needed]
+
+    # How hard it is to prove unique from the needed clues alone, in a solver that has learned nothing yet.
+    proof = Solver(ctx=p.solver.ctx)
+    proof.add(skeleton(p))
+    proof.add([p.clues[number] for number in analysis.needed])
+    proof.add(block)
+    analysis.checks += 1
+    instrument.check(proof, family="logic_grid")
+    stats = instrument.statistics(proof)
+    analysis.difficulty = Struct()
+    analysis.difficulty.conflicts = stats.get("conflicts", 0)
+    analysis.difficulty.decisions = stats.get("decisions", 0)
+    analysis.difficulty.score = round(math.log2(1 + analysis.difficulty.conflicts), 1)
+    return analysis
+
+
+def expected_constraints(p, expected):
+    # expected holds one row per primary, as solver_check() prints them:  the primary's label, then the value
+    # of each of p.helper_fn, e.g. ("April", 8880, "Eritrea", "Basketry").  Values are matched by their text.
+    primaries = {str(const): const for const in p.primary_consts}
+    constraints = []
+    for primary, *values in expected:
+        for fn, value in zip(p.helper_fn, values):
+            sort = fn.range()
+            if hasattr(sort, "num_constructors"):
+                choices = {str(sort.constructor(i)()): sort.constructor(i)() for i in range(sort.num_constructors())}
+                value = choices[str(value)]
+            else:
+                value = sort.cast(value)
+            constraints.append(fn(primaries[str(primary)]) == value)
+    return constraints
+
+
+def violated_clues(p, expected):
+    """
+    The clue numbers the expected solution breaks.  Returns None if the expected solution breaks the skeleton
+    itself (a label used twice, say), since then every clue is suspect.  One check.
+    """
+    s = Solver(ctx=p.solver.ctx)
+    s.add(skeleton(p))
+    s.add(expected_constraints(p, expected))
+    if instrument.check(s, family="logic_grid") != sat:
+        return None
+    m = s.model()
+    return [number for number, expr in p.clues.items() if is_false(m.eval(expr, model_completion=True))]
+
+
+def diagnose(p, expected=None):
+    """
+    Check the puzzle's clues, and say which are at fault.  Returns a Struct with:
+        status     "contradiction", "wrong answer", "ok" (matches expected) or "sat" (nothing to compare with)
+        core       for a contradiction, the clue numbers that cannot all hold
+        violated   with expected, the clue numbers the expected answer breaks
+        checks     how many solves it took
+    """
+    report = Struct()
+    report.core = unsat_core(p)
+    report.checks = 1
+    report.violated = None
+    if expected is not None:
+        # Worth doing for a contradiction too:  the core says which clues fight, this says which one is wrong.
+        report.violated = violated_clues(p, expected)
+        report.checks += 1
+    if report.core is not None:
+        report.status = "contradiction"
+    elif expected is None:
+        report.status = "sat"
+    else:
+        report.status = "ok" if report.violated == [] else "wrong answer"
+    return report
+
+
+def print_report(report, clue_text=None):
+    # clue_text, if given, maps clue numbers to the words of the clue.
+    print(f"Status: {report.status}, in {report.checks} checks")
+    for title, numbers in (("Contradiction between clues", report.core), ("Clues broken by the expected answer",
+                                                                           report.violated)):
+        if numbers:
+            print(f"{title}:")
+            for number in numbers:
+                print(f"   {number}. {clue_text[number] if clue_text else ''}")
+
+
+def print_redundancy(analysis, clue_text=None):
+    print(f"Status: {analysis.status}, in {analysis.checks} checks")
+    if analysis.core:
+        print(f"Contradiction between clues {analysis.core}")
+    if analysis.needed is not None:
+        print(f"Needed:  {len(analysis.needed)} clues {analysis.needed}")
+        print("Redundant:" + ("  none" if not analysis.redundant else ""))
+        for number in analysis.redundant:
+            print(f"   {number}. {clue_text[number] if clue_text else ''}")
+        d = analysis.difficulty
+        print(f"Difficulty {d.score}  ({d.conflicts} conflicts, {d.decisions} decisions)")
+
+
+# The answer to the Coral City puzzle.
+CORAL_CITY_ANSWER = [
+    ("January", 8060, "Honduras", "Ceramics"),
+    ("February", 10425, "Jamaica", "Firearms"),
+    ("March", 7525, "Chile", "Sculpture"),
+    ("April", 8880, "Eritrea", "Basketry"),
+    ("May", 6910, "Kyrgzstan", "Glassware"),
+    ("June", 9500, "Iraq", "Lacquerware"),
+    ("July", 6425, "Norway", "Armor"),
+]
+
+
+if __name__ == "__main__":
+    from z3 import Context
+    from logic_puzzles import CORAL_CITY_CLUES, CORAL_CITY_TEXT, Puzzle
+
+    def coral_city(clues):
+        p = Puzzle.from_text(CORAL_CITY_TEXT, ctx=Context())
+        for number, text in enumerate(clues, 1):
+            p.clue(text, number)
+        return p, dict(enumerate(clues, 1))
+
+    print("Coral City as written:")
+    p, text = coral_city(CORAL_CITY_CLUES)
+    print_report(diagnose(p, expected=CORAL_CITY_ANSWER), text)
+
+    print("\nCoral City, with clue 6 mistyped as 9500 instead of 8880:")
+    clues = list(CORAL_CITY_CLUES)
+    clues[5] = "Basketry == 9500"
+    p, text = coral_city(clues)
+    print_report(diagnose(p, expected=CORAL_CITY_ANSWER), text)
+
+    print("\nCoral City, with clue 3 mistyped as Eritrea instead of Norway:")
+    clues = list(CORAL_CITY_CLUES)
+    clues[2] = "8880 != Eritrea"
+    p, text = coral_city(clues)
+    print_report(diagnose(p, expected=CORAL_CITY_ANSWER), text)
+
+    print("\nWhich clues of Coral City are needed?")
+    p, text = coral_city(CORAL_CITY_CLUES)
+    print_redundancy(clue_redundancy(p, verify=True), text)
+
+    # A generated puzzle, with clues true of its answer added until there are 30.
+    from generator import Generator, pool_groups
+
+    generator = Generator(pool_groups(4, 6), seed=4)
+    made = generator.generate()
+    clues = list(made.clues)
+    while len(clues) < 30:
+        clue = generator.draw(made.answer)
+        if clue is not None and generator.clue_text(clue) not in clues:
+            clues.append(generator.clue_text(clue))
+    p = Puzzle(generator.groups, ctx=Context())
+    for number, clue in enumerate(clues, 1):
+        p.clue(clue, number)
+    print(f"\nA generated puzzle of 4 by 6, its {len(made.clues)} minimal clues and {30 - len(made.clues)} more:")
+    print_redundancy(clue_redundancy(p), dict(enumerate(clues, 1)))
@@ -0,0 +1,231 @@
+"""
+Read a whole solution out of a model with one call, as a table of small integers.
+
+Printing a solution the usual way, `m.eval(fn(primary))` for every primary and function, crosses from
+Python into Z3 once per cell and builds a Python object for every value.  That is nothing for one 7 by 3
+grid, and most of the time when listing thousands of solutions of a big one.
+
+Every column of a logic grid takes its values from a short known list:  the enum's labels, or the numbers in
+the category.  So a cell can be written as its index into that list, a few bits wide.  An Extractor builds one
+bit-vector term ahead of time, the index of every cell concatenated, and reading a model is then one eval of
+that term.  The number that comes back is split into a NumPy array of codes, rows by primary and columns by
+function.  Labels are only turned into text when asked for.
+
+    extractor = Extractor(p.primary_consts, p.helper_fn)
+    table = extractor.table(m)
+    table.codes                         # e.g. array([[3, 2, 6], [6, 4, 5], ...])
+    table.rows()                        # [["January", "8060", "Honduras", "Ceramics"], ...]
+    solver.add(extractor.blocking_clause(table.codes))
+
+The value lists come from the enum sort, or when given as values, and then a model with a value not in its list
+raises ValueError rather than being quietly given the wrong code.   Otherwise the models read give them:  the
+first model gives all of them for the one-to-one functions of these puzzles, where every value is used exactly
+once, and a model with a new value adds it (a slower read, as the term is built again).
+"""
+import time
+
+import numpy as np
+from z3 import Ast, BitVecVal, BoolRef, Concat, If, Or, Z3_mk_or, is_int_value, is_rational_value, sat, unsat
+
+import instrument
+from tuning import timeout_of
+
+
+class Extractor:
+    def __init__(self, primary_consts, helper_fn, values=None):
+        # values, if given, lists the possible values of each function in helper_fn, in code order.
+        self.primary_consts = list(primary_consts)
+        self.terms = [[fn(primary) for fn in helper_fn] for primary in self.primary_consts]
+        self.shape = len(self.primary_consts), len(helper_fn)
+        self.values = None
+        if values is not None:
+            self.values = [[fn.range().cast(v) if hasattr(fn, "range") else v for v in column]
+                           for fn, column in zip(helper_fn, values)]
+        elif all(hasattr(term.sort(), "num_constructors") for term in self.terms[0]):
+            self.values = [[sort.constructor(i)() for i in range(sort.num_constructors())]
+                           for sort in (term.sort() for term in self.terms[0])]
+        self.learning = self.values is None
+        self.packed = None
+        self._labels = None
+        self.differs = dict()    # (term id, code) -> term != value
+
+    def learn_values(self, m):
+        # Each column's values as the model m has them, numbers in order.  Values learned from an earlier
+        # model keep their codes, and new ones go after them.
+        first = self.values is None
+        columns = [[] for _ in self.terms[0]] if first else self.values
+        for known, column in zip(columns, zip(*self.terms)):
+            found = {value.sexpr(): value for value in known}
+            new = dict()
+            for term in column:
+                value = m.eval(term, model_completion=True)
+                if value.sexpr() not in found:
+                    new.setdefault(value.sexpr(), value)
+            values = list(new.values())
+            if first and all(is_int_value(v) or is_rational_value(v) for v in values):
+                values.sort(key=lambda v: v.as_long() if is_int_value(v) else v.as_fraction())
+            known.extend(values)
+        self.values = columns
+        self.packed = self._labels = None
+
+    def build(self):
+        # One code per cell, width bits each, cell 0 in the lowest bits.  The code len(values) means "none of
+        # these", so every width leaves room for it.
+        self.width = max(len(column) for column in self.values).bit_length()
+        pieces = []
+        for row in self.terms:
+            for term, column in zip(row, self.values):
+                code = BitVecVal(len(column), self.width, term.ctx)
+                for index in range(len(column) - 1, -1, -1):
+                    code = If(term == column[index], BitVecVal(index, self.width, term.ctx), code)
+                pieces.append(code)
+        self.packed = Concat(pieces[::-1]) if len(pieces) > 1 else pieces[0]
+        self.weights = 1 << np.arange(self.width, dtype=np.int64)
+        self.limits = np.array([len(column) for column in self.values])
+
+    def codes(self, m):
+        """ The model's solution as an int array, one row per primary and one column per function. """
+        if self.values is None:
+            self.learn_values(m)
+        if self.packed is None:
+            self.build()
+        number = m.eval(self.packed, model_completion=True).as_long()
+        cells = self.shape[0] * self.shape[1]
+        raw = np.frombuffer(number.to_bytes((cells * self.width + 7) // 8, "little"), dtype=np.uint8)
+        bits = np.unpackbits(raw, bitorder="little")[:cells * self.width].reshape(cells, self.width)
+        codes = (bits @ self.weights).reshape(self.shape)
+        if (codes >= self.limits).any():
+            if not self.learning:
+                raise ValueError("the model has a value outside the extractor's lists")
+            self.learn_values(m)
+            return self.codes(m)
+        return codes
+
+    def table(self, m):
+        return Table(self, self.codes(m))
+
+    def labels(self):
+        # Each column's values as text, worked out once.
+        if self._labels is None:
+            self._labels = [[str(v) for v in column] for column in self.values]
+        return self._labels
+
+    def blocking_clause(self, codes):
+        # "At least one cell differs from this solution", as blocking_clause() in logic_puzzles.py, from codes.
+        # Each `term != value` is built the first time it is needed and kept, since successive solutions of
+        # one puzzle share most of their cells.
+        differs = []
+        for row, row_codes in zip(self.terms, codes.tolist()):
+            for term, column, code in zip(row, self.values, row_codes):
+                key = term.get_id(), code
+                if key not in self.differs:
+                    self.differs[key] = term != column[code]
+                differs.append(self.differs[key])
+        # Or() checks and coerces every argument, which takes longer than everything else here put together.
+        # They are all Bools of one context already, so go to the C API directly.
+        ctx = differs[0].ctx
+        return BoolRef(Z3_mk_or(ctx.ref(), len(differs), (Ast * len(differs))(*[d.as_ast() for d in differs])), ctx)
+
+
+class Table:
+    # One solution:  codes, and the extractor that knows what they mean.
+    def __init__(self, extractor, codes):
+        self.extractor = extractor
+        self.codes = codes
+
+    def label(self, row, column):
+        return self.extractor.labels()[column][self.codes[row, column]]
+
+    def rows(self):
+        # Rows of text, the primary's label first, as print_solution() prints them.
+        labels = self.extractor.labels()
+        return [[str(primary)] + [labels[j][code] for j, code in enumerate(row)]
+                for primary, row in zip(self.extractor.primary_consts, self.codes.tolist())]
+
+    def values(self):
+        # Rows of z3 values, without asking the model again.
+        return [[column[code] for column, code in zip(self.extractor.values, row)] for row in self.codes.tolist()]
+
+
+class Incomplete(Exception):
+    # solution_codes() stopped before it knew it had every solution:  out of time, or the solver gave up.
+    def __init__(self, found, reason):
+        super().__init__(f"stopped after {found} solutions:  {reason}")
+        self.found = found
+        self.reason = reason
+
+
+def solution_codes(solver, extractor, limit=None, timeout=None):
+    """
+    Generator of the code array of every solution, blocking each one found, within a push/pop scope as
+    all_solutions() in logic_puzzles.py has it.  Stops after limit solutions.  Raises Incomplete, after
+    yielding what it found, when timeout seconds run out or a check comes back unknown before the last
+    solution is proven the last.   A timeout the caller gave the solver with tuning.set_timeout() still
+    bounds each check, and is put back at the end.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    previous = timeout_of(solver)
+    solver.push()
+    try:
+        found = 0
+        while limit is None or found < limit:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Incomplete(found, f"out of time after {timeout}s")
+                solver.set("timeout", min(previous, max(1, int(remaining * 1000))))
+            result = instrument.check(solver)
+            if result == unsat:     # every solution found
+                return
+            if result != sat:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise Incomplete(found, f"out of time after {timeout}s")
+                raise Incomplete(found, solver.reason_unknown())
+            codes = extractor.codes(solver.model())
+            solver.add(extractor.blocking_clause(codes))
+            found += 1
+            yield codes
+    finally:
+        if deadline is not None:
+            solver.set("timeout", previous)
+        solver.pop()
+
+
+if __name__ == "__main__":
+    from z3 import Context
+
+    from logic_puzzles import Puzzle
+
+    # A grid with few clues has many solutions, so listing them is mostly reading models.
+    p = Puzzle.from_text("""Month: January, February, March, April, May, June, July ;
+                            Visitors: 6425, 6910, 7525, 8060, 8880, 9500, 10425 ;
+                            Country: Chile, Eritrea, Honduras, Iraq, Jamaica, Kyrgzstan, Norway ;
+                            Exhibit: Armor, Basketry, Ceramics, Firearms, Glassware, Lacquerware, Sculpture""",
+                         cache_dir=None, ctx=Context())
+    for clue in ("January == Chile", "Armor == 6425", "February == 9500", "Iraq == Basketry"):
+        p.clue(clue)
+    count = 300
+
+    p.solver.push()
+    start = time.perf_counter()
+    reading = 0
+    for _ in range(count):
+        p.solver.check()
+        m = p.solver.model()
+        begin = time.perf_counter()
+        values = [[m.eval(fn(primary)) for fn in p.helper_fn] for primary in p.primary_consts]
+        rows = [[str(primary)] + [str(v) for v in row] for primary, row in zip(p.primary_consts, values)]
+        reading += time.perf_counter() - begin
+        p.solver.add(Or([fn(primary) != v for primary, row in zip(p.primary_consts, values)
+                         for fn, v in zip(p.helper_fn, row)]))
+    p.solver.pop()
+    print(f"m.eval per cell:   {count} solutions in {time.perf_counter() - start:.2f}s, {reading:.3f}s reading models")
+
+    extractor = Extractor(p.primary_consts, p.helper_fn, values=[p.consts[g] for g in p.groups if g != p.primary])
+    start = time.perf_counter()
+    solutions = np.stack(list(solution_codes(p.solver, extractor, limit=count)))
+    print(f"Extractor:         {len(solutions)} solutions in {time.perf_counter() - start:.2f}s, as an array of "
+          f"shape {solutions.shape}")
+    print("The last one:")
+    for row in Table(extractor, solutions[-1]).rows():
+        print("   " + ", ".join(row))
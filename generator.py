@@ -0,0 +1,347 @@
+"""
+Make new logic grid puzzles that have exactly one solution, with no clue to spare.
+
+The hero puzzle in logic_puzzles.py came from a site that "generated this puzzle with multiple solutions by not
+having quite enough clues".   Here a puzzle is made the other way around.  Pick the answer first, at random:
+a shuffle of every group against the primary.  Then add clues that are true of the answer, written in the clue
+language of clues.py, in the patterns the puzzles in this repository use:
+
+    same        Basketry == 8880                      the basketry exhibit saw 8,880 visitors
+    differ      8880 != Norway                        ... wasn't from Norway
+    either      Lacquerware == (Jamaica or Iraq)      ... is either Jamaica's or Iraq's
+    pair        (9500, Glassware) == (June, Ky)       of those two, one is June's and the other Kyrgzstan's
+    offset      Armor.Month == Iraq.Month + 1         one month after
+    before      7525.Month < 6425.Month               sometime before
+
+Offsets are only used on groups in even steps (the primary's positions, years), and before and after on the
+primary and on numeric groups.
+
+Whether the clues so far pin the answer down is one check:  the clues, plus "some cell differs from the
+answer", is unsat exactly when the answer is the only solution.   When it is sat, the model is another solution,
+and the next clue is drawn at random from the clues the answer passes and that other solution fails, so every
+clue added rules something out.   The clues are tested against both solutions in plain Python, on tables of
+value indexes, and only the clue that is kept is compiled for Z3.
+
+All of it happens on one solver, which keeps the skeleton of the grid from one puzzle to the next.  Each puzzle
+works in a push/pop scope of its own, where "differs from the answer" is asserted and each clue as `selector
+implies clue`, so a check only counts the clues whose selectors are passed as assumptions.  (Keeping every clue
+ever drawn in the solver instead, switched off by its selector, made each puzzle slower than the one before:
+from 140ms to 480ms over 200 puzzles of 4 by 5.)   Compiled clues are kept by their text for later puzzles.
+Once the answer is unique, the unsat core says which clues the proof used, and each of those is tried without:
+if the rest is still unsat, that clue was redundant.  What is left is minimal, since dropping any one clue
+lets another solution in.   On one core that comes to about 600 puzzles a minute of 4 categories by 5 values,
+and 280 of 4 by 7.
+
+    generator = Generator(CORAL_CITY_TEXT, seed=1)
+    made = generator.generate()                  # made.clues, made.solution, made.checks, made.seconds
+    python generator.py -n 200 -o puzzles.jsonl  # puzzles for corpus.py
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+
+import numpy as np
+from z3 import Bool, Context, Implies, Solver, unsat
+
+import instrument
+from clues import compile_clue
+from extract import Extractor
+from logic_puzzles import Puzzle, Struct
+
+# How often each kind of clue is drawn.
+CLUE_WEIGHTS = {"same": 2, "differ": 3, "either": 3, "pair": 2, "offset": 2, "before": 2}
+MAX_OFFSET = 3      # steps
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_']*|\d+(\.\d+)?")    # a label clues.py can read
+DRAWS = 500         # clues drawn looking for one the other solution fails, before falling back on "same"
+
+# Groups to take puzzles from:  the first is the primary, and each puzzle takes as many of the others as it
+# needs, and as many values of each.
+POOL = {
+    "Month": "January, February, March, April, May, June, July, August, September".split(", "),
+    "Year": [2007, 2008, 2009, 2010, 2011, 2012, 2013, 2014, 2015],
+    "Country": "Chile, Eritrea, Honduras, Iraq, Jamaica, Kyrgzstan, Norway, Peru, Spain".split(", "),
+    "Exhibit": "Armor, Basketry, Ceramics, Firearms, Glassware, Lacquerware, Sculpture, Tapestry, Vases".split(", "),
+    "Visitors": [6425, 6910, 7525, 8060, 8880, 9500, 10425, 11150, 12200],
+    "Hero": "Criminal, Deep, Green, Max, Prism, Ultra, Wonderman, Xeno, Zephyr".split(", "),
+}
+
+
+def pool_groups(categories, size):
+    """ Groups of categories x size, taken from POOL, for a puzzle of that shape. """
+    if not 2 <= categories <= len(POOL) or not 2 <= size <= min(len(values) for values in POOL.values()):
+        raise ValueError(f"the pool has shapes up to {len(POOL)} categories of {len(POOL['Month'])} values")
+    return {group: values[:size] for group, values in list(POOL.items())[:categories]}
+
+
+class Generator:
+    def __init__(self, groups, seed=None):
+        if isinstance(groups, str):
+            groups = Puzzle.parse_groups(groups)
+        labels = [str(value).lower() for values in groups.values() for value in values]
+        if len(set(labels)) < len(labels) or not all(WORD.fullmatch(label) for label in labels):
+            raise ValueError("a clue names each value by its label, so labels must be single words or numbers, and "
+                             "no two alike")
+        self.groups = groups
+        self.names = list(groups)
+        self.size = len(groups[self.names[0]])
+        self.rng = random.Random(seed)
+        self.numeric = [not isinstance(groups[name][0], str) for name in self.names]
+        self.ordered = [g for g in range(len(self.names)) if g == 0 or self.numeric[g]]
+        self.stepped = [g for g in self.ordered if g == 0 or len({b - a for a, b in zip(groups[self.names[g]],
+                                                                                        groups[self.names[g]][1:])}) == 1]
+
+        # The skeleton, once.  A plain Solver, as the checks need assumptions and unsat cores.
+        self.puzzle = Puzzle(groups, ctx=Context())
+        self.solver = Solver(ctx=self.puzzle.ctx)
+        self.solver.add(self.puzzle.solver.assertions())
+        self.extractor = Extractor(self.puzzle.primary_consts, self.puzzle.helper_fn,
+                                   values=[self.puzzle.consts[name] for name in self.names[1:]])
+        self.compiled = dict()       # clue text -> z3 expression
+        self.selectors = dict()      # clue text -> its selector, for the puzzle in progress
+
+    # -- an answer is a table like Extractor.codes() gives:  row i holds the value index, in each group after
+    # the primary, of primary i.
+
+    def random_answer(self):
+        return np.array([self.rng.sample(range(self.size), self.size) for _ in self.names[1:]]).T
+
+    def where(self, table):
+        # where[g][v]:  the primary that goes with value v of group g.
+        found = [list(range(self.size))]
+        for column in table.T:
+            found.append(np.argsort(column).tolist())
+        return found
+
+    def attribute(self, table, entity, g):
+        # What Label.Group gives for entity in group g:  the number, else the 1-based position.
+        index = entity if g == 0 else int(table[entity, g - 1])
+        return self.groups[self.names[g]][index] if self.numeric[g] else index + 1
+
+    def text(self, label):
+        g, v = label
+        return str(self.groups[self.names[g]][v])
+
+    # -- clues.  A clue is a tuple of its kind and its labels, (group, value index) pairs, and numbers.
+
+    def holds(self, clue, table, where):
+        kind = clue[0]
+        entity = lambda label: where[label[0]][label[1]]
+        if kind == "same":
+            return entity(clue[1]) == entity(clue[2])
+        if kind == "differ":
+            return entity(clue[1]) != entity(clue[2])
+        if kind == "either":
+            a, b, c = (entity(label) for label in clue[1:])
+            return (a == b) != (a == c)
+        if kind == "pair":
+            a, b, x, y = (entity(label) for label in clue[1:])
+            return (a == x and b == y) != (a == y and b == x)
+        _, a, b, g, offset = clue
+        left, right = self.attribute(table, entity(a), g), self.attribute(table, entity(b), g)
+        return left == right + offset if kind == "offset" else left < right
+
+    def clue_text(self, clue):
+        kind, name = clue[0], self.text
+        if kind == "same":
+            return f"{name(clue[1])} == {name(clue[2])}"
+        if kind == "differ":
+            return f"{name(clue[1])} != {name(clue[2])}"
+        if kind == "either":
+            return f"{name(clue[1])} == ({name(clue[2])} or {name(clue[3])})"
+        if kind == "pair":
+            return f"({name(clue[1])}, {name(clue[2])}) == ({name(clue[3])}, {name(clue[4])})"
+        _, a, b, g, offset = clue
+        group = self.names[g]
+        if kind == "offset":
+            return f"{name(a)}.{group} == {name(b)}.{group} + {offset}"
+        return f"{name(a)}.{group} < {name(b)}.{group}"
+
+    def label_of(self, table, entity, g):
+        return g, entity if g == 0 else int(table[entity, g - 1])
+
+    def draw(self, table):
+        # A random clue that holds for the answer in table.
+        rng, groups = self.rng, range(len(self.names))
+        kind = rng.choices(list(CLUE_WEIGHTS), weights=list(CLUE_WEIGHTS.values()))[0]
+        if kind in ("offset", "before"):
+            choices = self.stepped if kind == "offset" else self.ordered
+            g = rng.choice(choices)
+            others = [h for h in groups if h != g]
+            a, b = rng.sample(range(self.size), 2)
+            left, right = self.attribute(table, a, g), self.attribute(table, b, g)
+            if left < right:
+                a, b, left, right = b, a, right, left
+            # a is the later one:  a.g == b.g + offset, or b.g < a.g.
+            later, earlier = self.label_of(table, a, rng.choice(others)), self.label_of(table, b, rng.choice(others))
+            if kind == "offset":
+                step = 1 if g == 0 else self.groups[self.names[g]][1] - self.groups[self.names[g]][0]
+                if left - right > MAX_OFFSET * step:
+                    return None
+                return "offset", later, earlier, g, left - right
+            return "before", earlier, later, g, 0
+        if kind in ("same", "differ", "either"):
+            ga, gb = rng.sample(groups, 2)
+            gc = rng.choice([h for h in groups if h != ga])
+            a = rng.randrange(self.size)
+            other = rng.choice([e for e in range(self.size) if e != a])
+            if kind == "same":
+                return "same", self.label_of(table, a, ga), self.label_of(table, a, gb)
+            if kind == "differ":
+                return "differ", self.label_of(table, a, ga), self.label_of(table, other, gb)
+            right = [self.label_of(table, a, gb), self.label_of(table, other, gc)]
+            rng.shuffle(right)
+            if right[0] == right[1]:
+                return None
+            return ("either", self.label_of(table, a, ga), *right)
+        # pair:  two entities, named once by groups ga and gb, and again by groups gx and gy, in either order.
+        sides = list(groups)
+        rng.shuffle(sides)
+        cut = rng.randrange(1, len(sides))
+        first, second = sides[:cut], sides[cut:]
+        a, b = rng.sample(range(self.size), 2)
+        x, y = (a, b) if rng.random() < 0.5 else (b, a)
+        labels = [self.label_of(table, e, rng.choice(side)) for e, side in ((a, first), (b, first), (x, second),
+                                                                              (y, second))]
+        if len(set(labels)) < 4:
+            return None
+        return ("pair", *labels)
+
+    def falsified(self, answer, answer_where, other):
+        # A random clue the answer passes and the other solution fails.
+        other_where = self.where(other)
+        for _ in range(DRAWS):
+            clue = self.draw(answer)
+            if clue is not None and not self.holds(clue, other, other_where):
+                assert self.holds(clue, answer, answer_where), clue
+                return clue
+        # Some cell differs, so saying what the answer has there is always a clue that fails the other solution.
+        entity, column = [(e, c) for e, c in zip(*np.nonzero(answer != other))][0]
+        return "same", (0, int(entity)), (int(column) + 1, int(answer[entity, column]))
+
+    def select(self, text):
+        # Assert `selector implies clue` for the puzzle in progress.
+        if text not in self.compiled:
+            self.compiled[text] = compile_clue(self.puzzle, text)
+        selector = Bool(f"clue_{len(self.selectors)}", self.puzzle.ctx)
+        self.solver.add(Implies(selector, self.compiled[text]))
+        self.selectors[text] = selector
+
+    def check(self, texts):
+        return instrument.check(self.solver, *[self.selectors[text] for text in texts], family="generator")
+
+    def generate(self, answer=None):
+        """
+        A puzzle with a unique solution.  Returns a Struct with groups, solution (rows of labels, as
+        print_solution() prints them), answer (the table of value indexes), clues (texts, in no particular order)
+        checks, drawn (clues added before minimizing) and seconds.
+        """
+        start = time.perf_counter()
+        answer = self.random_answer() if answer is None else np.asarray(answer)
+        answer_where = self.where(answer)
+        made = Struct()
+        made.checks, made.groups = 0, self.groups
+        self.selectors = dict()
+        self.solver.push()
+        try:
+            self.solver.add(self.extractor.blocking_clause(answer))
+            texts = []
+            while True:
+                made.checks += 1
+                if self.check(texts) == unsat:
+                    break
+                other = self.extractor.codes(self.solver.model())
+                text = self.clue_text(self.falsified(answer, answer_where, other))
+                self.select(text)
+                texts.append(text)
+            made.drawn = len(texts)
+
+            # Minimize:  only the clues in the core are needed, and of those, drop each the rest can do without.
+            core = {str(name) for name in self.solver.unsat_core()}
+            needed = [text for text in texts if str(self.selectors[text]) in core]
+            for text in list(needed):
+                if text not in needed:
+                    continue     # a smaller core already left it out
+                trial = [other for other in needed if other != text]
+                made.checks += 1
+                if self.check(trial) == unsat:
+                    core = {str(name) for name in self.solver.unsat_core()}
+                    needed = [other for other in trial if str(self.selectors[other]) in core]
+        finally:
+            self.solver.pop()
+
+        self.rng.shuffle(needed)
+        made.clues = needed
+        made.answer = answer
+        made.solution = [[str(self.groups[self.names[0]][i])] + [self.text((g + 1, int(v))) for g, v in enumerate(row)]
+                         for i, row in enumerate(answer)]
+        made.seconds = time.perf_counter() - start
+        return made
+
+    def record(self, made, id=None):
+        # The puzzle as a line of corpus.py's input.
+        return {"id": id, "categories": self.groups, "clues": made.clues}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate logic grid puzzles with a unique solution and a "
+                                                 "minimal set of clues, as JSON lines for corpus.py.")
+    parser.add_argument("-n", "--count", type=int, default=10, help="puzzles to make (default 10)")
+    parser.add_argument("--shape", default="4x5", help="categories x values, from the built in pool (default 4x5)")
+    parser.add_argument("--categories", help="category text, as Puzzle.from_text() takes, instead of --shape")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("-o", "--output", help="write here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.categories:
+        groups = Puzzle.parse_groups(args.categories)
+    else:
+        categories, size = (int(n) for n in args.shape.lower().split("x"))
+        groups = pool_groups(categories, size)
+    generator = Generator(groups, seed=args.seed)
+    out = open(args.output, "w") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        for i in range(args.count):
+            made = generator.generate()
+            out.write(json.dumps(generator.record(made, f"generated-{i + 1}")) + "\n")
+    finally:
+        if args.output:
+            out.close()
+    seconds = time.perf_counter() - start
+    print(f"{args.count} puzzles in {seconds:.1f}s, {args.count / seconds * 60:.0f} a minute", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    from logic_puzzles import CORAL_CITY_TEXT, is_unique
+
+    if sys.argv[1:]:
+        main()
+        sys.exit()
+
+    generator = Generator(CORAL_CITY_TEXT, seed=7)
+    made = generator.generate()
+    print(f"A Coral City puzzle, {len(made.clues)} clues ({made.drawn} before minimizing), {made.checks} checks, "
+          f"{made.seconds:.2f}s:")
+    for number, text in enumerate(made.clues, 1):
+        print(f"   {number:2}. {text}")
+    print("Its solution:")
+    for row in made.solution:
+        print("   " + ", ".join(row))
+
+    # Solved from scratch, the clues give that solution and no other, and none of them can go.
+    p = Puzzle.from_text(CORAL_CITY_TEXT, cache_dir=None, ctx=Context())
+    for text in made.clues:
+        p.clue(text)
+    print("Unique when solved from scratch:", is_unique(p.solver, p.primary_consts, p.helper_fn))
+
+    for shape in ((3, 4), (4, 5), (4, 7)):
+        generator = Generator(pool_groups(*shape), seed=1)
+        start = time.perf_counter()
+        made = [generator.generate() for _ in range(30)]
+        seconds = time.perf_counter() - start
+        print(f"{shape[0]} categories of {shape[1]}:  {len(made)} puzzles in {seconds:.2f}s, "
+              f"{len(made) / seconds * 60:.0f} a minute, {np.mean([len(m.clues) for m in made]):.1f} clues and "
+              f"{np.mean([m.checks for m in made]):.1f} checks each")
@@ -0,0 +1,320 @@
+"""
+See where the time goes inside a puzzle:  building terms, check(), or reading the answer.
+
+podcast_puzzle() and the Dave Cook puzzles build their terms, call check() and print the solution all in one
+function body, so timing the whole call cannot tell a slow encoding from slow solving.   benchmark.py finds out
+by swapping Solver for a timed subclass while it runs, which is fine for a benchmark and no way to run for
+real.  Here the puzzle code says where its phases are, and the hooks do nothing unless a sink is enabled:
+
+    enable(JsonlSink("events.jsonl"))          # or MemorySink(), or PUZZLE_EVENTS=events.jsonl in the environment
+    with puzzle("hero"):
+        with phase("build"):
+            p = build_hero_puzzle()
+        result = check(p.solver)               # instead of p.solver.check()
+
+    @instrumented("extract")                   # a decorator does the same as `with phase("extract"):`
+    def print_solution(m, ...):
+
+Each hook sends the sink one event, a dict that JSON can write:
+
+    phase    {"event": "phase", "phase": "build", "puzzle": "hero", "seconds": 0.021, ...}
+    check    the check's result, seconds, and what it added to Z3's statistics counters (conflicts, decisions,
+             ...), with the memory in use
+    clue     a clue's number, text, seconds to compile, and terms:  the distinct subterms of its expression
+    puzzle   at the end of puzzle(), the total seconds split three ways as benchmark.py splits them:  build up
+             to the first check, check summed over every check, extract for the rest
+
+Every event also has the time it started (time.time()), the process id, the thread's name, and the name and
+family of the puzzle it belongs to (metrics.py keeps its histograms by family).  The puzzle in progress is kept
+per thread, so runner.py's threads and processes each report under their own puzzle name.
+
+When no sink is enabled phase() hands back one shared do-nothing context manager, and check() and clue() return
+after one test, so the hooks can stay in the code.   Timing 200,000 empty phases on this machine, a disabled one
+took 0.7 microseconds, of which 0.5 is the `with` statement itself, and an enabled one 6 (into a MemorySink).
+"""
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+from z3 import is_app
+
+EVENTS_FILE = os.environ.get("PUZZLE_EVENTS")     # a JSONL file, to turn the hooks on in every process
+MEMORY_COUNTERS = {"memory", "max memory"}
+
+NO_PHASE = nullcontext()
+_sink = None
+_local = threading.local()     # .frames:  the puzzles in progress on this thread, innermost last
+
+
+class MemorySink:
+    # Keeps the events in a list.
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def of(self, kind):
+        return [event for event in self.events if event["event"] == kind]
+
+
+class JsonlSink:
+    # Appends each event to a file as one line of JSON.  Every line is written and flushed whole, so processes
+    # appending to the same file do not split each other's lines.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a")
+
+    def __call__(self, event):
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def enable(sink):
+    """ Send events to sink, any callable taking an event dict.  Returns the sink that was enabled before. """
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+def disable():
+    return enable(None)
+
+
+def enabled():
+    return _sink is not None
+
+
+def emit(kind, **fields):
+    if _sink is None:
+        return
+    frames = getattr(_local, "frames", None)
+    event = {"event": kind, "puzzle": frames[-1].name if frames else None,
+             "family": frames[-1].family if frames else None}
+    event.update(fields)
+    event["pid"] = os.getpid()
+    event["thread"] = threading.current_thread().name
+    _sink(event)
+
+
+class Frame:
+    # One puzzle in progress:  its times so far, for the puzzle event at the end.
+    def __init__(self, name, family):
+        self.name = name
+        self.family = family
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        self.first_check = None
+        self.check = 0.0
+        self.checks = 0
+
+
+def current_frame():
+    frames = getattr(_local, "frames", None)
+    return frames[-1] if frames else None
+
+
+class PuzzleScope:
+    # The context manager puzzle() returns.
+    def __init__(self, name, family, fields):
+        self.name = name
+        self.family = family
+        self.fields = fields
+
+    def __enter__(self):
+        if not hasattr(_local, "frames"):
+            _local.frames = []
+        self.frame = Frame(self.name, self.family)
+        _local.frames.append(self.frame)
+        return self.frame
+
+    def __exit__(self, *exc):
+        frame = self.frame
+        end = time.perf_counter()
+        first_check = frame.first_check if frame.first_check is not None else end
+        try:
+            emit("puzzle", start=frame.wall, seconds=end - frame.start, build=first_check - frame.start,
+                 check=frame.check, extract=end - first_check - frame.check, checks=frame.checks,
+                 error=None if exc[0] is None else repr(exc[1]), **self.fields)
+        finally:
+            _local.frames.pop()
+        return False
+
+
+def puzzle(name, family=None, **fields):
+    """
+    Context manager:  everything inside belongs to the puzzle name, of family (such as "logic_grid" or "sudoku",
+    as tuning.py names them).  Extra fields go in its event.
+    """
+    if _sink is None:
+        return NO_PHASE
+    return PuzzleScope(name, family, fields)
+
+
+class Phase:
+    # The context manager phase() returns.
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        emit("phase", phase=self.name, start=self.wall, seconds=time.perf_counter() - self.start, **self.fields)
+        return False
+
+
+def phase(name, **fields):
+    """ Context manager timing one phase of the puzzle in progress.  Extra fields go in its event. """
+    if _sink is None:
+        return NO_PHASE
+    return Phase(name, fields)
+
+
+def instrumented(name):
+    # Decorator:  every call of the function is a phase called name.
+    def decorate(fn):
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            if _sink is None:
+                return fn(*args, **kwargs)
+            with Phase(name, {"function": fn.__qualname__}):
+                return fn(*args, **kwargs)
+        return timed
+    return decorate
+
+
+def statistics(solver):
+    # The solver's numeric statistics as a dict.  Tactic solvers have fewer of them than Solver() does.
+    return {key: value for key, value in solver.statistics() if isinstance(value, (int, float))}
+
+
+def increments(solver):
+    # What the counters went up by since the last call on this solver.  Z3 keeps them for the life of a solver,
+    # so on a warm one (a Puzzle's, the Resolver's) the counters after each check are running totals.  The
+    # last ones seen are kept on the solver, as tuning.set_timeout() keeps the timeout.  Memory is a level, not
+    # a count, so it is left as it is, and so is a counter that went down (a solver that started afresh).
+    stats = statistics(solver)
+    seen = getattr(solver, "stats_seen", {})
+    solver.stats_seen = stats
+    return {key: value if key in MEMORY_COUNTERS or value < seen.get(key, 0) else value - seen.get(key, 0)
+            for key, value in stats.items()}
+
+
+def check(solver, *assumptions, family=None):
+    """
+    solver.check(*assumptions), sending a check event when enabled.  family, if given, is the family the check
+    is reported under, else it is the family of the puzzle in progress.  The event's stats are what this check
+    added to the solver's counters.
+    """
+    if _sink is None:
+        return solver.check(*assumptions)
+    wall = time.time()
+    start = time.perf_counter()
+    result = solver.check(*assumptions)
+    seconds = time.perf_counter() - start
+    frame = current_frame()
+    if frame is not None:
+        if frame.first_check is None:
+            frame.first_check = start
+        frame.check += seconds
+        frame.checks += 1
+    fields = dict(result=str(result), start=wall, seconds=seconds, assumptions=len(assumptions),
+                  stats=increments(solver))
+    if family is not None:
+        fields["family"] = family
+    emit("check", **fields)
+    return result
+
+
+def term_count(expr):
+    # The distinct subterms of expr, each shared subterm once, as Z3 stores them.
+    seen = set()
+    todo = [expr]
+    while todo:
+        term = todo.pop()
+        key = term.get_id()
+        if key in seen:
+            continue
+        seen.add(key)
+        if is_app(term):
+            todo.extend(term.children())
+    return len(seen)
+
+
+def clue(number, expr, text=None, seconds=None):
+    # A clue has been added.  Counting its terms walks the expression, so only when enabled.
+    if _sink is None:
+        return
+    emit("clue", number=number, text=text, seconds=seconds, terms=term_count(expr))
+
+
+def sum_stats(events):
+    # The statistics of check events added up, the memory counters taking their largest value.
+    total = dict()
+    for event in events:
+        for key, value in event.get("stats", {}).items():
+            if key in MEMORY_COUNTERS:
+                total[key] = max(total.get(key, 0), value)
+            else:
+                total[key] = total.get(key, 0) + value
+    return total
+
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if EVENTS_FILE:
+    enable(JsonlSink(EVENTS_FILE))
+
+
+if __name__ == "__main__":
+    import io
+    from contextlib import redirect_stdout
+
+    from z3 import Context
+
+    import instrument     # the module the puzzles report to, which is not this __main__ one
+    from dave_cook_tv_puzzle import television_puzzle
+    from logic_puzzles import coral_city_puzzle, hero_puzzle, podcast_puzzle
+
+    count = 200_000
+    for title in ("disabled", "enabled"):
+        if title == "enabled":
+            instrument.enable(instrument.MemorySink())
+        start = time.perf_counter()
+        for _ in range(count):
+            with instrument.phase("nothing"):
+                pass
+        print(f"An empty phase, {title}:  {(time.perf_counter() - start) / count * 1e6:.2f} microseconds")
+
+    sink = instrument.MemorySink()
+    instrument.enable(sink)
+    for fn in (podcast_puzzle, hero_puzzle, coral_city_puzzle, television_puzzle):
+        with instrument.puzzle(fn.__name__), redirect_stdout(io.StringIO()):
+            fn(ctx=Context())
+    instrument.disable()
+
+    print(f"\n{'puzzle':20} {'total':>8} {'build':>8} {'check':>8} {'extract':>8} {'checks':>6} {'conflicts':>9}")
+    for event in sink.of("puzzle"):
+        checks = [e for e in sink.of("check") if e["puzzle"] == event["puzzle"]]
+        print(f"{event['puzzle']:20} " + " ".join(f"{event[key]:8.4f}" for key in ("seconds", "build", "check",
+                                                                                     "extract")) +
+              f" {event['checks']:6} {instrument.sum_stats(checks).get('conflicts', 0):9g}")
+    print("\nThe biggest clues:")
+    for event in sorted(sink.of("clue"), key=lambda e: -e["terms"])[:5]:
+        print(f"   {event['puzzle']:20} clue {event['number']:>2}:  {event['terms']:4} terms")
@@ -1,6 +1,15 @@
 """ create puzzle from long description string """
+import hashlib
+import os
+import time
+
 from z3 import *
 
+import instrument
+from clues import compile_clue
+from extract import Extractor, Table, solution_codes
+from tuning import tuned_solver
+
 
 def rip(string, ripped):
     # rip('2,343', ',') -> '2343'
@@ -11,6 +20,12 @@ class Struct:    # an empty class, basically handy a dict that uses dot notation
     pass
 
 
+# Where Puzzle keeps compiled skeletons.  Bump CACHE_VERSION whenever Puzzle.compile() changes what it builds.
+CACHE_DIR = os.environ.get("PUZZLE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            ".puzzle_cache"))
+CACHE_VERSION = 1
+
+
 """
 This is the first logic puzzle I coded.  You will see functions made without helpers.   It takes me writing some
 code about three times before I can generalize it.  I'm following Dave Cook's logic for now.
@@ -26,21 +41,23 @@ currently has and what year it began.
 5. The show that began in 2010 has more downloads than the show that began in 2011.
 
 """
-def podcast_puzzle():
+def podcast_puzzle(ctx=None):
     print("\n====\nPodcast Puzzle\n\n====")
     p = Struct()
 
-    s = Solver()
+    s = Solver(ctx=ctx)
 
     # enum Hosts, with local labels in p struct
     host_names = "BobbyBora,DixieDean,EvaEstrada,FayeFender".split(",")
-    Host, host_consts = EnumSort("Host", host_names)
+    Host, host_consts = EnumSort("Host", host_names, ctx=ctx)
     p.Bobby, p.Dixie, p.Eva, p.Faye = host_consts
     # The problem with allowing both 'Host' and 'host' is trying to read code aloud.
     # Also, EnumSort names are global across solvers and there appears no way to delete or reuse a name.
+    # They are only global to a z3 Context, though.  Pass ctx=Context() and the puzzle can be built again,
+    # or built on another thread at the same time, since each Context has names of its own.
 
     # Years
-    year = Function("year", Host, IntSort())  # year_to_host()
+    year = Function("year", Host, IntSort(ctx))  # year_to_host()
     # While it is not documented:  It's Function(name, input_type, return_type)
     # So, this could be called host_to_year().
     s.add(Distinct([year(host) for host in host_consts]))
@@ -51,7 +68,7 @@ def podcast_puzzle():
                  year(host) == 2014))
 
     # Downloads, in millions
-    download = Function("download", Host, IntSort())  # host_to_download()
+    download = Function("download", Host, IntSort(ctx))  # host_to_download()
     s.add(Distinct([download(host) for host in host_consts]))
     for host in host_consts:
         s.add(Or(download(host) == 1,
@@ -86,8 +103,9 @@ def podcast_puzzle():
     s.add(download(host2010) > download(host2011))
 
     solver=s   # because I cut and paste and did not want to rename :)
-    # solver.check() means the engine should do its thing
-    if solver.check() == sat:
+    # solver.check() means the engine should do its thing.  instrument.check() is the same call, and also
+    # reports how long it took when instrument.py is switched on.
+    if instrument.check(solver) == sat:
         # If we find a solution, we can use the model to get the full grid
         m = solver.model()
         for host in host_consts:
@@ -100,11 +118,13 @@ def podcast_puzzle():
         for name in host_consts:
             expressions.append(download(name) != m.eval(download(name)))
             expressions.append(year(name) != m.eval(year(name)))
+        solver.push()   # so the blocking clause can be taken back out with pop()
         solver.add(Or(expressions))
-        if solver.check() == unsat:
+        if instrument.check(solver) == unsat:
             print("Solution is unique")
         else:
             print("Solution is not unique")
+        solver.pop()
     else:
         print("Contradiction!  No solution possible.")
 
@@ -129,20 +149,75 @@ p.clue("Kyrgyzstan.num == Jamica.num + 3")
 p.clue("February == (6910 or Firearms)")   # alternate reverse polic like "February 6910 Firearms or =="
 
 This work would some more coding, may need an eval() to run correctly, and would not add to my z3 understanding.
+
+Later:  clues.py parses the clue language properly, no eval() needed, and `Puzzle.clue()` uses it.
+See coral_city_text_puzzle() below for the whole puzzle written that way.
 """
 class Puzzle:
-    def __init__(self, group_dict):
-        self.labels = dict()
+    # The first group is the primary kind.  Every other group gets a make_func() pair to and from it,
+    # named like "month_to_visitor" and "visitor_to_month".
+    #
+    # Building those terms through the Python bindings is slow next to Z3 reading them back as text, so the
+    # compiled skeleton is saved as SMT-LIB2 (the output of `Solver.sexpr()`), under a hash of the
+    # normalized category text.   Later runs with the same categories parse that file with `from_string()`
+    # and only look up the sorts and functions by name.
+    #
+    # ctx is the z3 Context to build in.  EnumSort names are global to a context, so two puzzles that both
+    # have a "Month" group need different contexts; pass `Context()` for a fresh one.
+    #
+    # domains, from presolve.py, maps a group to the make_func() domains of its pair with the primary.
+    #
+    # template, from templates.py, copies the skeleton of any puzzle of the same shape instead of building it.
+    def __init__(self, group_dict, cache_dir=None, ctx=None, domains=None, template=None):
+        self.groups = group_dict
+        self.ctx = ctx
+        self.domains = domains or dict()
 
         # dictionary with keys being the labels for used in the puzzle, with a leading underscore.
         # The values are the z3 data reference types
         # This means `add(p._Mark == p._Baseball)` is something you might write.
+        self.labels = dict()
 
-        self.solver = Solver()
+        self.solver = tuned_solver("logic_grid", ctx)
+        self.primary = next(iter(group_dict))
+        self.kinds = dict()     # group name -> z3 sort
+        self.consts = dict()    # group name -> list of z3 values, in the order given
+        self.funcs = dict()     # group name -> (primary_to_group, group_to_primary), except for the primary
+
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = os.path.join(cache_dir, self.cache_key() + ".smt2")
+        with instrument.phase("build", how="skeleton"):
+            if template is not None and not self.domains:
+                template.load_into(self)
+            elif cache_file is not None and os.path.exists(cache_file):
+                with open(cache_file) as f:
+                    self.load(f.read())
+            else:
+                self.compile()
+                if cache_file is not None:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    with open(cache_file + ".tmp", "w") as f:
+                        f.write(self.solver.sexpr())
+                    os.replace(cache_file + ".tmp", cache_file)   # never leave half a file for another process
+
+        self.label_groups = dict()   # label -> the group it belongs to
+        for group, values in group_dict.items():
+            for value, const in zip(values, self.consts[group]):
+                self.labels[str(value)] = const
+                self.label_groups[str(value)] = group
+                setattr(self, "_" + str(value), const)
+        self.primary_consts = self.consts[self.primary]
+        self.helper_fn = [fn for fn, back_fn in self.funcs.values()]
+        self.clues = dict()          # clue number -> z3 expression, in the order added
 
     """ Create from a block of text, where the text block is just a dictionary, e.g., 'key1: value1, value2, value3 ; key2:....'"""
     @classmethod
-    def from_text(cls, text_block):
+    def from_text(cls, text_block, cache_dir=CACHE_DIR, ctx=None):
+        return cls(cls.parse_groups(text_block), cache_dir=cache_dir, ctx=ctx)
+
+    @staticmethod
+    def parse_groups(text_block):
         d = dict()
         groups = text_block.split(';')
         for key, value_block in [g.split(':') for g in groups]:
@@ -155,9 +230,101 @@ class Puzzle:
                 except ValueError:
                     values = raw_values
             d[key.strip()] = values
-        return cls(d)
-
-
+        return d
+
+    def clue(self, text, number=None):
+        # Compile a clue written in the clues.py language, e.g. p.clue("February == (6910 or Firearms)"),
+        # and add it to the solver.  Clues are numbered in order unless a number is given.
+        start = time.perf_counter()
+        expr = compile_clue(self, text)
+        if number is None:
+            number = len(self.clues) + 1
+        self.clues[number] = expr
+        self.solver.add(expr)
+        instrument.clue(number, expr, text, time.perf_counter() - start)
+        return expr
+
+    def entity(self, label):
+        # The member of the primary group that goes with label, e.g. exhibit_to_month(Firearms).
+        group = self.label_groups[label]
+        if group == self.primary:
+            return self.labels[label]
+        return self.funcs[group][1](self.labels[label])
+
+    def value(self, entity, group):
+        # The entity's value in group:  the number for a numeric group, else the 1-based position.
+        if group != self.primary:
+            entity = self.funcs[group][0](entity)
+        consts = self.consts[group]
+        if not is_int_value(consts[0]) and not is_rational_value(consts[0]):
+            return lookup(entity, consts, [IntVal(i + 1, self.ctx) for i in range(len(consts))])
+        return entity
+
+    def normalized_text(self):
+        # The category block with the spacing and line breaks taken out, so reformatting is still a cache hit.
+        return ";".join(f"{group}:{','.join(str(v) for v in values)}" for group, values in self.groups.items())
+
+    def cache_key(self):
+        text = f"{CACHE_VERSION}|{self.normalized_text()}|{sorted(self.domains.items())}"
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def func_names(self, group):
+        return f"{self.primary}_to_{group}".lower(), f"{group}_to_{self.primary}".lower()
+
+    def compile(self):
+        for group, values in self.groups.items():
+            if isinstance(values[0], str):
+                self.kinds[group], self.consts[group] = EnumSort(group, values, ctx=self.ctx)
+            else:
+                self.kinds[group] = IntSort(self.ctx) if isinstance(values[0], int) else RealSort(self.ctx)
+                self.consts[group] = [self.kinds[group].cast(v) for v in values]
+        primary_kind, primary_consts = self.kinds[self.primary], self.consts[self.primary]
+        for group in self.groups:
+            if group != self.primary:
+                name, back_name = self.func_names(group)
+                self.funcs[group] = make_func(self.solver, name, back_name, primary_kind, primary_consts,
+                                              self.kinds[group], self.consts[group],
+                                              domains=self.domains.get(group))
+
+    def load(self, smt2_text):
+        self.solver.from_string(smt2_text)
+        wanted = {name for group in self.groups if group != self.primary for name in self.func_names(group)}
+        decls = dict()
+        for assertion in self.solver.assertions():
+            if is_eq(assertion):
+                collect_functions(assertion, decls)
+                if wanted <= decls.keys():
+                    break
+        for group, values in self.groups.items():
+            if group == self.primary:
+                continue
+            name, back_name = self.func_names(group)
+            self.funcs[group] = decls[name], decls[back_name]
+            self.kinds[self.primary] = decls[name].domain(0)
+            self.kinds[group] = decls[name].range()
+        for group, values in self.groups.items():
+            kind = self.kinds.get(group)
+            if kind is None:    # a puzzle of just one group has no functions to find it by
+                self.compile()
+                return
+            if isinstance(values[0], str):
+                self.consts[group] = [kind.constructor(i)() for i in range(kind.num_constructors())]
+            else:
+                self.consts[group] = [kind.cast(v) for v in values]
+
+
+def collect_functions(expr, decls, depth=2):
+    # Fill decls with name -> FuncDecl for every uninterpreted function applied in the top `depth` levels
+    # of expr.  Puzzle.compile() asserts `back_fn(fn(con)) == con` for every pair, so two levels below
+    # the `==` finds them all without walking every term of the skeleton.
+    if not is_app(expr):
+        return
+    decl = expr.decl()
+    if decl.kind() == Z3_OP_UNINTERPRETED and decl.arity() > 0:
+        decls[decl.name()] = decl
+    if depth > 0:
+        for child in expr.children():
+            collect_functions(child, decls, depth - 1)
 
 
 # p = Puzzle.from_text("""
@@ -168,24 +335,96 @@ class Puzzle:
 
 """
 Create a Z3 EnumSort, and add the constants to struct"""
-def make_enum(p, kind_name, kind_values):
-    kind, kind_consts = EnumSort(kind_name, kind_values)
+def make_enum(p, kind_name, kind_values, ctx=None):
+    kind, kind_consts = EnumSort(kind_name, kind_values, ctx=ctx)
     for i in range(len(kind_values)):
         setattr(p, "_"+str(kind_values[i]), kind_consts[i])
     return kind, kind_consts
 
 # create functions to and from the primary puzzle enum.
-def make_func(solver, name, back_name, from_kind, from_consts, to_kind, to_values):
+# Whatever the encoding, fn(con) is an expression of to_kind and back_fn(val) one of from_kind, and both
+# accept expressions the solver has not decided yet, such as `hero_to_year(name_to_hero(p._Red))`.
+# domains, when given, lists for each of from_consts the indexes into to_values it may still go with, as
+# worked out by presolve.py; the encodings then leave the ruled out pairs out (or assert them false).
+def make_func(solver, name, back_name, from_kind, from_consts, to_kind, to_values, encoding="function",
+              domains=None):
+    if domains is None:
+        domains = [range(len(to_values))] * len(from_consts)
+    return ENCODINGS[encoding](solver, name, back_name, from_kind, from_consts, to_kind, to_values, domains)
+
+
+def function_encoding(solver, name, back_name, from_kind, from_consts, to_kind, to_values, domains):
+    # The original encoding:  a pair of uninterpreted functions, O(n^2) terms per pair of categories.
     fn = Function(name, from_kind, to_kind)
     solver.add(Distinct([fn(con) for con in from_consts]))
-    for con in from_consts:
-        solver.add(Or([(fn(con) == val) for val in to_values]))
+    for con, allowed in zip(from_consts, domains):
+        solver.add(Or([(fn(con) == to_values[j]) for j in allowed]))
     back_fn = Function(back_name, to_kind, from_kind)
     solver.add(*[back_fn(fn(con)) == con for con in from_consts])
     solver.add(*[fn(back_fn(val)) == val for val in to_values])  # added during debugging, may be superfluous
     return fn, back_fn
 
 
+def bool_encoding(solver, name, back_name, from_kind, from_consts, to_kind, to_values, domains):
+    # An assignment matrix:  is_match[i][j] is true when from_consts[i] goes with to_values[j].   Every row
+    # and every column has exactly one true cell.  This is the grid you would draw on paper for the puzzle.
+    to_values = [to_kind.cast(val) for val in to_values]
+    is_match = [[Bool(f"{name}_{i}_{j}", from_kind.ctx) for j in range(len(to_values))] for i in range(len(from_consts))]
+    for row in is_match:
+        solver.add(PbEq([(cell, 1) for cell in row], 1))
+    for column in zip(*is_match):
+        solver.add(PbEq([(cell, 1) for cell in column], 1))
+    for row, allowed in zip(is_match, domains):
+        solver.add(*[Not(cell) for j, cell in enumerate(row) if j not in allowed])
+    rows = [choose(row, to_values) for row in is_match]
+    columns = [choose(column, from_consts) for column in zip(*is_match)]
+    return (lambda con: lookup(con, from_consts, rows),
+            lambda val: lookup(val, to_values, columns))
+
+
+def int_encoding(solver, name, back_name, from_kind, from_consts, to_kind, to_values, domains):
+    # A permutation:  position[i] is the index into to_values of the value that goes with from_consts[i].
+    to_values = [to_kind.cast(val) for val in to_values]
+    position = [Int(f"{name}_{i}", from_kind.ctx) for i in range(len(from_consts))]
+    solver.add(*[And(0 <= pos, pos < len(to_values)) for pos in position])
+    solver.add(Distinct(position))
+    for pos, allowed in zip(position, domains):
+        solver.add(*[pos != j for j in range(len(to_values)) if j not in allowed])
+    rows = [choose([pos == j for j in range(len(to_values))], to_values) for pos in position]
+    columns = [choose([pos == j for pos in position], from_consts) for j in range(len(to_values))]
+    return (lambda con: lookup(con, from_consts, rows),
+            lambda val: lookup(val, to_values, columns))
+
+
+ENCODINGS = {"function": function_encoding, "bool": bool_encoding, "int": int_encoding}
+
+
+def choose(conditions, results):
+    # The result whose condition holds; the last condition is assumed when none of the others hold.
+    chain = results[-1]
+    for condition, result in zip(conditions[-2::-1], results[-2::-1]):
+        chain = If(condition, result, chain)
+    return chain
+
+
+def lookup(arg, keys, results):
+    # results[i] where arg is keys[i].  A known key (p._Red, or 2010) picks its result directly;
+    # anything else becomes an If chain for the solver.
+    if not is_expr(arg):
+        arg = keys[0].sort().cast(arg)
+    for key, result in zip(keys, results):
+        if arg.eq(key):
+            return result
+    return choose([arg == key for key in keys], results)
+
+
+def add_clue(p, number, expr):
+    # Add a clue to p.solver, and remember it under its number so diagnostics.py can name the clues at fault.
+    p.clues[number] = expr
+    p.solver.add(expr)
+    instrument.clue(number, expr)
+
+
 """
 I wrote this example second.  I finalized use the make_func() and make_enum() 
 helper functions making the code felt less repetitive.   I found it necessary, for
@@ -222,89 +461,103 @@ person to his superhero identity, and determine the year he started and the neig
 15. The superhero who patrols Frazier Park began 3 years before "Criminal Bane".
 16. Of "Green Avenger" and "Prism Shield", one patrols Tenth Avenue and the other is Peter Powers.
 """
-def hero_puzzle():
-    print("\n====\nHero Puzzle\n\n====")
-
-    s = Solver()
+def build_hero_puzzle(encoding="function", ctx=None):
+    # Returns the puzzle as a Struct:  the labels (p._Red, p._Deep, ...), the solver with every clue added,
+    # and the arguments solver_check() needs.  encoding picks how make_func() encodes each pair of categories.
+    # ctx is the z3 Context to build in, the global one by default.  Everything made from the sorts (functions,
+    # clues, the solver's terms) follows them into it.
+    s = Solver(ctx=ctx)
     p = Struct()
+    p.solver = s
+    p.clues = dict()     # clue number -> z3 expression, as Puzzle keeps them
 
     # The setup
     hero_values = "Criminal, Deep, Green, Max, Prism, Ultra, Wonderman".split(", ")
     name_values = "Arnold, Cal, Hal, Lyle, Ned, Peter, Red".split(", ")
     hood_values = "Apple, Frazier, Idyllwild, Libertyville, Mission, Summerland, Tenth".split(", ")
     year_values = 2007, 2008, 2009, 2010, 2011, 2012, 2013
-    Hero, hero_consts = make_enum(p, "hero", hero_values)
-    Name, name_consts = make_enum(p, "Name", name_values)
-    Hood, hood_consts = make_enum(p, "Hood", hood_values)
-    hero_to_name, name_to_hero = make_func(s, "hero_to_name", "name_to_hero", Hero, hero_consts, Name, name_consts)
-    hero_to_hood, hood_to_hero = make_func(s, "hero_to_hood", "hood_to_hero", Hero, hero_consts, Hood, hood_consts)
-    hero_to_year, year_to_hero = make_func(s, "hero_to_year", "year_to_hero", Hero, hero_consts, IntSort(), year_values)
+    Hero, hero_consts = make_enum(p, "hero", hero_values, ctx)
+    Name, name_consts = make_enum(p, "Name", name_values, ctx)
+    Hood, hood_consts = make_enum(p, "Hood", hood_values, ctx)
+    hero_to_name, name_to_hero = make_func(s, "hero_to_name", "name_to_hero", Hero, hero_consts, Name, name_consts, encoding=encoding)
+    hero_to_hood, hood_to_hero = make_func(s, "hero_to_hood", "hood_to_hero", Hero, hero_consts, Hood, hood_consts, encoding=encoding)
+    hero_to_year, year_to_hero = make_func(s, "hero_to_year", "year_to_hero", Hero, hero_consts, IntSort(ctx), year_values, encoding=encoding)
 
     # solver_check args
-    primary_consts = hero_consts
-    helper_fn = [hero_to_name, hero_to_hood, hero_to_year]
-    line = "The hero {:13} (aka {:7}) has patrolled {:>13} since {}"
+    p.primary_consts = hero_consts
+    p.helper_fn = [hero_to_name, hero_to_hood, hero_to_year]
+    p.line = "The hero {:13} (aka {:7}) has patrolled {:>13} since {}"
 
     # Clues.  Notice how reverse functions cut out temporary variables
     # 1. Red Reilly began 1 year before "Deep Shadow".
-    s.add(hero_to_year(name_to_hero(p._Red)) + 1 == hero_to_year(p._Deep))
+    add_clue(p, 1, hero_to_year(name_to_hero(p._Red)) + 1 == hero_to_year(p._Deep))
 
     # 2. The hero who patrols Idyllwild isn't Ned Nielsen.
-    s.add(hood_to_hero(p._Idyllwild) != name_to_hero(p._Ned))
+    add_clue(p, 2, hood_to_hero(p._Idyllwild) != name_to_hero(p._Ned))
 
     # 3. Arnold Ashley is either "Deep Shadow" or "Green Avenger".
-    s.add(Or(name_to_hero(p._Arnold) == p._Deep, name_to_hero(p._Arnold) == p._Green))
+    add_clue(p, 3, Or(name_to_hero(p._Arnold) == p._Deep, name_to_hero(p._Arnold) == p._Green))
     # In a future program, this could encode as `Or(Arnold == Deep, Arnold == Green)`
     # or even `Arnold == (Deep, Green)`
 
     # 4. The superhero who started in 2010, "Deep Shadow", the superhero who patrols Libertyville, the hero who
     # patrols Summerland and the person who patrols Tenth Avenue are all different people.
-    s.add(Distinct(year_to_hero(2010), p._Deep, hood_to_hero(p._Libertyville), hood_to_hero(p._Summerland), hood_to_hero(p._Tenth)))
+    add_clue(p, 4, Distinct(year_to_hero(2010), p._Deep, hood_to_hero(p._Libertyville), hood_to_hero(p._Summerland), hood_to_hero(p._Tenth)))
 
     # 5. "Wonderman" began sometime before Hal Houston.
-    s.add(hero_to_year(p._Wonderman) < hero_to_year(name_to_hero(p._Hal)))
+    add_clue(p, 5, hero_to_year(p._Wonderman) < hero_to_year(name_to_hero(p._Hal)))
 
     # 6. Of the superhero who patrols Frazier Park and the hero who started in 2007, one is Lyle Lucas and the other is "Wonderman".
-    s.add(Xor(And(hood_to_hero(p._Frazier) == name_to_hero(p._Lyle), year_to_hero(2007) == p._Wonderman),
+    add_clue(p, 6, Xor(And(hood_to_hero(p._Frazier) == name_to_hero(p._Lyle), year_to_hero(2007) == p._Wonderman),
               And(hood_to_hero(p._Frazier) == p._Wonderman, year_to_hero(2007) == name_to_hero(p._Lyle))))
 
     # 7. Red Reilly began sometime after the hero who patrols Mission Vale.
-    s.add(hero_to_year(name_to_hero(p._Red)) > hero_to_year(hood_to_hero(p._Mission)))
+    add_clue(p, 7, hero_to_year(name_to_hero(p._Red)) > hero_to_year(hood_to_hero(p._Mission)))
 
     # 8. The hero who started in 2009 is either Cal Copeland or Arnold Ashley.
-    s.add(Xor(year_to_hero(2009) == name_to_hero(p._Cal), year_to_hero(2009) == name_to_hero(p._Arnold)))
+    add_clue(p, 8, Xor(year_to_hero(2009) == name_to_hero(p._Cal), year_to_hero(2009) == name_to_hero(p._Arnold)))
 
     # 9. The person who patrols Mission Vale began 1 year before Lyle Lucas.
-    s.add(hero_to_year(hood_to_hero(p._Mission)) + 1 == hero_to_year(name_to_hero(p._Lyle)))
+    add_clue(p, 9, hero_to_year(hood_to_hero(p._Mission)) + 1 == hero_to_year(name_to_hero(p._Lyle)))
     # Mission.year + 1 == Lyle.year
 
     # 10. Neither the superhero who started in 2012 nor "Deep Shadow" is the hero who patrols Libertyville.
-    s.add(And(hood_to_hero(p._Libertyville) != year_to_hero(2012),
+    add_clue(p, 10, And(hood_to_hero(p._Libertyville) != year_to_hero(2012),
               hood_to_hero(p._Libertyville) != p._Deep))
 
     # 11. "Ultra Hex" is either the person who patrols Frazier Park or Ned Nielsen.
-    s.add(Xor(p._Ultra == hood_to_hero(p._Frazier), p._Ultra == name_to_hero(p._Ned)))
+    add_clue(p, 11, Xor(p._Ultra == hood_to_hero(p._Frazier), p._Ultra == name_to_hero(p._Ned)))
 
 
     # 12. "Prism Shield" doesn't patrol Idyllwild.
-    s.add(p._Prism != hood_to_hero(p._Idyllwild))
+    add_clue(p, 12, p._Prism != hood_to_hero(p._Idyllwild))
 
     # 13. The person who patrols Mission Vale isn't Ned Nielsen.
-    s.add(hood_to_hero(p._Mission) != name_to_hero(p._Ned))
+    add_clue(p, 13, hood_to_hero(p._Mission) != name_to_hero(p._Ned))
 
     # 14. Cal Copeland began sometime before "Max Fusion".
-    s.add(hero_to_year(name_to_hero(p._Cal)) < hero_to_year(p._Max))
+    add_clue(p, 14, hero_to_year(name_to_hero(p._Cal)) < hero_to_year(p._Max))
 
     # 15. The superhero who patrols Frazier Park began 3 years before "Criminal Bane".
-    s.add(hero_to_year(hood_to_hero(p._Frazier)) + 3 == hero_to_year(p._Criminal))
+    add_clue(p, 15, hero_to_year(hood_to_hero(p._Frazier)) + 3 == hero_to_year(p._Criminal))
 
     # 16. Of "Green Avenger" and "Prism Shield", one patrols Tenth Avenue and the other is Peter Powers.
-    s.add(Xor(And(p._Green == hood_to_hero(p._Tenth),
+    add_clue(p, 16, Xor(And(p._Green == hood_to_hero(p._Tenth),
                   p._Prism == name_to_hero(p._Peter)),
               And(p._Green == name_to_hero(p._Peter),
                   p._Prism == hood_to_hero(p._Tenth))))
 
-    solver_check(s, line, primary_consts, helper_fn)
+    return p
+
+
+def hero_puzzle(ctx=None):
+    print("\n====\nHero Puzzle\n\n====")
+    with instrument.phase("build"):
+        p = build_hero_puzzle(ctx=ctx)
+    solver_check(p.solver, p.line, p.primary_consts, p.helper_fn)
+    # The alternate shown above is only one of them.  Blocking only on the hero_to_* functions means two
+    # models that differ only in a helper like year_to_hero(2010) count as the same solution.
+    print("Number of solutions:", count_solutions(p.solver, p.primary_consts, p.helper_fn))
 
 
 """
@@ -346,93 +599,103 @@ and determine the total number of visitors it saw during its limited engagement.
 16. The presentation that pulled in 6,425 visitors wasn't from Kyrgyzstan.
 """
 
-def coral_city_puzzle():
-    print("\n====\nCoral City Puzzle\n\n====")
-
-    s = Solver()
+def build_coral_city_puzzle(encoding="function", ctx=None):
+    # Returns the puzzle as a Struct, like build_hero_puzzle().
+    s = Solver(ctx=ctx)
     p = Struct()
+    p.solver = s
+    p.clues = dict()     # clue number -> z3 expression, as Puzzle keeps them
     month_values = "January, February, March, April, May, June, July".split(", ")  # primary
     visitor_values = [6425, 6910, 7525, 8060, 8880, 9500, 10425]
     country_values = "Chile, Eritrea, Honduras, Iraq, Jamaica, Kyrgzstan, Norway".split(", ")
     exhibit_values = "Armor, Basketry, Ceramics, Firearms, Glassware, Lacquerware, Sculpture".split(", ")
 
-    Month, month_consts = make_enum(p, "Month", month_values)
+    Month, month_consts = make_enum(p, "Month", month_values, ctx)
 
-    Exhibit, exhibit_consts = make_enum(p, "Exhibit", exhibit_values)
-    Country, country_consts = make_enum(p, "Country", country_values)
-    month_to_visitors, visitors_to_month = make_func(s, "month_to_visitors", "visitors_to_month", Month, month_consts, IntSort(), visitor_values)
-    month_to_country, country_to_month= make_func(s, "month_to_country", "country_to_month", Month, month_consts, Country, country_consts)
-    month_to_exhibit, exhibit_to_month = make_func(s, "month_to_exhibit", "exhibit_to_country", Month, month_consts, Exhibit, exhibit_consts)
+    Exhibit, exhibit_consts = make_enum(p, "Exhibit", exhibit_values, ctx)
+    Country, country_consts = make_enum(p, "Country", country_values, ctx)
+    month_to_visitors, visitors_to_month = make_func(s, "month_to_visitors", "visitors_to_month", Month, month_consts, IntSort(ctx), visitor_values, encoding=encoding)
+    month_to_country, country_to_month= make_func(s, "month_to_country", "country_to_month", Month, month_consts, Country, country_consts, encoding=encoding)
+    month_to_exhibit, exhibit_to_month = make_func(s, "month_to_exhibit", "exhibit_to_country", Month, month_consts, Exhibit, exhibit_consts, encoding=encoding)
 
     # Month enums also need a numeric equivalent to do "before" or "1 month before"
-    month_to_number = Function("month_to_number", Month, IntSort())
+    month_to_number = Function("month_to_number", Month, IntSort(ctx))
     for i, month in enumerate(month_consts):
         s.add(month_to_number(month) == i+1)
 
     # solver_check args
-    primary_consts = month_consts
-    helper_fn = [month_to_visitors, month_to_country, month_to_exhibit]
-    line = "In month {:>9}, there were {:5} visitors to {}'s {} exhibit"
+    p.primary_consts = month_consts
+    p.helper_fn = [month_to_visitors, month_to_country, month_to_exhibit]
+    p.line = "In month {:>9}, there were {:5} visitors to {}'s {} exhibit"
 
     # Clues.  Coding this got long and repetitive.
     # 1. The presentation from Kyrgyzstan was held 3 months after the exhibit from Jamaica.
-    s.add(month_to_number(country_to_month(p._Kyrgzstan)) == month_to_number(country_to_month(p._Jamaica)) + 3)
+    add_clue(p, 1, month_to_number(country_to_month(p._Kyrgzstan)) == month_to_number(country_to_month(p._Jamaica)) + 3)
 
     # 2. February's exhibit is either the presentation that pulled in 6,910 visitors or the firearms presentation.
-    s.add(Xor(p._February == visitors_to_month(6910), p._February == exhibit_to_month(p._Firearms)))
+    add_clue(p, 2, Xor(p._February == visitors_to_month(6910), p._February == exhibit_to_month(p._Firearms)))
 
     # 3. The presentation that pulled in 8,880 visitors wasn't from Norway.
-    s.add(visitors_to_month(8880) != country_to_month(p._Norway))
+    add_clue(p, 3, visitors_to_month(8880) != country_to_month(p._Norway))
 
     # 4. Of the exhibit that pulled in 9,500 visitors and the glassware exhibit, one took place in June and the other was from Kyrgyzstan.
-    s.add(Xor(And(visitors_to_month(9500) == p._June, exhibit_to_month(p._Glassware) == country_to_month(p._Kyrgzstan)),
+    add_clue(p, 4, Xor(And(visitors_to_month(9500) == p._June, exhibit_to_month(p._Glassware) == country_to_month(p._Kyrgzstan)),
               And(visitors_to_month(9500) == country_to_month(p._Kyrgzstan), exhibit_to_month(p._Glassware) == p._June)))
 
     # 5. The armor exhibit was held 1 month after the presentation from Iraq.
-    s.add(month_to_number(exhibit_to_month(p._Armor)) == 1 + month_to_number(country_to_month(p._Iraq)))
+    add_clue(p, 5, month_to_number(exhibit_to_month(p._Armor)) == 1 + month_to_number(country_to_month(p._Iraq)))
 
     # 6. The basketry presentation saw 8,880 visitors.
-    s.add(visitors_to_month(8880) == exhibit_to_month(p._Basketry))
+    add_clue(p, 6, visitors_to_month(8880) == exhibit_to_month(p._Basketry))
 
     # 7. The presentation that pulled in 7,525 visitors was held sometime before the exhibit that pulled in 6,425 visitors.
-    s.add(month_to_number(visitors_to_month(7525)) < month_to_number(visitors_to_month(6425)))
+    add_clue(p, 7, month_to_number(visitors_to_month(7525)) < month_to_number(visitors_to_month(6425)))
 
     # 8. The lacquerware presentation is either the exhibit from Jamaica or the presentation from Iraq.
-    s.add(Xor(exhibit_to_month(p._Lacquerware) == country_to_month(p._Jamaica),
+    add_clue(p, 8, Xor(exhibit_to_month(p._Lacquerware) == country_to_month(p._Jamaica),
               exhibit_to_month(p._Lacquerware) == country_to_month(p._Iraq)))
 
     # 9. The exhibit that pulled in 8,060 visitors was held 1 month before the exhibit from Jamaica.
-    s.add(month_to_number(visitors_to_month(8060)) + 1 == month_to_number(country_to_month(p._Jamaica)))
+    add_clue(p, 9, month_to_number(visitors_to_month(8060)) + 1 == month_to_number(country_to_month(p._Jamaica)))
 
     # 10. The sculpture exhibit was held 2 months after the presentation that pulled in 8,060 visitors.
-    s.add(month_to_number(exhibit_to_month(p._Sculpture)) == 2 + month_to_number(visitors_to_month(8060)))
+    add_clue(p, 10, month_to_number(exhibit_to_month(p._Sculpture)) == 2 + month_to_number(visitors_to_month(8060)))
 
     # 11. The firearms exhibit was held 1 month after the presentation that pulled in 8,060 visitors.
-    s.add(month_to_number(exhibit_to_month(p._Firearms)) == 1 + month_to_number(visitors_to_month(8060)))
+    add_clue(p, 11, month_to_number(exhibit_to_month(p._Firearms)) == 1 + month_to_number(visitors_to_month(8060)))
 
     # 12. The presentation from Honduras was held sometime before the basketry exhibit.
-    s.add(month_to_number(country_to_month(p._Honduras)) < month_to_number(exhibit_to_month(p._Basketry)))
+    add_clue(p, 12, month_to_number(country_to_month(p._Honduras)) < month_to_number(exhibit_to_month(p._Basketry)))
 
     # 13. The lacquerware exhibit was held sometime after the sculpture presentation.
-    s.add(month_to_number(exhibit_to_month(p._Lacquerware)) > month_to_number(exhibit_to_month(p._Sculpture)))
+    add_clue(p, 13, month_to_number(exhibit_to_month(p._Lacquerware)) > month_to_number(exhibit_to_month(p._Sculpture)))
 
     # 14. April's exhibit wasn't from Iraq.
-    s.add(p._April != country_to_month(p._Iraq))
+    add_clue(p, 14, p._April != country_to_month(p._Iraq))
 
     # 15. The presentation that pulled in 7,525 visitors was from Chile.
-    s.add(visitors_to_month(7525) == country_to_month(p._Chile))
+    add_clue(p, 15, visitors_to_month(7525) == country_to_month(p._Chile))
 
     # 16. The presentation that pulled in 6,425 visitors wasn't from Kyrgyzstan.
-    s.add(visitors_to_month(6425) != country_to_month(p._Kyrgzstan))
+    add_clue(p, 16, visitors_to_month(6425) != country_to_month(p._Kyrgzstan))
+
+    return p
 
-    solver_check(s, line, primary_consts, helper_fn)
 
-    s.check()
+def coral_city_puzzle(ctx=None):
+    print("\n====\nCoral City Puzzle\n\n====")
+    with instrument.phase("build"):
+        p = build_coral_city_puzzle(ctx=ctx)
+    solver_check(p.solver, p.line, p.primary_consts, p.helper_fn)
+
+    s = p.solver
+    instrument.check(s)
     #
     # This is a sample of a bunch of debug I added to track down a problem.
     #
     # I identified where something went wrong, because I was running the program to see output between adding clues.
     # Still, figuring out why I was getting an answer that seemed to contradict the clue took some time.
+    # These days diagnose() in diagnostics.py names the clues at fault in a check or two, using the clue numbers.
     #
     # m=s.model()
     # print("So, is the month of basketry same as month of 8880?")
@@ -470,37 +733,106 @@ def coral_city_puzzle():
     pass
 
 
-def solver_check(solver, line, primary_consts, helper_fn):
-    # Run the solver, print the solution, check for uniqueness
+def solver_check(solver, line, primary_consts, helper_fn, portfolio=None):
+    # Run the solver, print the solution, check for uniqueness.
+    # The solver is left as it was found, so it can be checked again after adding or removing clues.
+    # portfolio=K races K differently configured solver processes on each check, see portfolio.py.
 
-    # solver.check() means the engine should do its thing
-    if solver.check() == sat:
+    # solver.check() means the engine should do its thing.  It answers sat, unsat, or unknown when it gives up
+    # (a timeout from tuning.py, say), and unknown proves nothing either way.
+    result, m = first_model(solver, primary_consts, helper_fn, portfolio)
+    if result == sat:
         # If we find a solution, we can use the model to get the full grid
-        m = solver.model()
-        for primary in primary_consts:
-            print(line.format(str(primary), *[str(m.eval(fn(primary))) for fn in helper_fn]))
-
-        # Eliminate this solution, then solve again to check if it is unique.
-        # that is, add the constraint to the solver that least of the functions would return a different
-        # value than the current solution.   I did not use the Z3 `push` and `pop` operators
-        # to safeguard the solver object from this new constraint.  Therefore, the function is not
-        # idempotent:  the new constraint disallows the found solution.
-        #
-        expressions = []
-        for primary in primary_consts:
-            for fn in helper_fn:
-                expressions.append(fn(primary) != m.eval(fn(primary)))
-        solver.add(Or(expressions))
-        if solver.check() == unsat:
+        extractor = Extractor(primary_consts, helper_fn)
+        print_solution(m, line, primary_consts, helper_fn, extractor)
+
+        result, alternate = alternate_solution(solver, primary_consts, helper_fn, m, portfolio)
+        if result == unsat:
             print("Solution is unique")
-        else:
+        elif result == sat:
             print("Solution is not unique")
             print("One alternate solution:")
-            m = solver.model()
-            for primary in primary_consts:
-                print(line.format(str(primary), *[str(m.eval(fn(primary))) for fn in helper_fn]))
-    else:
+            print_solution(alternate, line, primary_consts, helper_fn, extractor)
+        else:
+            print("Could not decide whether the solution is unique.")
+    elif result == unsat:
         print("Contradiction!  No solution possible.")
+    else:
+        print("Could not decide whether there is a solution.")
+
+
+@instrument.instrumented("extract")
+def print_solution(m, line, primary_consts, helper_fn, extractor=None):
+    # One line per primary.  The model is read through extract.py, one eval for the whole grid rather than one per
+    # cell.  Pass the same extractor to print several solutions of a puzzle, so its term is only built once.
+    if extractor is None:
+        extractor = Extractor(primary_consts, helper_fn)
+    for row in extractor.table(m).rows():
+        print(line.format(*row))
+
+
+def blocking_clause(m, primary_consts, helper_fn):
+    # "At least one of the functions returns a different value than it does in model m."
+    return Or([fn(primary) != m.eval(fn(primary)) for primary in primary_consts for fn in helper_fn])
+
+
+def first_model(solver, primary_consts, helper_fn, portfolio=None):
+    # (result, model):  the check's result, and a model when it is sat, else None.  With portfolio=K, K processes
+    # race for it, and the model only carries the values of helper_fn for each primary, which is all a solution is.
+    if portfolio:
+        from portfolio import race
+        raced = race(solver, [fn(primary) for primary in primary_consts for fn in helper_fn], k=portfolio)
+        return raced.status, raced.model
+    result = instrument.check(solver)
+    return result, solver.model() if result == sat else None
+
+
+def alternate_solution(solver, primary_consts, helper_fn, m, portfolio=None):
+    # Eliminate the solution in m, then solve again:  (sat, another solution), (unsat, None) when m is the only
+    # one, or (unknown, None) when the solver gave up.
+    # My first version added the blocking clause straight to the solver, which meant every later check
+    # also excluded m.   Here it only lives inside a push/pop scope, so the same solver can answer
+    # "solve", "is it unique" and "show an alternate" as often as needed without being rebuilt.
+    solver.push()
+    try:
+        solver.add(blocking_clause(m, primary_consts, helper_fn))
+        return first_model(solver, primary_consts, helper_fn, portfolio)
+    finally:
+        solver.pop()
+
+
+def is_unique(solver, primary_consts, helper_fn, m=None):
+    # True if the puzzle has exactly one solution, False if it has none or several, and None if the solver gave
+    # up before it could tell.  Pass m to skip re-solving when a model is at hand.
+    if m is None:
+        result, m = first_model(solver, primary_consts, helper_fn)
+        if result != sat:
+            return None if result == unknown else False
+    result, _ = alternate_solution(solver, primary_consts, helper_fn, m)
+    return None if result == unknown else result == unsat
+
+
+def all_solutions(solver, primary_consts, helper_fn, limit=None, timeout=None):
+    # Generator of every solution, one at a time, each as a list of rows:  row i holds the values of
+    # helper_fn for primary_consts[i].  This is the blocking clause idea from alternate_solution() in a loop.
+    #
+    # A solution is projected onto helper_fn:  only `fn(primary)` terms go in the blocking clauses, so
+    # models that differ only in other constants (host2012, year_to_hero(2010), ...) are not repeated.
+    # Stops after `limit` solutions.  Running out of `timeout` seconds first, or the solver giving up,
+    # raises extract.Incomplete after the solutions found so far, since they may not be all.  The blocking clauses
+    # live in a push/pop scope that is closed when the generator finishes or is thrown away, so do not use
+    # the solver for anything else while only part way through the solutions.
+    #
+    # Reading each model with m.eval() per cell, and building each blocking clause with Or(), came to most of
+    # the time for puzzles with many solutions.  extract.py reads a model with one eval, as a table of codes.
+    extractor = Extractor(primary_consts, helper_fn)
+    for codes in solution_codes(solver, extractor, limit, timeout):
+        yield Table(extractor, codes).values()
+
+
+def count_solutions(solver, primary_consts, helper_fn, limit=None, timeout=None):
+    # At most limit.  Raises extract.Incomplete, whose found is the count so far, rather than under-count.
+    return sum(1 for _ in all_solutions(solver, primary_consts, helper_fn, limit, timeout))
 
 
 """
@@ -521,7 +853,46 @@ I figured that I would end up doing a bunch of strings and use an evil `eval()`.
 so I didn't do it.
 """
 
+"""
+The Coral City puzzle again, written with Puzzle and the clue language from clues.py.
+"""
+CORAL_CITY_TEXT = """
+    Month: January, February, March, April, May, June, July;
+    Visitors:  6425, 6910, 7525, 8060, 8880, 9500, 10425;
+    Country:  Chile, Eritrea, Honduras, Iraq, Jamaica, Kyrgzstan, Norway;
+    Exhibit:  Armor, Basketry, Ceramics, Firearms, Glassware, Lacquerware, Sculpture"""
+
+CORAL_CITY_CLUES = [
+    "Kyrgzstan.Month == Jamaica.Month + 3",
+    "February == (6910 or Firearms)",
+    "8880 != Norway",
+    "(9500, Glassware) == (June, Kyrgzstan)",
+    "Armor.Month == Iraq.Month + 1",
+    "Basketry == 8880",
+    "7525.Month < 6425.Month",
+    "Lacquerware == (Jamaica or Iraq)",
+    "8060.Month + 1 == Jamaica.Month",
+    "Sculpture.Month == 8060.Month + 2",
+    "Firearms.Month == 8060.Month + 1",
+    "Honduras.Month < Basketry.Month",
+    "Lacquerware.Month > Sculpture.Month",
+    "April != Iraq",
+    "7525 == Chile",
+    "6425 != Ky",
+]
+
+
+def coral_city_text_puzzle():
+    print("\n====\nCoral City Puzzle, from text\n\n====")
+    p = Puzzle.from_text(CORAL_CITY_TEXT, ctx=Context())   # its own context, as coral_city_puzzle() has a Month
+    for text in CORAL_CITY_CLUES:
+        p.clue(text)
+    solver_check(p.solver, "In month {:>9}, there were {:5} visitors to {}'s {} exhibit", p.primary_consts,
+                 p.helper_fn)
+
+
 if __name__ == "__main__":
     podcast_puzzle()
     hero_puzzle()
     coral_city_puzzle()
+    coral_city_text_puzzle()
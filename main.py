@@ -1,8 +1,5 @@
 from z3 import *
-from z3_guide_code_samples import z3_guide_samples
-from dave_cook_poker_sample import poker_puzzle
-from dave_cook_skiing_puzzle import skiing_puzzle
-from dave_cook_tv_puzzle import television_puzzle
+from runner import register_main_puzzles, run_puzzles, print_results
 
 
 def z3_hello():
@@ -14,8 +11,7 @@ def z3_hello():
 
 if __name__ == '__main__':
     z3_hello()
-    z3_guide_samples()
-    poker_puzzle()
-    skiing_puzzle()
-    television_puzzle()
-
+    # z3_guide_samples(), poker_puzzle(), skiing_puzzle() and television_puzzle() each run in their own
+    # process, so they run at the same time and their EnumSort names cannot clash.
+    register_main_puzzles()
+    print_results(run_puzzles())
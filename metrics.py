@@ -0,0 +1,257 @@
+"""
+Keep Z3's effort per check as Prometheus histograms, one set per family of puzzle.
+
+section_solvers() of z3_guide_code_samples.py prints `s.statistics()` once and moves on.   Collected over every
+check, the same counters say how hard Z3 is working, and unlike seconds they do not depend on the machine:
+when a corpus of puzzles or an encoding changes and the conflicts per check go up tenfold, something should
+say so.   Every check made through the puzzle helpers goes through instrument.check(), which sends a check
+event with the counters.  A Collector is an instrument.py sink that adds each check to histograms of
+
+    z3_check_seconds          the time check() took
+    z3_check_conflicts        conflicts, from the SMT core or the SAT solver
+    z3_check_decisions        decisions, likewise
+    z3_check_propagations     propagations, the SAT solver's binary and n-ary ones added together
+    z3_check_memory_mb        memory in use, and
+    z3_check_max_memory_mb    the most Z3 had used, when the check finished
+
+with a `family` label (logic_grid, sudoku, queens, ..., else the puzzle's name), and counts the checks by
+result in z3_checks_total.   render() gives them in Prometheus' text format, which write_textfile() writes
+for node_exporter's textfile collector and serve() serves over HTTP at /metrics.
+
+    collector = install(textfile="/var/lib/node_exporter/z3.prom", port=9464)    # in the solving process
+
+Puzzles solved in worker processes (runner.py, corpus.py) report to the worker's collector, which no one
+scrapes.   For those, set PUZZLE_EVENTS=events.jsonl so every process appends its events to one file, and run
+
+    python metrics.py events.jsonl --textfile z3.prom --port 9464 --follow
+
+to keep the histograms from that file.
+"""
+import argparse
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import instrument
+
+COUNT_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+MEMORY_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 4096)
+
+# name -> (help text, buckets, the statistics it adds up).  "seconds" is the event's own timing.
+HISTOGRAMS = {
+    "z3_check_seconds": ("Seconds spent in check()", SECONDS_BUCKETS, ("seconds",)),
+    "z3_check_conflicts": ("Conflicts per check()", COUNT_BUCKETS, ("conflicts", "sat conflicts")),
+    "z3_check_decisions": ("Decisions per check()", COUNT_BUCKETS, ("decisions", "sat decisions")),
+    "z3_check_propagations": ("Propagations per check()", COUNT_BUCKETS,
+                              ("propagations", "sat propagations 2ary", "sat propagations nary")),
+    "z3_check_memory_mb": ("Megabytes Z3 had in use after check()", MEMORY_BUCKETS, ("memory",)),
+    "z3_check_max_memory_mb": ("Most megabytes Z3 had used by the end of check()", MEMORY_BUCKETS, ("max memory",)),
+}
+COPY = re.compile(r" #\d+$")    # runner.context_puzzles() numbers the copies of a puzzle
+
+
+class Histogram:
+    # One histogram for one family.  counts[i] is the observations in bucket i alone, not the running total.
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def family_of(event):
+    # The event's family, else the name of its puzzle, else "other".
+    if event.get("family"):
+        return event["family"]
+    if event.get("puzzle"):
+        return COPY.sub("", event["puzzle"])
+    return "other"
+
+
+class Collector:
+    # An instrument.py sink.  forward is the sink that was enabled before, which still gets every event.
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.lock = threading.Lock()
+        self.histograms = {name: dict() for name in HISTOGRAMS}     # name -> family -> Histogram
+        self.checks = dict()                                        # (family, result) -> count
+
+    def __call__(self, event):
+        if self.forward is not None:
+            self.forward(event)
+        if event["event"] == "check":
+            self.add(event)
+
+    def add(self, event):
+        family = family_of(event)
+        stats = dict(event.get("stats") or {}, seconds=event["seconds"])
+        with self.lock:
+            key = family, event["result"]
+            self.checks[key] = self.checks.get(key, 0) + 1
+            for name, (_, buckets, keys) in HISTOGRAMS.items():
+                found = [stats[k] for k in keys if k in stats]
+                if found:
+                    by_family = self.histograms[name]
+                    if family not in by_family:
+                        by_family[family] = Histogram(buckets)
+                    by_family[family].observe(sum(found))
+
+    def render(self):
+        """ The metrics in Prometheus' text exposition format. """
+        lines = ["# HELP z3_checks_total Calls of check(), by result",
+                 "# TYPE z3_checks_total counter"]
+        with self.lock:
+            for (family, result), count in sorted(self.checks.items()):
+                lines.append(f'z3_checks_total{{family="{label(family)}",result="{label(result)}"}} {count}')
+            for name, (help_text, buckets, _) in HISTOGRAMS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for family, histogram in sorted(self.histograms[name].items()):
+                    family = label(family)
+                    total = 0
+                    for bound, count in zip(list(buckets) + ["+Inf"], histogram.counts):
+                        total += count
+                        lines.append(f'{name}_bucket{{family="{family}",le="{bound}"}} {total}')
+                    lines.append(f'{name}_sum{{family="{family}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{family="{family}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        # node_exporter may read the file at any moment, so it only ever sees a whole one.
+        with open(path + ".tmp", "w") as f:
+            f.write(self.render())
+        os.replace(path + ".tmp", path)
+
+
+def serve(collector, port=9464, host="127.0.0.1"):
+    """ Serve collector's metrics at http://host:port/metrics from a daemon thread.  Returns the server. """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = collector.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):     # scrapes every few seconds would fill stderr
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_every(collector, path, interval):
+    # Rewrite the textfile every interval seconds, and once more when the process exits.
+    def loop():
+        while True:
+            time.sleep(interval)
+            collector.write_textfile(path)
+    threading.Thread(target=loop, daemon=True).start()
+    atexit.register(collector.write_textfile, path)
+
+
+def install(textfile=None, port=None, interval=15):
+    """
+    Collect the checks of this process, on top of any sink already enabled.  With textfile, write the metrics
+    there every interval seconds and at exit.  With port, serve them.  Returns the Collector.
+    """
+    collector = Collector()
+    collector.forward = instrument.enable(collector)
+    if textfile:
+        write_every(collector, textfile, interval)
+    if port:
+        serve(collector, port)
+    return collector
+
+
+def follow(collector, path, textfile=None, interval=1.0):
+    # Add the check events appended to path, for ever, rewriting textfile after each batch.
+    with open(path, "rb") as f:
+        while True:
+            lines = f.readlines()
+            for line in lines:
+                if line.endswith(b"\n"):
+                    collector(json.loads(line))
+                else:
+                    f.seek(-len(line), os.SEEK_CUR)     # half a line:  read it again once it is all there
+            if lines and textfile:
+                collector.write_textfile(textfile)
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export Z3 check() statistics from an event file as Prometheus "
+                                                 "metrics.")
+    parser.add_argument("events", help="a JSONL file written by instrument.py (PUZZLE_EVENTS)")
+    parser.add_argument("--textfile", help="write the metrics here, for node_exporter's textfile collector")
+    parser.add_argument("--port", type=int, help="serve the metrics at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--follow", action="store_true", help="keep reading events as they are appended")
+    args = parser.parse_args(argv)
+
+    collector = Collector()
+    if args.port:
+        serve(collector, args.port)
+    if args.follow:
+        follow(collector, args.events, args.textfile)
+    for event in instrument.read_events(args.events):
+        collector(event)
+    if args.textfile:
+        collector.write_textfile(args.textfile)
+    if not args.textfile and not args.port:
+        print(collector.render(), end="")
+
+
+if __name__ == "__main__":
+    import io
+    import sys
+    import urllib.request
+    from contextlib import redirect_stdout
+
+    from z3 import Context
+
+    if sys.argv[1:]:
+        main()
+        sys.exit()
+
+    from logic_puzzles import coral_city_puzzle, hero_puzzle
+    from queens import solve_queens
+    from sudoku import HARD_INSTANCE, solve_batch
+
+    import metrics     # the module instrument's sink belongs to, which is not this __main__ one
+
+    collector = metrics.install()
+    server = metrics.serve(collector, port=0)     # any free port
+    for fn in (hero_puzzle, coral_city_puzzle):
+        with instrument.puzzle(fn.__name__, family="logic_grid"), redirect_stdout(io.StringIO()):
+            fn(ctx=Context())
+    for n in (8, 16, 24):
+        solve_queens(n)
+    solve_batch([HARD_INSTANCE])
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+        text = response.read().decode()
+    server.shutdown()
+    print("\n".join(line for line in text.splitlines()
+                    if line.startswith(("z3_checks_total", "z3_check_conflicts_count", "z3_check_conflicts_sum",
+                                        "z3_check_seconds_sum"))))
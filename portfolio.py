@@ -0,0 +1,207 @@
+"""
+Race several differently configured solvers on one puzzle, and take whichever answers first.
+
+How long a check takes depends a lot on luck:  the random seed, which way the solver guesses a Bool first
+(its phase selection), and the tactics in front of it.   The guide's pairwise encoding of 40 queens, on one
+core, runs past 20 seconds with the default solver at every seed and phase setting in STRATEGIES, and solves
+in under 4 seconds with solve-eqs or ctx-simplify in front, or with the finite domain solver.   Nothing tells in advance which setting will
+be lucky, so run K of them at once and stop the rest when one finishes.   With K processes sharing the cores
+each runs slower, but the answer comes from the lucky one.  Racing the first four on that one core took 8.8s.
+
+    raced = race(p.solver, [fn(c) for fn in p.helper_fn for c in p.primary_consts], k=4)
+    raced.status, raced.model, raced.winner
+
+The assertions are written out as SMT-LIB once.  Each racer is a spawned process, so it has its own Z3 and can
+set global parameters (seeds, phase selection) without touching anyone else, and it parses the text and checks.
+The first sat or unsat wins and the others are terminated.   Models do not cross processes, so the winner
+sends back the values of the terms asked for (constants, enum constructors by index), and the parent pins
+those values in its own solver and checks once more, which is quick with everything decided, to get a real
+model in its own context.   solver_check() in logic_puzzles.py takes portfolio=K to work this way.
+
+Starting a process and importing z3 costs a few tenths of a second, so racing only pays for checks that
+take longer than that.
+"""
+import multiprocessing
+import queue
+import time
+from fractions import Fraction
+
+from z3 import (Z3_OP_UNINTERPRETED, BitVecVal, BoolVal, Const, IntVal, RealVal, Solver, is_bv_value, is_const,
+                is_false, is_int_value, is_rational_value, is_true, sat, set_param, unknown, unsat)
+from z3.z3util import get_vars
+
+from logic_puzzles import Struct
+from tuning import CONFIGS
+
+# (name, tuning.CONFIGS name, global parameters).  The first K are raced.  Phase selection 0 always guesses
+# false, 2 caches the last phase, 3 is Z3's default, and 5 guesses at random.
+STRATEGIES = [
+    ("default", "default", {}),
+    ("seed 1, random phase", "default", {"smt.random_seed": 1, "smt.phase_selection": 5}),
+    ("finite domain", "qffd", {"sat.random_seed": 2}),
+    ("solve-eqs first, seed 3", "smt-solve-eqs", {"smt.random_seed": 3}),
+    ("seed 4, phase caching", "default", {"smt.random_seed": 4, "smt.phase_selection": 2}),
+    ("seed 5, guess false", "default", {"smt.random_seed": 5, "smt.phase_selection": 0}),
+    ("context simplify, seed 6", "smt-ctx-simplify", {"smt.random_seed": 6, "smt.phase_selection": 5}),
+    ("seed 7, random phase", "default", {"smt.random_seed": 7, "smt.phase_selection": 5}),
+]
+RESULTS = {"sat": sat, "unsat": unsat, "unknown": unknown}
+TERM_PREFIX = "race_term_"
+
+
+def encode(value):
+    # A model value as plain Python, to send between processes.  None for anything else.
+    if is_true(value) or is_false(value):
+        return "bool", is_true(value)
+    if is_int_value(value):
+        return "int", value.as_long()
+    if is_rational_value(value):
+        return "real", str(value.as_fraction())
+    if is_bv_value(value):
+        return "bv", value.as_long()
+    sort = value.sort()
+    if hasattr(sort, "num_constructors") and value.num_args() == 0:
+        for i in range(sort.num_constructors()):
+            if sort.constructor(i) == value.decl():
+                return "constructor", i
+    return None
+
+
+def decode(encoded, sort):
+    kind, value = encoded
+    if kind == "bool":
+        return BoolVal(value, sort.ctx)
+    if kind == "int":
+        return IntVal(value, sort.ctx)
+    if kind == "real":
+        return RealVal(Fraction(value), sort.ctx)
+    if kind == "bv":
+        return BitVecVal(value, sort.size(), sort.ctx)
+    return sort.constructor(value)()
+
+
+def race_worker(index, text, names, strategy, timeout, results):
+    # Runs in a spawned process.  Puts (index, status, values, seconds) on results, values holding the encoded
+    # value of each named constant when sat.
+    start = time.perf_counter()
+    status, values = "unknown", None
+    try:
+        _, config, params = strategy
+        for name, value in params.items():
+            set_param(name, value)
+        s = CONFIGS[config](None)
+        if timeout:
+            s.set("timeout", int(timeout * 1000))
+        s.from_string(text)
+        status = str(s.check())
+        if status == "sat":
+            m = s.model()
+            decls = {d.name(): d for d in m.decls()}
+            values = [encode(m[decls[name]]) if name in decls else None for name in names]
+    except Exception:     # a pipeline that refuses the problem just drops out of the race
+        status = "unknown"
+    results.put((index, status, values, time.perf_counter() - start))
+
+
+def race_text(solver, terms):
+    # The solver's assertions as text, and a constant name for each term the racers report the value of.
+    # Constants go by their own names.  Anything else, like month_to_country(April), is named by a fresh
+    # constant equal to it.  (Not every constant:  an unbounded Int alias is enough to make QF_FD give up.)
+    s = Solver(ctx=solver.ctx)
+    s.add(solver.assertions())
+    names = []
+    for i, term in enumerate(terms):
+        if is_const(term) and term.decl().kind() == Z3_OP_UNINTERPRETED:
+            names.append(term.decl().name())
+        else:
+            names.append(f"{TERM_PREFIX}{i}")
+            s.add(Const(names[-1], term.sort()) == term)
+    return s.sexpr(), names
+
+
+def pinned_model(solver, terms, values):
+    # A model of solver in its own context, with each term fixed to its raced value.
+    solver.push()
+    try:
+        solver.add([term == decode(value, term.sort()) for term, value in zip(terms, values) if value is not None])
+        return solver.model() if solver.check() == sat else None
+    finally:
+        solver.pop()
+
+
+def race(solver, terms=None, k=4, timeout=None, strategies=STRATEGIES):
+    """
+    Check solver with the first k strategies at once.  terms are the expressions whose values the model
+    should carry over (default:  every constant in the assertions).  Returns a Struct with status (sat, unsat
+    or unknown), model (when sat, in the solver's own context), winner (the strategy's name), seconds, and reason:
+    why the status is unknown, when every racer gave up, timed out or died.
+    """
+    start = time.perf_counter()
+    if terms is None:
+        terms = sorted({v.get_id(): v for a in solver.assertions() for v in get_vars(a)}.values(), key=str)
+    text, names = race_text(solver, terms)
+    mp = multiprocessing.get_context("spawn")
+    results = mp.Queue()
+    racers = [mp.Process(target=race_worker, args=(i, text, names, strategy, timeout, results), daemon=True)
+              for i, strategy in enumerate(strategies[:k])]
+    for racer in racers:
+        racer.start()
+    raced = Struct()
+    raced.status, raced.model, raced.winner, raced.reason = unknown, None, None, "every racer gave up"
+    try:
+        finished = 0
+        while finished < len(racers):
+            try:
+                index, status, values, _ = results.get(timeout=1)
+            except queue.Empty:
+                if not any(racer.is_alive() for racer in racers) and results.empty():
+                    raced.reason = f"{len(racers) - finished} of {len(racers)} racers died without answering"
+                    break
+                continue
+            finished += 1
+            if status != "unknown":
+                raced.status, raced.winner, raced.reason = RESULTS[status], strategies[index][0], None
+                if status == "sat":
+                    raced.model = pinned_model(solver, terms, values)
+                    if raced.model is None:     # the values came back, but not a model of this solver
+                        raced.status, raced.reason = unknown, f"{raced.winner}'s model did not check here"
+                break
+    finally:
+        for racer in racers:
+            if racer.is_alive():
+                racer.terminate()
+        for racer in racers:
+            racer.join()
+    raced.seconds = time.perf_counter() - start
+    return raced
+
+
+if __name__ == "__main__":
+    from z3 import Context, Ints
+
+    from logic_puzzles import CORAL_CITY_CLUES, CORAL_CITY_TEXT, Puzzle, print_solution, solver_check
+
+    p = Puzzle.from_text(CORAL_CITY_TEXT, ctx=Context())
+    for text in CORAL_CITY_CLUES:
+        p.clue(text)
+    line = "In month {:>9}, there were {:5} visitors to {}'s {} exhibit"
+    terms = [fn(c) for c in p.primary_consts for fn in p.helper_fn]
+
+    # How much the seed alone matters, one strategy at a time.
+    for strategy in STRATEGIES[:4]:
+        raced = race(p.solver, terms, k=1, strategies=[strategy])
+        print(f"{strategy[0]:28} {raced.status}  {raced.seconds:.2f}s (including starting the process)")
+    raced = race(p.solver, terms, k=4)
+    print(f"Racing 4:  {raced.status} in {raced.seconds:.2f}s, won by {raced.winner}")
+    print_solution(raced.model, line, p.primary_consts, p.helper_fn)
+
+    print("\nsolver_check(..., portfolio=4):")
+    solver_check(p.solver, line, p.primary_consts, p.helper_fn, portfolio=4)
+
+    # A race no one finishes is unknown, which proves nothing:  not a contradiction.   The grid above can be
+    # solved inside any timeout short enough to show it, so race x^3 + y^3 == z^3, which none of them can.
+    x, y, z = Ints("x y z")
+    fermat = Solver()
+    fermat.add(x > 0, y > 0, z > 0, x * x * x + y * y * y == z * z * z)
+    raced = race(fermat, k=2, timeout=0.5)
+    print(f"\nRacing 2 on x^3 + y^3 == z^3 for half a second:  {raced.status}, {raced.reason}")
@@ -0,0 +1,274 @@
+"""
+Solve the easy part of a logic grid puzzle in plain Python before calling Z3.
+
+Most clues in these puzzles are the kind you cross off on the paper grid:  "the presentation that pulled in
+8,880 visitors wasn't from Norway", or "Lacquerware is either Jamaica or Iraq".   Grid keeps the paper grid:
+for every pair of groups, a row per value of the first group holding a bitmask of the values of the second
+group it could still go with.   Crossing off a cell, and the classic deductions that follow from it, run
+until nothing changes:
+
+    - a row with one candidate left is a match, so that candidate is crossed off every other row
+    - a value that is a candidate of only one row matches that row
+    - transitivity:  item i of A can only go with those values of C that some candidate of i in B goes with
+
+Clues the grid does not understand (anything with an offset or an ordering, like "Armor.Month ==
+Iraq.Month + 1") are left to Z3.   When every clue was understood and the grid is solved, the solution is
+unique and Z3 is not needed at all.   Otherwise what is left of the grid becomes the `domains` of each
+make_func() pair, so Z3 starts from far fewer possibilities.
+
+    p, grid = presolve_puzzle(CORAL_CITY_TEXT, CORAL_CITY_CLUES)
+"""
+from clues import ClueError, find, parse_clue
+from logic_puzzles import CACHE_DIR, Puzzle
+
+
+class Contradiction(Exception):
+    pass
+
+
+def single(mask):
+    # Whether mask has exactly one candidate left (the bit trick test).  An empty row cannot be reached without
+    # eliminate() raising, but 0 passes the bit trick too, so say so rather than read it as a match for item -1.
+    if not mask:
+        raise Contradiction("an empty row in the grid")
+    return mask & (mask - 1) == 0
+
+
+class Grid:
+    def __init__(self, groups):
+        # groups is a dict of group name to list of values, as Puzzle takes.  All groups are the same size.
+        self.groups = groups
+        self.names = list(groups)
+        self.size = len(groups[self.names[0]])
+        self.where = dict()     # label -> (group, index)
+        for group, values in groups.items():
+            if len(values) != self.size:
+                raise ValueError(f"group {group} has {len(values)} values, not {self.size}")
+            for index, value in enumerate(values):
+                self.where[str(value)] = group, index
+        full = (1 << self.size) - 1
+        self.candidates = {(a, b): [full] * self.size for a in self.names for b in self.names if a != b}
+        self.understood = True   # False once any clue is left for Z3
+        self.changed = False
+
+    # -- the grid itself
+
+    def eliminate(self, a, i, b, j):
+        # Cross off "item i of a goes with item j of b", in both directions.
+        if a == b:
+            if i == j:
+                raise Contradiction(f"{self.groups[a][i]} cannot differ from itself")
+            return
+        row, reverse = self.candidates[a, b], self.candidates[b, a]
+        if row[i] & (1 << j):
+            row[i] &= ~(1 << j)
+            reverse[j] &= ~(1 << i)
+            self.changed = True
+            if not row[i]:
+                raise Contradiction(f"nothing left for {self.groups[a][i]} in {b}")
+            if not reverse[j]:
+                raise Contradiction(f"nothing left for {self.groups[b][j]} in {a}")
+
+    def match(self, a, i, b, j):
+        if a == b:
+            if i != j:
+                raise Contradiction(f"{self.groups[a][i]} and {self.groups[a][j]} cannot be the same")
+            return
+        for other in range(self.size):
+            if other != j:
+                self.eliminate(a, i, b, other)
+            if other != i:
+                self.eliminate(a, other, b, j)
+
+    def restrict(self, a, i, b, allowed):
+        # Item i of a goes with one of the indexes in allowed.
+        for j in range(self.size):
+            if j not in allowed:
+                self.eliminate(a, i, b, j)
+
+    def propagate(self):
+        # Run the deductions to a fixpoint.  Raises Contradiction if the clues cannot all hold.
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            for (a, b), row in self.candidates.items():
+                for i, mask in enumerate(row):
+                    if single(mask):
+                        j = mask.bit_length() - 1
+                        for other in range(self.size):
+                            if other != i:
+                                self.eliminate(a, other, b, j)
+                for j in range(self.size):
+                    rows = [i for i, mask in enumerate(row) if mask & (1 << j)]
+                    if len(rows) == 1:
+                        self.match(a, rows[0], b, j)
+            for a in self.names:
+                for b in self.names:
+                    for c in self.names:
+                        if len({a, b, c}) == 3:
+                            self.transitive(a, b, c)
+
+    def transitive(self, a, b, c):
+        a_b, b_c = self.candidates[a, b], self.candidates[b, c]
+        for i, mask in enumerate(a_b):
+            reachable = 0
+            j = 0
+            while mask:
+                if mask & 1:
+                    reachable |= b_c[j]
+                mask >>= 1
+                j += 1
+            for k in range(self.size):
+                if not reachable & (1 << k):
+                    self.eliminate(a, i, c, k)
+
+    def solved(self):
+        return all(single(mask) for row in self.candidates.values() for mask in row)
+
+    def solution(self):
+        # {primary value: {group: value}}, like corpus.py reports, once solved.
+        primary = self.names[0]
+        if not self.solved():
+            raise ValueError("the grid is not solved")
+        return {str(self.groups[primary][i]): {b: str(self.groups[b][self.candidates[primary, b][i].bit_length() - 1])
+                                               for b in self.names[1:]}
+                for i in range(self.size)}
+
+    def domains(self):
+        # What is left of each primary pair, in the form Puzzle (and so make_func) takes.
+        primary = self.names[0]
+        return {b: [[j for j in range(self.size) if mask & (1 << j)] for mask in self.candidates[primary, b]]
+                for b in self.names[1:]}
+
+    # -- reading clues
+
+    def add_clue(self, text):
+        # Cross off what the clue says, if it is a kind of clue the grid understands.  Returns whether it was.
+        try:
+            understood = self.read(parse_clue(text))
+        except ClueError:
+            understood = False
+        if not understood:
+            self.understood = False
+        return understood
+
+    def label(self, node):
+        # (group, index) for a plain label node, else None.
+        if node[0] != "label":
+            return None
+        text = node[1]
+        if text[0].isdigit():
+            text = str(float(text) if "." in text else int(text))
+            return self.where.get(text)
+        return self.where[find(text, self.where, "label")]
+
+    def labels(self, nodes):
+        found = [self.label(node) for node in nodes]
+        return None if None in found else found
+
+    def read(self, node):
+        tag = node[0]
+        if tag == "and":
+            return all([self.read(part) for part in node[1]])
+        if tag == "distinct":
+            found = self.labels(node[1])
+            if found is None:
+                return False
+            for x, (a, i) in enumerate(found):
+                for b, j in found[x + 1:]:
+                    self.eliminate(a, i, b, j)
+            return True
+        if tag != "compare" or node[1] not in ("==", "!="):
+            return False
+        op, left, right = node[1:]
+        if left[0] in ("or", "tuple"):
+            left, right = right, left
+        a = self.label(left)
+        if right[0] == "tuple" and left[0] == "tuple" and op == "==":
+            return self.read_pairs(self.labels(left[1]), self.labels(right[1]))
+        if a is None:
+            return False
+        if right[0] == "or":
+            options = self.labels(right[1])
+            if options is None:
+                return False
+            if op == "!=":                          # neither
+                for b, j in options:
+                    self.eliminate(*a, b, j)
+                return True
+            if len(options) == 2:                   # either:  exactly one of two
+                return self.read_either(a, *options)
+            return False
+        b = self.label(right)
+        if b is None:
+            return False
+        if op == "==":
+            self.match(*a, *b)
+        else:
+            self.eliminate(*a, *b)
+        return True
+
+    def read_either(self, a, x, y):
+        # "a is either x or y":  x and y are different entities, and a is one of them.  Returns whether the grid
+        # holds all of that.  With a, x and y in three different groups it only holds that x and y differ:  "a1
+        # is b1 or else c1" ties three groups together, which no pair of groups can say, so Z3 must have the clue.
+        self.eliminate(*x, *y)
+        if x == a:
+            self.eliminate(*a, *y)
+        elif y == a:
+            self.eliminate(*a, *x)
+        elif x[0] == a[0]:
+            self.match(*a, *y)
+        elif y[0] == a[0]:
+            self.match(*a, *x)
+        elif x[0] == y[0]:
+            self.restrict(*a, x[0], {x[1], y[1]})
+        else:
+            return False
+        return True
+
+    def read_pairs(self, left, right):
+        # "Of A and B, one is X and the other is Y"
+        if left is None or right is None or len(left) != 2 or len(right) != 2:
+            return False
+        self.eliminate(*left[0], *left[1])
+        self.eliminate(*right[0], *right[1])
+        return all([self.read_either(a, *right) for a in left] + [self.read_either(x, *left) for x in right])
+
+
+def presolve(groups, clue_texts):
+    """
+    Fill in a Grid from the clues.  If grid.understood and grid.solved(), grid.solution() is the unique
+    answer and Z3 is not needed.  Raises Contradiction if the clues cannot all hold.
+    """
+    grid = Grid(groups)
+    for text in clue_texts:
+        grid.add_clue(text)
+    grid.propagate()
+    return grid
+
+
+def presolve_puzzle(categories, clue_texts, ctx=None, cache_dir=CACHE_DIR):
+    # Build a Puzzle (from text or a dict of groups) with its domains cut down by the grid, and add the
+    # clues.  Returns (puzzle, grid).
+    if isinstance(categories, str):
+        groups = Puzzle.parse_groups(categories)
+    else:
+        groups = categories
+    grid = presolve(groups, clue_texts)
+    p = Puzzle(groups, cache_dir=cache_dir, ctx=ctx, domains=grid.domains())
+    for number, text in enumerate(clue_texts, 1):
+        p.clue(text, number)
+    return p, grid
+
+
+if __name__ == "__main__":
+    from z3 import Context
+    from logic_puzzles import CORAL_CITY_CLUES, CORAL_CITY_TEXT, solver_check
+
+    p, grid = presolve_puzzle(CORAL_CITY_TEXT, CORAL_CITY_CLUES, ctx=Context())
+    left = sum(bin(mask).count("1") for row in grid.candidates.values() for mask in row)
+    print(f"Coral City:  grid understood every clue: {grid.understood}, solved: {grid.solved()}, "
+          f"{left} candidates left of {len(grid.candidates) * grid.size ** 2}")
+    solver_check(p.solver, "In month {:>9}, there were {:5} visitors to {}'s {} exhibit", p.primary_consts,
+                 p.helper_fn)
@@ -1,9 +1,30 @@
+import random
+from functools import lru_cache
+from itertools import groupby
+
 from z3 import *
 
+import instrument
+
 """
 This was an attempt at the pix-a-pix colored puzzles.  I finally gave up from too
 many instabilities in z3.  Lots of "sometimes eval returns a string of the variable name
-but sometimes it returns a value" or "I think a segfault seems good right now".   
+but sometimes it returns a value" or "I think a segfault seems good right now".
+
+Second attempt, which works.  The first modeled each block with an Int start and tested every
+cell against every start with And/Or/Xor, calling check() after each cell.   That hands Z3 the
+whole search, in the theory it is worst at.   Instead, this does what people do with pencil:
+one line at a time.
+
+A line is a row or column with its clue, and the colors each cell could still be.  A small
+dynamic program finds every way to place the clue's blocks that agrees with what is known, and
+keeps only the colors some placement gives each cell (and the starts each block could have).
+Crossing lines share cells, so line solving runs until nothing changes.   Many puzzles are
+solved by then.   If not, Z3 gets a Bool for each start a block could still have and a Bool for
+each cell and color, covering only the choices still open.
+
+Lines with the same clue and the same known cells get the same answer, so line solving is
+memoized, which matters in the repeated passes and in puzzles with repeated lines.
 """
 """
 First puzzle:
@@ -13,136 +34,236 @@ First puzzle:
 """
 
 
-def mushroom_puzzle():
-    def show(title):
-        if solver.check() == unsat:
-            print(f"{title}:  No solution found, contradiction.")
-        else:
-            print(f"{title}:  Solution found.")
-            m = solver.model()
-            print("Current starts:")
-            for s in starts:
-                print(f"   {s}: {m.eval(s)}")
-            for row in range(num_rows):
-                for col in range(num_cols):
-                    g = grid[row][col]
-                    print(f" Grid {row}, {col}, variable {g}, value {m.eval(g)}")
-                    g.sort()
-                    print(f" {grid[row][col]}={m.eval(grid[row][col])}={m.eval(g)}")
-                    pass
-            print("\n\n\n\n")
-            # print board
-            max_clues = 8
-            clue_width = 3
-            indent = max_clues * clue_width + 2
+def parse_clues(raw_clues, color_codes):
+    # "2R,1G;3R" -> [[(2, 1), (1, 2)], [(3, 1)]], as (length, color index) tuples.  Color 0 is blank, and a
+    # line with no blocks is written as an empty clue, e.g. "3R;;1G".
+    return [tuple((int(code[:-1]), color_codes.index(code[-1])) for code in block.split(',') if code)
+            for block in raw_clues.split(';')]
 
-    # Puzzle definition; what makes the mushroom puzzle is its codes and colors
-    raw_row_clues = "3R;5R;5R;1B;5G"
-    raw_col_clues = "2R,1G;3R,1G;3R,1B,1G;3R,1G;2R,1G"
-    color_codes = ".RGB"
 
+@lru_cache(maxsize=None)
+def solve_line(clue, cells):
+    """
+    clue is a tuple of (length, color) blocks; cells a tuple of bitmasks, bit c set if the cell could be color c
+    (bit 0 for blank).  Returns (cells, starts) narrowed to what some placement of the blocks allows, where
+    starts[k] is the tuple of starts block k could have, or None if no placement fits.
+    """
+    size, count = len(cells), len(clue)
+    # blank_until[p]:  the first cell at or after p that cannot be blank.
+    blank_until = [size] * (size + 1)
+    for i in range(size - 1, -1, -1):
+        blank_until[i] = blank_until[i + 1] if cells[i] & 1 else i
+    # run[c][s]:  how many cells from s on could be color c.
+    run = dict()
+    for _, color in clue:
+        if color not in run:
+            counts = [0] * (size + 1)
+            for i in range(size - 1, -1, -1):
+                counts[i] = counts[i + 1] + 1 if cells[i] >> color & 1 else 0
+            run[color] = counts
+    # Two blocks of the same color need a blank between them.
+    gaps = [1 if k + 1 < count and clue[k + 1][1] == clue[k][1] else 0 for k in range(count)]
 
-    row_clues = [[(int(code[:-1]), color_codes.find(code[-1]))
-                   for code in block.split(',')]
-                  for block in raw_row_clues.split(';')]
-    col_clues = [[(int(code[:-1]), color_codes.find(code[-1]))
-                   for code in block.split(',')]
-                  for block in raw_col_clues.split(';')]
-    num_rows, num_cols, num_colors = len(row_clues), len(col_clues), len(color_codes)
+    # Backward:  fits[k][p] is whether blocks k and up can be placed in cells p and up, blanks before each.
+    # place[k][s] is whether block k can start at s and still leave room for the rest.
+    fits = [None] * (count + 1)
+    place = [None] * count
+    fits[count] = [blank_until[p] == size for p in range(size + 1)]
+    for k in range(count - 1, -1, -1):
+        length, color = clue[k]
+        gap, after = gaps[k], fits[k + 1]
+        place[k] = [s + length + gap <= size and run[color][s] >= length and
+                    (not gap or cells[s + length] & 1) and after[s + length + gap]
+                    for s in range(size + 1)]
+        fits[k] = [False] * (size + 1)
+        fits[k][size] = place[k][size]
+        for p in range(size - 1, -1, -1):
+            fits[k][p] = place[k][p] or (cells[p] & 1 and fits[k][p + 1])
+    if not fits[0][0]:
+        return None
 
-    solver = Solver()
+    # Forward:  reached[p] is whether the blocks before block k can be placed, gap included, ending at p.  A
+    # start s is real if it fits and some reached p before it has blank cells up to s;  the latest such p is
+    # the best bet.  A cell can be blank if it is between a reached p and a placement of the rest.
+    # Colors are marked as ranges in difference arrays, so each placement costs the same however long.
+    narrowed = [0] * size
+    diffs = dict()
+    starts = []
+    reached = [False] * (size + 1)
+    reached[0] = True
+    for k in range(count + 1):
+        latest = -1
+        next_reached = [False] * (size + 1)
+        found = []
+        for s in range(size + 1):
+            if reached[s]:
+                latest = s
+            if latest < 0 or blank_until[latest] < s:
+                continue
+            if s < size and fits[k][s + 1] and blank_until[latest] > s:
+                narrowed[s] |= 1
+            if k < count and place[k][s]:
+                length, color = clue[k]
+                found.append(s)
+                diff = diffs.setdefault(color, [0] * (size + 1))
+                diff[s] += 1
+                diff[s + length] -= 1
+                if gaps[k]:
+                    narrowed[s + length] |= 1
+                next_reached[s + length + gaps[k]] = True
+        if k < count:
+            starts.append(tuple(found))
+        reached = next_reached
+
+    for color, diff in diffs.items():
+        total, bit = 0, 1 << color
+        for i in range(size):
+            total += diff[i]
+            if total:
+                narrowed[i] |= bit
+    return tuple(narrowed), tuple(starts)
 
-    # z3 has some interesting theories about arrays, which is not useful for this
-    # project.  At least, I could not get useful information from the documentation.
-    #
-    # I happened across the IntVector sort, which turns out to be a simple Python routine
-    # for naming independent Const variables.  It does not allow me to use a list subscript
-    # that is an expression, e.g., "my_list[my_z3_const_intSort]".  So that didn't work.
-    #
-    # If I invert the puzzle a bit, each non-blank cell is both in a horizontal block of cells
-    # defined by a row clue's position and a vertical block defined by a row clue's position.
-    # The only set of starting indexes of these blocks that work is the final solution.
-    #
-    # Fun fact, every z3 Const must have a unique name and type combination.  Reusing the same name returns
-    # the previous Const.   That is, two calls to "Const('a_const', IntSort())" return the same reference.
-    #
-    # Current Data Structures
-    # * row_clues and col_clues are tuples of the number of blocks followed by the color index for each clue.
-    #   clues are stored as an list of lists.  For example, if raw_col_clues starts with "2R,1G;" then col_clues[0]
-    #   (clues for the first column) will be [(2 {blocks}, 1 {color index of R}, (1,2)].  These are not z3 consts.
-    #
-    # * starts is a list of the starting indexes (IntSort) of each clue's block of colored cells,
-    #   for one   They are named "clue_{row|col}_{#}_clue_{#}", e.g., "clue_col_0_clue_0" or
-    #   "clue_col_1_clue_1".  The Python variable starts is a list reused for each line.
-    #
-    # * grid[rows][cols] is a matrix of squares, each an IntSort() resolving having the color code of the square.
-    #   The color code 0 means blank, and the codes are the index into color_codes.
-    #   Each square is named as "grid_row_{#}_col_{#}".
-    #
-
-
-    grid = [ [ Const(f"grid_row_{row}_col_{col}", IntSort())
-               for col in range(num_cols)]
-             for row in range(num_rows)]
-
-    print("1", solver.check())
-
-    # Now add constraints for the row and column clues.
-    # This is annoyingly, almost, but not quite parameterized between rows and columns
-    # row_params = ("line", num_lines, line_clues)
-    # col_params= ("col", num_cols, col_clues)
-    # for params in (row_params, col_params):
-    #     line_row, range_var, clues = params
-
-    # Row clues.
-    for row in range(num_rows):
-        prefix = "row"
-        clues = row_clues[row]
-
-        # for each line of clues (each row), get starts, the starting index Consts.
-        starts = [Const(f"{prefix}_{row}_code_{code_num}", IntSort())
-                  for code_num in range(len(clues))]
-        print(f"2 {row=}", solver.check())
-
-        last_start, last_end, last_color = None, 0, 0
-        for code_num, (length, color) in enumerate(clues):
-            start = starts[code_num]
-            end = start + length - 1
-            # block must fit within grid
-            solver.add(start >= 0, end  < num_cols)
-            print(f"3 {row=} {code_num=}", solver.check())
-
-            # block must start after last block, or with one spacer if same color
-            if last_start is not None:
-                if color != last_color:
-                    solver.add(start > last_end)
+
+def propagate(row_clues, col_clues, grid):
+    """
+    Line solve every row and column of grid (a list of rows of color bitmasks, changed in place) until nothing
+    changes.  Returns the starts found for each line, as {("row" or "col", index): starts}, or None if the
+    clues contradict each other.
+    """
+    num_rows, num_cols = len(row_clues), len(col_clues)
+    starts = dict()
+    pending = [("row", i) for i in range(num_rows)] + [("col", j) for j in range(num_cols)]
+    queued = set(pending)
+    while pending:
+        line = pending.pop()
+        queued.discard(line)
+        kind, index = line
+        if kind == "row":
+            cells = tuple(grid[index])
+            solved = solve_line(row_clues[index], cells)
+        else:
+            cells = tuple(grid[i][index] for i in range(num_rows))
+            solved = solve_line(col_clues[index], cells)
+        if solved is None:
+            return None
+        narrowed, starts[line] = solved
+        for position, (old, new) in enumerate(zip(cells, narrowed)):
+            if old != new:
+                if kind == "row":
+                    grid[index][position] = new
+                    crossing = ("col", position)
                 else:
-                    solver.add(start > last_end + 1)  # add at least one blank square between
-            last_start, last_end, last_color = start, end, color
-        print(f"4 {row=}", solver.check())
+                    grid[position][index] = new
+                    crossing = ("row", position)
+                if crossing not in queued:
+                    queued.add(crossing)
+                    pending.append(crossing)
+    return starts
 
-        # Now add color requirement to each grid cell
-        # which is "blank if in no block, or the color of the block the cell is in"
-        for col in range(num_cols):
-            g = grid[row][col]
-            in_block = []
-            in_block_with_color = []
-            for code_num, (length, color) in enumerate(clues):
-                start = starts[code_num]  # start is a IntSort
-                end = start + length - 1  # end is an ArithRef
-                in_block.append(And([start >= col, col <= end]))
-                in_block_with_color.append(And([g == color, start >= col, end <= col]))
-            in_any_block = Or(in_block)
-            is_blank = g == 0  # square is color 0, meaning blank or '.'
-            solver.add(Xor(is_blank, in_any_block))  # g is blank iff it is not in a block
-            print(show(f"5 {row=} {col=}"))
 
-            # solver.add(Or(is_blank, Or(in_block_with_color)))  # if not blank, be color of block
-            print(f"6 {row=} {col=}", solver.check())
+def z3_solve(row_clues, col_clues, grid, starts, num_colors):
+    # What line solving could not decide, as Bools:  cell[r][c][color], and for each line and block a Bool per
+    # start it could still have.  Returns the solution as rows of color indexes, or None.
+    num_rows, num_cols = len(row_clues), len(col_clues)
+    cell = [[[Bool(f"cell_{r}_{c}_{color}") if grid[r][c] >> color & 1 else BoolVal(False)
+              for color in range(num_colors)]
+             for c in range(num_cols)]
+            for r in range(num_rows)]
+    solver = Solver()
+    for (kind, index), line_starts in starts.items():
+        clue = row_clues[index] if kind == "row" else col_clues[index]
+        line = cell[index] if kind == "row" else [cell[r][index] for r in range(num_rows)]
+        begins = [{s: Bool(f"{kind}_{index}_block_{k}_at_{s}") for s in block} for k, block in
+                  enumerate(line_starts)]
+        covering = [[[] for _ in range(num_colors)] for _ in line]
+        for k, (length, color) in enumerate(clue):
+            solver.add(PbEq([(b, 1) for b in begins[k].values()], 1))
+            for s, b in begins[k].items():
+                for i in range(s, s + length):
+                    covering[i][color].append(b)
+                if k:
+                    # Block k starts after block k-1 ends, with a gap if they are the same color.
+                    gap = 1 if clue[k - 1][1] == color else 0
+                    earlier = [e for t, e in begins[k - 1].items() if t + clue[k - 1][0] + gap <= s]
+                    solver.add(Implies(b, Or(earlier)))
+        for i, colors in enumerate(covering):
+            for color in range(1, num_colors):
+                solver.add(line[i][color] == Or(colors[color]))
+            solver.add(line[i][0] == Not(Or([b for blocks in colors for b in blocks])))
+    if instrument.check(solver, family="nonogram") != sat:
+        return None
+    m = solver.model()
+    return [[next(color for color in range(num_colors) if is_true(m.eval(cell[r][c][color])))
+             for c in range(num_cols)]
+            for r in range(num_rows)]
+
 
+def solve_nonogram(row_clues, col_clues, num_colors):
+    """ Returns (solution, how), the solution being rows of color indexes and how "lines" or "z3", or (None, None). """
+    full = (1 << num_colors) - 1
+    grid = [[full] * len(col_clues) for _ in row_clues]
+    starts = propagate(row_clues, col_clues, grid)
+    if starts is None:
+        return None, None
+    if all(mask & (mask - 1) == 0 for row in grid for mask in row):
+        return [[mask.bit_length() - 1 for mask in row] for row in grid], "lines"
+    solution = z3_solve(row_clues, col_clues, grid, starts, num_colors)
+    return (solution, "z3") if solution else (None, None)
 
 
+def clues_of(lines):
+    # The clue for each line of an image, as rows of color indexes.
+    return [tuple((len(list(run)), color) for color, run in groupby(line) if color) for line in lines]
+
+
+def image_clues(image):
+    return clues_of(image), clues_of(zip(*image))
+
+
+def show(solution, color_codes):
+    for row in solution:
+        print("   " + " ".join(color_codes[color] for color in row))
+
+
+def mushroom_puzzle():
+    # Puzzle definition; what makes the mushroom puzzle is its codes and colors
+    raw_row_clues = "3R;5R;5R;1B;5G"
+    raw_col_clues = "2R,1G;3R,1G;3R,1B,1G;3R,1G;2R,1G"
+    color_codes = ".RGB"
+
+    row_clues = parse_clues(raw_row_clues, color_codes)
+    col_clues = parse_clues(raw_col_clues, color_codes)
+    solution, how = solve_nonogram(row_clues, col_clues, len(color_codes))
+    print(f"Mushroom puzzle, solved by {how}:")
+    show(solution, color_codes)
+
+
+def random_image(num_rows, num_cols, num_colors, seed=0, blank=0.4):
+    # An image of blobs:  each cell copies the color of the cell above or to the left, or takes a random one.
+    rng = random.Random(seed)
+    image = [[0] * num_cols for _ in range(num_rows)]
+    for r in range(num_rows):
+        for c in range(num_cols):
+            roll = rng.random()
+            if roll < 0.35 and r:
+                image[r][c] = image[r - 1][c]
+            elif roll < 0.7 and c:
+                image[r][c] = image[r][c - 1]
+            else:
+                image[r][c] = 0 if rng.random() < blank else rng.randrange(1, num_colors)
+    return image
+
 
 if __name__ == "__main__":
+    import time
+
     mushroom_puzzle()
+    color_codes = ".RGBY"
+    for seed in range(3):
+        image = random_image(50, 50, len(color_codes), seed=seed)
+        row_clues, col_clues = image_clues(image)
+        start = time.perf_counter()
+        solution, how = solve_nonogram(row_clues, col_clues, len(color_codes))
+        print(f"50x50, {len(color_codes) - 1} colors, seed {seed}:  solved by {how} in "
+              f"{time.perf_counter() - start:.2f}s, clues match: {image_clues(solution) == (row_clues, col_clues)}")
     print("This program is gratified to be of use.")
@@ -0,0 +1,143 @@
+"""
+N queens, three ways, and a sweep to see which way scales.
+
+The eight queens sample in section_puzzles() of z3_guide_code_samples.py is the pairwise encoding:  an Int
+column per row, Distinct columns, and an If term for every pair of rows to keep them off each other's
+diagonals.  That is N*(N-1)/2 diagonal terms, fine for 8 and not so fine for 200.   The other two encodings:
+
+    board       a Bool per square.  Exactly one queen per row and per column, and at most one on each of
+                the 4N-2 diagonals, all as pseudo-boolean constraints Z3 handles natively.
+    bitvector   a one-hot BitVec of width N per row.  Like the classic bitboard search, the squares attacked
+                from the rows above are carried down as three masks:  columns, and the two diagonals, which
+                shift one place left or right per row.  Each row must miss all three.  That is O(N) terms.
+
+On one core, with a 60 second timeout per check, board solves N=200 in about ten seconds, most of it
+spent building.  Pairwise needs 25 seconds at N=50 and gives up at 150.  Bitvector gives up at 50.  Small
+terms are not the same as easy terms.  The masks are only ORs and shifts, but the solver learns little
+from them until the board is nearly full.  The pseudo-boolean row, column and diagonal constraints
+propagate from the first queen.
+
+Those numbers are for the default Solver.  The encodings ask tuning.py for their solver, so once
+`python tuning.py queens` has found a faster configuration (a preprocessing pipeline in front of the SMT
+core took pairwise from 3.4 seconds to 0.05 at about N=30), the sweep uses it.
+
+    python queens.py --sizes 8 50 100 200 --timeout 60
+"""
+import argparse
+import time
+
+from z3 import (And, AtMost, BitVec, BitVecVal, Bool, Distinct, If, Int, LShR, PbEq, is_true, sat,
+                unknown)
+
+import instrument
+from logic_puzzles import Struct
+from tuning import tuned_solver
+
+
+def pairwise_encoding(n):
+    # The guide's encoding, with 8 replaced by n.
+    Q = [Int('Q_%i' % (i + 1)) for i in range(n)]
+    s = tuned_solver("queens")
+    s.add([And(1 <= Q[i], Q[i] <= n) for i in range(n)])
+    s.add(Distinct(Q))
+    s.add([If(i == j,
+              True,
+              And(Q[i] - Q[j] != i - j, Q[i] - Q[j] != j - i))
+           for i in range(n) for j in range(i)])
+    return s, lambda m: [m[q].as_long() for q in Q]
+
+
+def board_encoding(n):
+    X = [[Bool(f"x_{i}_{j}") for j in range(n)] for i in range(n)]
+    s = tuned_solver("queens")
+    for i in range(n):
+        s.add(PbEq([(X[i][j], 1) for j in range(n)], 1))
+        s.add(PbEq([(X[j][i], 1) for j in range(n)], 1))
+    for d in range(-(n - 2), n - 1):          # diagonals with at least two squares
+        s.add(AtMost(*[X[i][i - d] for i in range(n) if 0 <= i - d < n], 1))
+    for d in range(1, 2 * n - 2):             # and the anti-diagonals
+        s.add(AtMost(*[X[i][d - i] for i in range(n) if 0 <= d - i < n], 1))
+    return s, lambda m: [next(j + 1 for j in range(n) if is_true(m.eval(X[i][j]))) for i in range(n)]
+
+
+def bitvector_encoding(n):
+    rows = [BitVec(f"row_{i}", n) for i in range(n)]
+    zero = BitVecVal(0, n)
+    s = tuned_solver("queens")
+    columns, left, right = zero, zero, zero
+    for row in rows:
+        # Exactly one bit set.  The bit trick row & (row - 1) == 0 says the same, but the subtraction
+        # bit-blasts into an adder the solver struggles with;  smearing the row's bits upward is only
+        # shifts and ORs, and much faster.
+        above = row << 1
+        step = 1
+        while step < n:
+            above = above | (above << step)
+            step *= 2
+        s.add(row != 0, row & above == 0)
+        s.add(row & (columns | left | right) == 0)
+        columns = columns | row
+        left = (left | row) << 1
+        right = LShR(right | row, 1)
+    return s, lambda m: [m[row].as_long().bit_length() for row in rows]
+
+
+ENCODINGS = {"pairwise": pairwise_encoding, "board": board_encoding, "bitvector": bitvector_encoding}
+
+
+def valid(columns):
+    # True if columns (1-based, one per row) is a solution.
+    n = len(columns)
+    return (sorted(columns) == list(range(1, n + 1)) and
+            len({c - i for i, c in enumerate(columns)}) == n and
+            len({c + i for i, c in enumerate(columns)}) == n)
+
+
+def solve_queens(n, encoding="pairwise", timeout=None):
+    """
+    Place n queens.  Returns a Struct with the columns (1-based, one per row, or None), the status, and the
+    build and solve seconds.
+    """
+    result = Struct()
+    start = time.perf_counter()
+    s, decode = ENCODINGS[encoding](n)
+    if timeout:
+        s.set("timeout", int(timeout * 1000))
+    built = time.perf_counter()
+    status = instrument.check(s, family="queens")
+    result.solve = time.perf_counter() - built
+    result.build = built - start
+    result.columns = decode(s.model()) if status == sat else None
+    result.status = "timeout" if status == unknown else str(status)
+    return result
+
+
+def sweep(sizes, encodings=tuple(ENCODINGS), timeout=60):
+    # Yield (n, encoding, result) for each size and encoding.  Once an encoding times out, larger sizes of it
+    # are skipped.
+    gave_up = set()
+    for n in sizes:
+        for encoding in encodings:
+            if encoding in gave_up:
+                continue
+            result = solve_queens(n, encoding, timeout)
+            if result.status == "timeout":
+                gave_up.add(encoding)
+            elif result.columns is not None and not valid(result.columns):
+                result.status = "WRONG"
+            yield n, encoding, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare N-queens encodings.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8, 25, 50, 100, 150, 200])
+    parser.add_argument("--encodings", nargs="+", choices=list(ENCODINGS), default=list(ENCODINGS))
+    parser.add_argument("--timeout", type=float, default=60, help="seconds allowed for each check()")
+    args = parser.parse_args(argv)
+    print(f"{'n':>4} {'encoding':10} {'build':>9} {'solve':>9}  status")
+    for n, encoding, result in sweep(args.sizes, args.encodings, args.timeout):
+        print(f"{n:4} {encoding:10} {result.build:9.3f} {result.solve:9.3f}  {result.status}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,517 @@
+"""
+A package dependency resolver, grown from the install puzzle in section_install_puzzle().
+
+The guide's version makes a Bool per package, states each dependency with DependsOn() and each conflict with
+Conflict(), and asks Z3 for a model.   That idea scales;  what does not is writing out the whole universe.   A
+real Debian `Packages` index has tens of thousands of packages, several versions of some, version ranges,
+alternatives ("a | b") and virtual packages.   So:
+
+    - The index is read a line at a time, keeping only the fields a resolver needs, as the raw text.
+      Dependency fields are only parsed for the packages a request actually reaches.
+    - Each (package, version) that can be reached from the request gets a Bool, named "name=version".
+      Nothing else is encoded, so a request touching 300 packages costs 300 packages whatever the index size.
+    - Depends and Pre-Depends become DependsOn(candidate, [Or(alternatives), ...]);  Conflicts and Breaks become
+      Conflict(candidate, other);  and at most one version of each package can be installed.
+    - Optimize picks the smallest install set, then the newest versions.
+
+    index = Index.read("Packages")
+    resolve(index, ["python3 (>= 3.11)", "gcc | clang"])      # [(name, version), ...], or None
+
+For many "what if" questions against the same index, Resolver keeps one solver warm.   What the questions
+reach is encoded once, and each question is a check() under assumptions:
+
+    r = Resolver(index)
+    r.query(["a", "z", "g"])        # .installed, or .conflicts:  the requested items that cannot go together
+
+Versions compare the way dpkg compares them:  epoch, upstream version, revision, with "~" sorting before
+everything, even the end of the string, so 1.0~rc1 comes before 1.0.
+"""
+import functools
+import re
+
+from z3 import And, AtMost, Bool, Implies, Not, Optimize, Or, Solver, is_true, sat
+
+import instrument
+from logic_puzzles import Struct
+from z3_guide_code_samples import Conflict, DependsOn
+
+DEPENDENCY_FIELDS = ("Pre-Depends", "Depends")
+CONFLICT_FIELDS = ("Conflicts", "Breaks")
+KEPT_FIELDS = ("Package", "Version", "Provides") + DEPENDENCY_FIELDS + CONFLICT_FIELDS
+
+
+# -- dpkg versions
+
+def split_version(version):
+    # The epoch ends at the first colon, as dpkg splits it:  the upstream version may have colons of its own.
+    epoch, _, rest = version.partition(":") if ":" in version else ("0", "", version)
+    upstream, _, revision = rest.rpartition("-") if "-" in rest else (rest, "", "0")
+    return int(epoch or 0), upstream, revision
+
+
+def order(ch):
+    if ch == "~":
+        return -1
+    if ch.isalpha():
+        return ord(ch)
+    return ord(ch) + 256
+
+
+def compare_part(a, b):
+    # dpkg's verrevcmp():  alternate runs of non-digits, compared character by character with order(), and
+    # runs of digits, compared as numbers.
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            x = order(a[i]) if i < len(a) and not a[i].isdigit() else 0
+            y = order(b[j]) if j < len(b) and not b[j].isdigit() else 0
+            if x != y:
+                return -1 if x < y else 1
+            i, j = i + 1, j + 1
+        start_i, start_j = i, j
+        while i < len(a) and a[i].isdigit():
+            i += 1
+        while j < len(b) and b[j].isdigit():
+            j += 1
+        x, y = int(a[start_i:i] or 0), int(b[start_j:j] or 0)
+        if x != y:
+            return -1 if x < y else 1
+    return 0
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def compare_versions(a, b):
+    """ -1, 0 or 1, as dpkg --compare-versions would order a and b. """
+    epoch_a, upstream_a, revision_a = split_version(a)
+    epoch_b, upstream_b, revision_b = split_version(b)
+    if epoch_a != epoch_b:
+        return -1 if epoch_a < epoch_b else 1
+    return compare_part(upstream_a, upstream_b) or compare_part(revision_a, revision_b)
+
+
+OPERATORS = {
+    "<<": lambda c: c < 0, "<=": lambda c: c <= 0, "=": lambda c: c == 0, ">=": lambda c: c >= 0,
+    ">>": lambda c: c > 0, "<": lambda c: c <= 0, ">": lambda c: c >= 0,      # < and > are old spellings
+}
+
+
+def satisfies(version, op, wanted):
+    return op is None or OPERATORS[op](compare_versions(version, wanted))
+
+
+# -- relation fields
+
+RELATION = re.compile(r"^\s*([^\s(:\[<]+)(?::[^\s(]+)?\s*(?:\(\s*([<>=]+)\s*([^)\s]+)\s*\))?")
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def parse_relations(text):
+    """
+    "a (>= 1.2), b | c:any (<< 3) [amd64]" -> ((("a", ">=", "1.2"),), (("b", None, None), ("c", "<<", "3"))).
+    Each item is a tuple of alternatives, any one of which will do.  Architecture qualifiers, architecture
+    lists and build profiles are dropped.
+    """
+    relations = []
+    for item in text.split(","):
+        alternatives = []
+        for alternative in item.split("|"):
+            match = RELATION.match(alternative)
+            if match:
+                alternatives.append(match.groups())
+        if alternatives:
+            relations.append(tuple(alternatives))
+    return tuple(relations)
+
+
+# -- the index
+
+class Index:
+    # packages:  name -> list of (version, fields), fields being {field: raw text} for KEPT_FIELDS only.
+    # provides:  virtual name -> list of (name, version, provided version or None).
+    def __init__(self):
+        self.packages = dict()
+        self.provides = dict()
+
+    @classmethod
+    def read(cls, path):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return cls.from_lines(f)
+
+    @classmethod
+    def from_lines(cls, lines):
+        index = cls()
+        for stanza in read_stanzas(lines):
+            index.add(stanza)
+        return index
+
+    def add(self, fields):
+        name, version = fields["Package"], fields.get("Version", "0")
+        self.packages.setdefault(name, []).append((version, fields))
+        for alternatives in parse_relations(fields.get("Provides", "")):
+            virtual, op, provided = alternatives[0]
+            self.provides.setdefault(virtual, []).append((name, version, provided if op == "=" else None))
+
+    def __len__(self):
+        return len(self.packages)
+
+    def candidates(self, name, op=None, wanted=None):
+        # Every (name, version) that satisfies the relation "name (op wanted)", providers included.
+        # A provider without a version only satisfies a relation with no version.
+        found = [(name, version) for version, _ in self.packages.get(name, ()) if satisfies(version, op, wanted)]
+        for provider, version, provided in self.provides.get(name, ()):
+            if op is None or (provided is not None and satisfies(provided, op, wanted)):
+                found.append((provider, version))
+        return found
+
+    def fields(self, candidate):
+        name, version = candidate
+        for v, fields in self.packages[name]:
+            if v == version:
+                return fields
+        raise KeyError(candidate)
+
+
+def read_stanzas(lines):
+    # Yield each stanza of a Packages file as {field: value}, keeping only KEPT_FIELDS.  Stanzas are separated
+    # by blank lines;  lines starting with white space continue the field before.
+    fields, field = dict(), None
+    for line in lines:
+        if not line.strip():
+            if "Package" in fields:
+                yield fields
+            fields, field = dict(), None
+        elif line[0] in " \t":
+            if field in fields:
+                fields[field] += " " + line.strip()
+        else:
+            field, _, value = line.partition(":")
+            if field in KEPT_FIELDS:
+                fields[field] = value.strip()
+    if "Package" in fields:
+        yield fields
+
+
+# -- encoding
+
+class Encoder:
+    # Turns the part of an index reachable from some relations into DependsOn() and Conflict() constraints.
+    # Calling reach() again only encodes what is new, so one Encoder can feed a solver that lives a long time.
+    def __init__(self, index, ctx=None):
+        self.index = index
+        self.ctx = ctx
+        self.vars = dict()          # (name, version) -> Bool, for every encoded candidate
+        self.versions = dict()      # name -> its encoded candidates
+        self.conflicts = dict()     # name -> [(candidate, op, wanted)], the encoded candidates conflicting with it
+        self.stated = set()         # conflicting pairs already stated
+
+    def var(self, candidate):
+        if candidate not in self.vars:
+            self.vars[candidate] = Bool("=".join(candidate), self.ctx)
+        return self.vars[candidate]
+
+    def clause(self, alternatives):
+        # One relation item as a Z3 expression:  any candidate of any alternative.
+        return Or([self.var(candidate) for name, op, wanted in alternatives
+                   for candidate in self.index.candidates(name, op, wanted)] + [False])
+
+    def reach(self, relations):
+        """
+        Encode every candidate reachable from relations (as parse_relations() gives them) that is not already
+        encoded.  Returns the new constraints.
+        """
+        constraints = []
+        new = []
+        pending = [candidate for alternatives in relations for name, op, wanted in alternatives
+                   for candidate in self.index.candidates(name, op, wanted)]
+        seen = set()
+        while pending:
+            candidate = pending.pop()
+            if candidate in seen or candidate in self.versions.get(candidate[0], ()):
+                continue
+            seen.add(candidate)
+            new.append(candidate)
+            self.versions.setdefault(candidate[0], []).append(candidate)
+            fields = self.index.fields(candidate)
+            depends = [alternatives for field in DEPENDENCY_FIELDS
+                       for alternatives in parse_relations(fields.get(field, ""))]
+            if depends:
+                constraints.append(DependsOn(self.var(candidate), [self.clause(item) for item in depends]))
+            else:
+                self.var(candidate)
+            for item in depends:
+                for name, op, wanted in item:
+                    pending.extend(self.index.candidates(name, op, wanted))
+            for field in CONFLICT_FIELDS:
+                for alternatives in parse_relations(fields.get(field, "")):
+                    for name, op, wanted in alternatives:
+                        self.conflicts.setdefault(name, []).append((candidate, op, wanted))
+
+        # Conflicts only matter between encoded candidates.  A new candidate may conflict with an old one or
+        # the other way round, so look both ways.  A package never conflicts with itself, which is how Debian
+        # says "replaces anything else providing the same thing".
+        for candidate in new:
+            name, version = candidate
+            fields = self.index.fields(candidate)
+            for field in CONFLICT_FIELDS:
+                for alternatives in parse_relations(fields.get(field, "")):
+                    for relation in alternatives:
+                        for other in self.index.candidates(*relation):
+                            if other[0] != name and other in self.versions.get(other[0], ()):
+                                self.state_conflict(constraints, candidate, other)
+            for other, op, wanted in self.conflicts.get(name, ()):
+                if other[0] != name and satisfies(version, op, wanted):
+                    self.state_conflict(constraints, other, candidate)
+            for virtual, *_ in self.provided(candidate):
+                for other, op, wanted in self.conflicts.get(virtual, ()):
+                    if other[0] != name and op is None:
+                        self.state_conflict(constraints, other, candidate)
+        for name in {name for name, _ in new}:
+            if len(self.versions[name]) > 1:
+                constraints.append(AtMost(*[self.vars[c] for c in self.versions[name]], 1))
+        return constraints
+
+    def provided(self, candidate):
+        return [alternatives[0] for alternatives in parse_relations(self.index.fields(candidate).get("Provides", ""))]
+
+    def state_conflict(self, constraints, a, b):
+        pair = (a, b) if a < b else (b, a)
+        if pair not in self.stated:
+            self.stated.add(pair)
+            constraints.append(Conflict(self.vars[a], self.vars[b]))
+
+
+def resolve(index, request, ctx=None):
+    """
+    Resolve request, a list of relation strings like "gcc (>= 4:12)" or "mail-transport-agent | postfix".
+    Returns the smallest install set, preferring newer versions, as a sorted list of (name, version), or None
+    if the request cannot be met.
+    """
+    relations = [item for text in request for item in parse_relations(text)]
+    encoder = Encoder(index, ctx)
+    o = Optimize(ctx=ctx)
+    o.add(encoder.reach(relations))
+    o.add([encoder.clause(item) for item in relations])
+    for candidate, var in encoder.vars.items():
+        o.add_soft(Not(var), 1, "size")
+    for name, candidates in encoder.versions.items():
+        newest_first = sorted(candidates, key=functools.cmp_to_key(lambda a, b: compare_versions(b[1], a[1])))
+        for rank, candidate in enumerate(newest_first):
+            if rank:
+                o.add_soft(Not(encoder.vars[candidate]), rank, "age")
+    if o.check() != sat:
+        return None
+    m = o.model()
+    return sorted(candidate for candidate, var in encoder.vars.items() if is_true(m.eval(var)))
+
+
+
+class Resolver:
+    """
+    One long-lived solver for many queries against the same index.  Encoding only grows:  what a query reaches
+    is added to the solver for good, since it is true of the index whatever is asked.   Each requested item
+    gets a Bool that implies it, and a query is one check() with the Bools of its items assumed, so nothing
+    has to be taken back afterwards.   When a query cannot be met, the unsat core of those Bools names the
+    requested items that cannot all be installed together.
+    """
+    def __init__(self, index, ctx=None):
+        self.index = index
+        self.ctx = ctx
+        self.encoder = Encoder(index, ctx)
+        self.solver = Solver(ctx=ctx)
+        self.solver.set("core.minimize", True)
+        self.requests = dict()      # requested text -> the Bool that implies it
+        self.checks = 0
+
+    def literal(self, text):
+        if text not in self.requests:
+            relations = parse_relations(text)
+            self.solver.add(self.encoder.reach(relations))
+            literal = Bool(f"request {text}", self.ctx)
+            self.solver.add(Implies(literal, And([self.encoder.clause(item) for item in relations])))
+            self.requests[text] = literal
+        return self.requests[text]
+
+    def query(self, request):
+        """
+        Can everything in request (relation strings, as resolve() takes) be installed together?  Returns a Struct
+        with installed, a sorted list of (name, version) or None, and conflicts, None or the requested items
+        that cannot all be met.   The install set is what the request needs in the model found, which is
+        consistent but not necessarily the smallest;  resolve() finds that, at the cost of a fresh Optimize.
+        """
+        literals = [self.literal(text) for text in request]
+        self.checks += 1
+        result = Struct()
+        result.installed, result.conflicts = None, None
+        if instrument.check(self.solver, *literals, family="resolver") == sat:
+            result.installed = self.needed(self.solver.model(), request)
+        else:
+            core = {str(literal) for literal in self.solver.unsat_core()}
+            result.conflicts = [text for text in request if str(self.requests[text]) in core]
+        return result
+
+    def needed(self, m, request):
+        # Walk from the request through the dependencies, taking the first installed alternative each time.
+        # The model may switch on packages nothing asked for;  they are left out.
+        def chosen(item):
+            for name, op, wanted in item:
+                for candidate in self.index.candidates(name, op, wanted):
+                    if candidate in self.encoder.vars and is_true(m.eval(self.encoder.vars[candidate])):
+                        return candidate
+            return None
+
+        installed = set()
+        pending = [chosen(item) for text in request for item in parse_relations(text)]
+        while pending:
+            candidate = pending.pop()
+            if candidate is None or candidate in installed:
+                continue
+            installed.add(candidate)
+            fields = self.index.fields(candidate)
+            pending.extend(chosen(item) for field in DEPENDENCY_FIELDS
+                           for item in parse_relations(fields.get(field, "")))
+        return sorted(installed)
+
+
+# The packages of section_install_puzzle(), as an index.
+GUIDE_INDEX = """
+Package: a
+Version: 1
+Depends: b, c, z
+
+Package: b
+Version: 1
+Depends: d
+
+Package: c
+Version: 1
+Depends: d | e, f | g
+
+Package: d
+Version: 1
+Conflicts: e, g
+
+Package: e
+Version: 1
+
+Package: f
+Version: 1
+
+Package: g
+Version: 1
+
+Package: z
+Version: 1
+"""
+
+# -- a synthetic index, for trying things out at a realistic size
+
+def synthetic_index(out, count=30000, seed=0, cluster=100, core=300):
+    """
+    Write a Packages index of count packages to out, a text file.  Like a real archive, packages come in
+    clusters (think source packages) that mostly depend on each other and on a shared core (think libc), so
+    what a request reaches is a few hundred packages, not the archive.   There are several versions of some
+    packages, version ranges, alternatives, virtual packages, conflicts and multi-line descriptions.
+    """
+    import random
+    rng = random.Random(seed)
+    names = [f"lib{i:05d}" if i < core else f"pkg{i:05d}" for i in range(count)]
+    versions = []
+    for i in range(count):
+        major = rng.randrange(1, 6)
+        choices = [f"{major}.{minor}-{rng.randrange(1, 4)}" for minor in range(rng.randrange(1, 4))]
+        if rng.random() < 0.05:
+            choices.append(f"{major}.{len(choices)}~rc1-1")
+        if rng.random() < 0.02:
+            choices = [f"1:{v}" for v in choices]
+        versions.append(choices)
+
+    def pick(i):
+        # Somewhere to depend on:  earlier in the same cluster, or in the core.
+        start = max(0, i - i % cluster) if i >= core else 0
+        if i > start and rng.random() < 0.7:
+            return rng.randrange(start, i)
+        return rng.randrange(0, min(i, core)) if i else None
+
+    for i, name in enumerate(names):
+        for version in versions[i]:
+            depends = []
+            for _ in range(rng.randrange(0, 5)):
+                j = pick(i)
+                if j is None:
+                    continue
+                relation = names[j]
+                roll = rng.random()
+                if roll < 0.2:
+                    relation += f" (>= {min(versions[j], key=functools.cmp_to_key(compare_versions))})"
+                elif roll < 0.25 and len(versions[j]) > 1:
+                    relation += f" (<< {max(versions[j], key=functools.cmp_to_key(compare_versions))})"
+                elif roll < 0.35:
+                    k = pick(i)
+                    if k is not None:
+                        relation += f" | {names[k]}:any"
+                elif roll < 0.4:
+                    relation = f"virtual{j % 50:02d}"
+                depends.append(relation)
+            out.write(f"Package: {name}\nVersion: {version}\nArchitecture: amd64\n")
+            if depends:
+                out.write(f"Depends: {', '.join(depends)}\n")
+            if i < core and i % 3 == 0:
+                out.write(f"Provides: virtual{(i // 3) % 50:02d}\n")
+            if i >= core and rng.random() < 0.03:
+                j = pick(i)
+                if j is not None and j >= core:
+                    out.write(f"Conflicts: {names[j]}\n")
+            out.write(f"Description: synthetic package {i}\n This line continues the description.\n .\n\n")
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+
+    guide = Resolver(Index.from_lines(GUIDE_INDEX.splitlines()))
+    for number, request in enumerate((["a", "z"], ["a", "z", "g"]), 1):
+        result = guide.query(request)
+        print(f"Check {number}:  {request} ->", result.installed or f"conflict between {result.conflicts}")
+
+    path = os.path.join(tempfile.gettempdir(), "synthetic_Packages")
+    start = time.perf_counter()
+    with open(path, "w") as f:
+        synthetic_index(f, count=30000)
+    print(f"Wrote {os.path.getsize(path) / 1e6:.1f} MB of index in {time.perf_counter() - start:.1f}s")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = Index.read(path)
+    print(f"Read {len(index)} packages in {time.perf_counter() - start:.1f}s, "
+          f"{tracemalloc.get_traced_memory()[1] / 1e6:.0f} MB at most")
+    tracemalloc.stop()
+
+    for request in (["pkg12345"], ["pkg29999 | pkg29998", "lib00042 (>= 2)"], ["pkg05010", "pkg05020", "pkg17777"]):
+        start = time.perf_counter()
+        installed = resolve(index, request)
+        seconds = time.perf_counter() - start
+        if installed is None:
+            print(f"{request}: cannot be installed ({seconds:.2f}s)")
+        else:
+            print(f"{request}: {len(installed)} packages in {seconds:.2f}s, e.g. "
+                  f"{', '.join('='.join(c) for c in installed[:3])}")
+
+    # What-if queries:  a base image, plus one more package at a time.
+    import random
+    rng = random.Random(1)
+    base = ["pkg05010", "pkg05020", "pkg17777"]
+    extras = [f"pkg{rng.randrange(300, 30000):05d}" for _ in range(300)]
+    warm = Resolver(index)
+    start = time.perf_counter()
+    results = [warm.query(base + [extra]) for extra in extras]
+    warm_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for extra in extras[:20]:
+        resolve(index, base + [extra])
+    cold_seconds = (time.perf_counter() - start) / 20
+    refused = [result.conflicts for result in results if result.conflicts]
+    print(f"{len(extras)} what-if queries on one warm Resolver:  {warm_seconds / len(extras) * 1000:.1f}ms each, "
+          f"against {cold_seconds * 1000:.0f}ms for resolve() from scratch;  {len(refused)} refused, e.g. "
+          f"{refused[:2]}")
@@ -0,0 +1,178 @@
+"""
+Run puzzle functions side by side, one process per puzzle.
+
+By default, every puzzle in this repository builds its sorts and functions in Z3's global context.  That context
+lives in the Python process, so `EnumSort("Player", ...)` can only be called once per process:  a second call
+fails with "enumeration sort name is already declared".   Running each puzzle in a freshly spawned process
+gives each one its own Z3 context, and lets the slow puzzles use the other cores instead of holding up the rest.
+
+Each puzzle's printed output is captured and handed back, so the output can be shown in the order the
+puzzles were registered rather than in the order they happened to finish.
+
+The logic puzzles and the Dave Cook puzzles also take a ctx argument, the Context to build in.  Those can share
+one long-lived process instead:  run_threads() calls each with a Context of its own on a thread pool.   Z3
+releases Python's lock while it works, so the checks run in parallel like the processes do, without the cost of
+starting a process and importing z3 for every puzzle.  A Context is not safe to share between threads, so a
+puzzle must build everything in the ctx it is given, and nothing from it may outlive the call.
+
+    python runner.py --threads
+
+Either way, each puzzle runs inside instrument.puzzle(name), so with PUZZLE_EVENTS=events.jsonl set every process
+and thread writes its phase and check events there under the puzzle's name.
+"""
+import io
+import multiprocessing
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from z3 import Context
+
+import instrument
+from logic_puzzles import Struct
+
+
+# Registered puzzles, in the order their results are reported.  Values are module level functions, because
+# spawned workers find a function by importing its module.
+PUZZLES = dict()
+
+
+def register(fn, name=None):
+    # Usable as `register(poker_puzzle)` or as a decorator.
+    PUZZLES[name or fn.__name__] = fn
+    return fn
+
+
+def run_one(item):
+    # Runs in the worker process.  Returns a Struct instead of raising, so one broken puzzle does not lose
+    # the results of the others.
+    name, fn = item
+    result = Struct()
+    result.name = name
+    result.error = None
+    buffer = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(buffer), instrument.puzzle(name):
+        try:
+            result.value = fn()
+        except Exception:
+            result.value = None
+            result.error = traceback.format_exc()
+    result.seconds = time.perf_counter() - start
+    result.output = buffer.getvalue()
+    return result
+
+
+def run_puzzles(puzzles=None, processes=None, worker=run_one):
+    """ Run each (name, function) pair in its own process, returning results in the order given. """
+    if puzzles is None:
+        puzzles = PUZZLES
+    if isinstance(puzzles, dict):
+        puzzles = list(puzzles.items())
+    # "spawn" rather than "fork", so a worker never inherits sorts already declared by the parent, and
+    # maxtasksperchild=1 so no two puzzles ever share a process (and so a context).
+    mp = multiprocessing.get_context("spawn")
+    with mp.Pool(processes=processes, maxtasksperchild=1) as pool:
+        return pool.map(worker, puzzles, chunksize=1)
+
+
+class ThreadOutput(io.TextIOBase):
+    # Stands in for sys.stdout while threads run:  a thread with a buffer of its own writes there, anything
+    # else goes on to the real stdout.  redirect_stdout() swaps sys.stdout for the whole process, so it cannot
+    # keep the threads apart.
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def write(self, text):
+        return getattr(self.local, "buffer", self.stdout).write(text)
+
+    def flush(self):
+        getattr(self.local, "buffer", self.stdout).flush()
+
+
+def run_in_context(item, output):
+    # Runs on a pool thread.  Like run_one(), but calls the puzzle with a Context of its own.
+    name, fn = item
+    result = Struct()
+    result.name = name
+    result.error = None
+    output.local.buffer = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with instrument.puzzle(name):
+            result.value = fn(ctx=Context())
+    except Exception:
+        result.value = None
+        result.error = traceback.format_exc()
+    result.seconds = time.perf_counter() - start
+    result.output = output.local.buffer.getvalue()
+    del output.local.buffer
+    return result
+
+
+def run_threads(puzzles=None, threads=None):
+    """
+    Run each (name, function) pair on a pool of threads, each function called with ctx=Context().  Returns
+    results like run_puzzles(), in the order given.
+    """
+    if puzzles is None:
+        puzzles = PUZZLES
+    if isinstance(puzzles, dict):
+        puzzles = list(puzzles.items())
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return list(pool.map(lambda item: run_in_context(item, output), puzzles))
+    finally:
+        sys.stdout = output.stdout
+
+
+def print_results(results):
+    total = 0.0
+    for result in results:
+        print(result.output, end="")
+        if result.error:
+            print(f"{result.name} failed:\n{result.error}")
+        total += result.seconds
+    print("\nTimings:")
+    for result in results:
+        print(f"   {result.name:20} {result.seconds:8.3f}s")
+    print(f"   {'(serial sum)':20} {total:8.3f}s")
+
+
+def register_main_puzzles():
+    # The puzzles main.py has always run.  Imported here, rather than at the top, so that importing the
+    # runner does not import every puzzle.
+    from z3_guide_code_samples import z3_guide_samples
+    from dave_cook_poker_sample import poker_puzzle
+    from dave_cook_skiing_puzzle import skiing_puzzle
+    from dave_cook_tv_puzzle import television_puzzle
+
+    for fn in (z3_guide_samples, poker_puzzle, skiing_puzzle, television_puzzle):
+        register(fn)
+
+
+def context_puzzles(copies=1):
+    # The puzzles that take a ctx, each listed copies times:  the same puzzle built again is no longer a clash.
+    from logic_puzzles import coral_city_puzzle, hero_puzzle, podcast_puzzle
+    from dave_cook_poker_sample import poker_puzzle
+    from dave_cook_skiing_puzzle import skiing_puzzle
+    from dave_cook_tv_puzzle import television_puzzle
+
+    fns = (podcast_puzzle, hero_puzzle, coral_city_puzzle, poker_puzzle, skiing_puzzle, television_puzzle)
+    return [(f"{fn.__name__}" + (f" #{copy + 1}" if copies > 1 else ""), fn) for fn in fns for copy in range(copies)]
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    if "--threads" in sys.argv[1:]:
+        print_results(run_threads(context_puzzles(copies=2), threads=4))
+    else:
+        register_main_puzzles()
+        print_results(run_puzzles())
+    print(f"   {'(wall clock)':20} {time.perf_counter() - start:8.3f}s")
@@ -0,0 +1,151 @@
+"""
+Build the skeleton of a logic grid once per shape, and copy it for every puzzle of that shape.
+
+The skeleton of a Puzzle, its sorts and its pairs of functions with their one-to-one constraints, depends on
+the labels only through their names.  Coral City and the hero puzzle are both four groups of seven, one of them
+numbers, and Puzzle builds the same few hundred terms for each, one Python call at a time.   The skeleton cache
+in logic_puzzles.py helps when the very same categories come back, which in a corpus of puzzles is rare.
+
+A Template builds the skeleton for a shape, such as (("enum", 7), ("int", 7), ("enum", 7), ("enum", 7)), with
+made-up names (tpl_g0 for the first group, tpl_g0_v3 for its fourth value, tpl_f1 and tpl_b1 for the function
+pair of the second group), and keeps it as SMT-LIB text.   A puzzle of that shape gets the text with the names
+swapped for its own, a number in place of each numeric value, and Z3 parses it into the puzzle's context.
+The sorts and functions are then picked out of assertions whose positions the template noted, rather than
+searched for.   What is left to build per puzzle is the clues.
+
+    p = from_template(groups, ctx=Context())        # groups as Puzzle takes them
+    p.clue("Kyrgzstan.Month == Jamaica.Month + 3")
+
+Templates are kept per process by shape, so the first puzzle of a shape pays for building it.  Puzzles with
+presolve.py domains have skeletons of their own and do not use templates.
+"""
+import re
+
+from z3 import Context, Const, EnumSort, IntSort, RealSort, Solver, is_app
+
+from logic_puzzles import Puzzle, make_func
+
+TEMPLATES = dict()     # shape -> Template
+NAME = re.compile(r"tpl_\w+")
+SIMPLE_SYMBOL = re.compile(r"[A-Za-z~!@$%^&*_+=<>.?/-][A-Za-z0-9~!@$%^&*_+=<>.?/-]*")
+
+
+def shape_of(groups):
+    # The shape of a dict of group name to values:  ("enum", "int" or "real", number of values) per group.
+    return tuple(("enum" if isinstance(values[0], str) else "int" if isinstance(values[0], int) else "real",
+                  len(values)) for values in groups.values())
+
+
+def symbol(name):
+    return name if SIMPLE_SYMBOL.fullmatch(name) else "|" + name.replace("|", "") + "|"
+
+
+class Template:
+    def __init__(self, shape):
+        self.shape = shape
+        ctx = Context()      # its own, so the made-up names never meet a puzzle's
+        solver = Solver(ctx=ctx)
+        kinds, consts = [], []
+        for g, (kind, size) in enumerate(shape):
+            names = [f"tpl_g{g}_v{i}" for i in range(size)]
+            if kind == "enum":
+                sort, values = EnumSort(f"tpl_g{g}", names, ctx=ctx)
+            else:
+                # A number stands in as a constant of the right sort, until a puzzle gives the real one.
+                sort = IntSort(ctx) if kind == "int" else RealSort(ctx)
+                values = [Const(name, sort) for name in names]
+            kinds.append(sort)
+            consts.append(values)
+        for g in range(1, len(shape)):
+            make_func(solver, f"tpl_f{g}", f"tpl_b{g}", kinds[0], consts[0], kinds[g], consts[g])
+
+        # Where to find each function pair:  an assertion `back(fn(con)) == con`.
+        self.anchors = dict()
+        for index, assertion in enumerate(solver.assertions()):
+            left = assertion.arg(0) if assertion.num_args() else None
+            if left is not None and is_app(left) and left.decl().name().startswith("tpl_b"):
+                self.anchors.setdefault(int(left.decl().name()[5:]), index)
+        self.anchors = [self.anchors[g] for g in range(1, len(shape))]
+
+        # Numbers are written in place of their stand-ins, so the stand-ins are not declared.
+        numeric = {f"tpl_g{g}_v{i}" for g, (kind, size) in enumerate(shape) if kind != "enum" for i in range(size)}
+        self.text = "\n".join(line for line in solver.sexpr().splitlines()
+                              if not (line.startswith("(declare-fun ") and line.split()[1] in numeric))
+
+    def names(self, p):
+        # What each made-up name becomes in puzzle p.
+        names = dict()
+        groups = list(p.groups.items())
+        for g, (group, values) in enumerate(groups):
+            names[f"tpl_g{g}"] = symbol(group)
+            for i, value in enumerate(values):
+                if isinstance(value, str):
+                    names[f"tpl_g{g}_v{i}"] = symbol(value)
+                else:
+                    sort = IntSort(p.ctx) if isinstance(value, int) else RealSort(p.ctx)
+                    names[f"tpl_g{g}_v{i}"] = sort.cast(value).sexpr()
+            if g:
+                fn_name, back_name = p.func_names(group)
+                names[f"tpl_f{g}"], names[f"tpl_b{g}"] = symbol(fn_name), symbol(back_name)
+        return names
+
+    def load_into(self, p):
+        """ Give Puzzle p its skeleton, kinds, consts and funcs from the template. """
+        if len(self.shape) == 1:     # one group:  no functions to share
+            p.compile()
+            return
+        names = self.names(p)
+        p.solver.from_string(NAME.sub(lambda match: names[match.group(0)], self.text))
+        assertions = p.solver.assertions()
+        groups = list(p.groups.items())
+        for g, anchor in enumerate(self.anchors, 1):
+            group, values = groups[g]
+            back = assertions[anchor].arg(0)
+            p.funcs[group] = back.arg(0).decl(), back.decl()
+            p.kinds[group] = back.arg(0).decl().range()
+        p.kinds[groups[0][0]] = p.funcs[groups[1][0]][0].domain(0)
+        for group, values in groups:
+            kind = p.kinds[group]
+            if isinstance(values[0], str):
+                p.consts[group] = [kind.constructor(i)() for i in range(kind.num_constructors())]
+            else:
+                p.consts[group] = [kind.cast(v) for v in values]
+
+
+def template_for(shape):
+    if shape not in TEMPLATES:
+        TEMPLATES[shape] = Template(shape)
+    return TEMPLATES[shape]
+
+
+def from_template(groups, ctx=None):
+    """ A Puzzle for groups (a dict, as Puzzle takes, or category text), its skeleton copied from its shape's. """
+    if isinstance(groups, str):
+        groups = Puzzle.parse_groups(groups)
+    return Puzzle(groups, ctx=ctx, template=template_for(shape_of(groups)))
+
+
+if __name__ == "__main__":
+    import time
+
+    from logic_puzzles import CORAL_CITY_CLUES, CORAL_CITY_TEXT, solver_check
+
+    groups = Puzzle.parse_groups(CORAL_CITY_TEXT)
+    hero = {"Year": [2007, 2008, 2009, 2010, 2011, 2012, 2013],
+            "Hero": "Criminal, Deep, Green, Max, Prism, Ultra, Wonderman".split(", "),
+            "Name": "Arnold, Cal, Hal, Lyle, Ned, Peter, Red".split(", "),
+            "Hood": "Apple, Frazier, Idyllwild, Libertyville, Mission, Summerland, Tenth".split(", ")}
+    count = 100
+    for title, make in (("built term by term", lambda g: Puzzle(g, ctx=Context())),
+                        ("copied from a template", lambda g: from_template(g, ctx=Context()))):
+        start = time.perf_counter()
+        for i in range(count):
+            make(groups if i % 2 else hero)
+        print(f"{count} skeletons {title}:  {(time.perf_counter() - start) / count * 1000:.1f} ms each")
+
+    p = from_template(CORAL_CITY_TEXT, ctx=Context())
+    for text in CORAL_CITY_CLUES:
+        p.clue(text)
+    print("\nCoral City, from the template:")
+    solver_check(p.solver, "In month {:>9}, there were {:5} visitors to {}'s {} exhibit", p.primary_consts,
+                 p.helper_fn)
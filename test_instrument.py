@@ -0,0 +1,24 @@
+"""
+The check events of instrument.py.   Run with `python -m pytest`.
+"""
+from z3 import Context
+
+import instrument
+from extract import Extractor, solution_codes
+from logic_puzzles import CORAL_CITY_TEXT, Puzzle
+
+
+def test_checks_on_one_solver_record_increments():
+    # Z3's counters run on for the life of a solver, so each event must hold what its own check added.
+    p = Puzzle.from_text(CORAL_CITY_TEXT, cache_dir=None, ctx=Context())
+    sink = instrument.MemorySink()
+    previous = instrument.enable(sink)
+    try:
+        list(solution_codes(p.solver, Extractor(p.primary_consts, p.helper_fn), limit=2))
+    finally:
+        instrument.enable(previous)
+    first, second = [event["stats"] for event in sink.of("check")]
+    totals = instrument.statistics(p.solver)
+    for key in ("decisions", "conflicts"):
+        assert first[key] + second[key] == totals[key]
+    assert second["decisions"] < totals["decisions"]
@@ -0,0 +1,253 @@
+"""
+Pick the fastest Z3 configuration for each kind of puzzle, once, and use it from then on.
+
+Z3's default Solver() is a generalist.   For a given kind of problem, another tactic pipeline is often much
+faster:  N queens with the guide's pairwise Ints times out at N=60 with the default solver, and solves in about
+two seconds with the finite domain solver (`SolverFor("QF_FD")`), which turns the bounded Ints into bits and
+hands them to the SAT solver.   Which pipeline wins depends on the encoding, not the size, so it is worth
+measuring once per family of puzzles:
+
+    python tuning.py                        # tune every family, write the profile
+    python tuning.py sudoku queens          # just these
+
+Each family has a few sample instances, built by the code that solves that family for real and saved as
+SMT-LIB text.  Every configuration in CONFIGS solves every sample, each run parsing the text into its own
+fresh Context, so no run inherits anything from the one before.   A configuration only counts if it gets the
+same answer as the default Solver on every sample (a pipeline that gives up with "unknown" is out).   The
+fastest total is saved to a small JSON profile if it beats the default by MARGIN, and
+
+    s = tuned_solver("sudoku", default="qffd")
+
+returns a solver of the winning configuration, or of the default when the family has not been tuned (or was
+tuned with another version of Z3, where the timings may not hold).   Puzzle, sudoku.py, queens.py and
+bit_tricks.py get their solvers this way.
+"""
+import json
+import os
+import time
+
+from z3 import Context, Solver, SolverFor, Tactic, Then, get_version_string, unknown
+
+PROFILE_FILE = os.environ.get("SOLVER_PROFILE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             ".solver_profile.json"))
+
+# name -> function of a Context returning an empty solver.
+CONFIGS = {
+    "default": lambda ctx: Solver(ctx=ctx),
+    "qffd": lambda ctx: SolverFor("QF_FD", ctx=ctx),
+    "bit-blast-sat": lambda ctx: Then("simplify", "propagate-values", "card2bv", "bit-blast", "sat",
+                                      ctx=ctx).solver(),
+    "lia-to-sat": lambda ctx: Then("simplify", "propagate-values", "lia2card", "card2bv", "bit-blast", "sat",
+                                   ctx=ctx).solver(),
+    "smt-solve-eqs": lambda ctx: Then("simplify", "propagate-values", "solve-eqs", "smt", ctx=ctx).solver(),
+    "smt-ctx-simplify": lambda ctx: Then("simplify", "ctx-simplify", "smt", ctx=ctx).solver(),
+    "qfbv": lambda ctx: Tactic("qfbv", ctx=ctx).solver(),
+    "nlsat": lambda ctx: Tactic("qfnra-nlsat", ctx=ctx).solver(),
+}
+
+# Families whose solver is kept warm and checked again and again under push/pop:  Puzzle's, for first_model(),
+# alternate_solution() and all_solutions().  A tactic's solver() starts again from nothing on every check (listing
+# 200 Coral City solutions took 10.4s with smt-ctx-simplify, 0.8s with the default), and the one-shot timings
+# below cannot see that, so these families only try the configurations that are incremental solvers.
+INCREMENTAL_FAMILIES = {"logic_grid"}
+INCREMENTAL_CONFIGS = ("default", "qffd")
+
+# A configuration replaces the default only when it takes at most this share of the default's time.  Closer
+# than that is noise:  smt-ctx-simplify won logic_grid with 0.070s against the default's 0.074s.
+MARGIN = 0.8
+
+
+# -- sample instances.  Each returns a list of SMT-LIB texts.  The imports are here rather than at the top,
+# since those modules ask this one for their solvers.
+
+def logic_grid_samples():
+    from logic_puzzles import CORAL_CITY_CLUES, CORAL_CITY_TEXT, Puzzle, build_hero_puzzle
+
+    p = Puzzle.from_text(CORAL_CITY_TEXT, cache_dir=None, ctx=Context())
+    for text in CORAL_CITY_CLUES:
+        p.clue(text)
+    return [p.solver.sexpr(), build_hero_puzzle().solver.sexpr()]
+
+
+def sudoku_samples():
+    import numpy as np
+    from sudoku import HARD_INSTANCE, candidates, propagate, shuffled, z3_problem
+
+    grids = shuffled(np.array(HARD_INSTANCE, dtype=np.uint8), 3, seed=1)
+    cand = candidates(grids)
+    propagate(cand)
+    return [z3_problem(grid)[0].sexpr() for grid in cand]
+
+
+def queens_samples():
+    from queens import bitvector_encoding, board_encoding, pairwise_encoding
+
+    return [pairwise_encoding(30)[0].sexpr(), board_encoding(60)[0].sexpr(), bitvector_encoding(16)[0].sexpr()]
+
+
+def bitvector_samples():
+    from z3 import Not
+    from bit_tricks import absolute, average, minimum, round_up_power_of_two_buggy
+
+    samples = []
+    for trick in (average, absolute, minimum, round_up_power_of_two_buggy):
+        s = Solver()
+        fast, slow = trick(64)
+        s.add(Not(fast == slow))
+        samples.append(s.sexpr())
+    return samples
+
+
+def nonlinear_samples():
+    # The guide's nonlinear examples from section_getting_started(), and a circle meeting a cubic.
+    from z3 import Reals
+
+    samples = []
+    for claims in (lambda x, y: [x ** 2 + y ** 2 > 3, x ** 3 + y < 5],
+                   lambda x, y: [x ** 2 + y ** 2 == 3, x ** 3 == 2],
+                   lambda x, y: [x ** 2 + y ** 2 == 25, y == x ** 3 - 4 * x, x * y > 1]):
+        s = Solver()
+        s.add(claims(*Reals("x y")))
+        samples.append(s.sexpr())
+    return samples
+
+
+FAMILIES = {
+    "logic_grid": logic_grid_samples,
+    "sudoku": sudoku_samples,
+    "queens": queens_samples,
+    "bitvector": bitvector_samples,
+    "nonlinear": nonlinear_samples,
+}
+
+
+# -- the profile
+
+_profile = None
+
+
+def load_profile(path=PROFILE_FILE):
+    global _profile
+    if _profile is None or _profile[0] != path:
+        found = dict()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                found = json.load(f)
+        _profile = path, found
+    return _profile[1]
+
+
+def save_profile(profile, path=PROFILE_FILE):
+    global _profile
+    with open(path + ".tmp", "w") as f:
+        json.dump(profile, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+    _profile = path, profile
+
+
+def usable_configs(family):
+    # The names in CONFIGS family may use.  A profile written before INCREMENTAL_FAMILIES may name others.
+    return INCREMENTAL_CONFIGS if family in INCREMENTAL_FAMILIES else tuple(CONFIGS)
+
+
+def tuned_solver(family, ctx=None, default="default", path=PROFILE_FILE):
+    """ An empty solver of the configuration tuned for family, else of default. """
+    entry = load_profile(path).get(family)
+    name = default
+    if entry and entry.get("z3") == get_version_string() and entry.get("config") in usable_configs(family):
+        name = entry["config"]
+    return CONFIGS[name](ctx)
+
+
+NO_TIMEOUT = 4294967295     # z3's default "timeout", meaning none
+
+
+def set_timeout(solver, milliseconds):
+    # solver.set("timeout", milliseconds), and remember it on the solver.  z3 has no way to read a solver's
+    # parameters back, and code that sets a timeout of its own for a while (extract.solution_codes()) has to
+    # put the caller's back afterwards.
+    solver.set("timeout", milliseconds)
+    solver.timeout_ms = milliseconds
+
+
+def timeout_of(solver):
+    # The timeout set_timeout() gave solver, in milliseconds.
+    return getattr(solver, "timeout_ms", NO_TIMEOUT)
+
+
+# -- tuning
+
+def time_config(name, text, timeout):
+    # One run in a fresh context.  Returns (result as a string, seconds).
+    ctx = Context()
+    s = CONFIGS[name](ctx)
+    s.set("timeout", int(timeout * 1000))
+    s.from_string(text)
+    start = time.perf_counter()
+    try:
+        result = s.check()
+    except Exception:     # some pipelines refuse some terms outright
+        result = unknown
+    return str(result), time.perf_counter() - start
+
+
+def tune(family, configs=tuple(CONFIGS), repeats=2, timeout=10, samples=None):
+    """
+    Time each configuration on the family's samples (the best of repeats runs each).  Returns the profile
+    entry:  {"config": the winner, "seconds": {config: total seconds, or None if disqualified}, "z3": version}.
+    The winner is the default unless the fastest takes at most MARGIN of the default's time.
+    """
+    samples = FAMILIES[family]() if samples is None else samples
+    configs = [name for name in configs if name in usable_configs(family)]
+    if "default" not in configs:
+        configs.insert(0, "default")     # what the others are measured against
+    expected = [time_config("default", text, timeout)[0] for text in samples]
+    seconds = dict()
+    for name in configs:
+        total = 0
+        for text, wanted in zip(samples, expected):
+            runs = [time_config(name, text, timeout) for _ in range(repeats)]
+            # A sample the default timed out on counts as settled by any sat or unsat.
+            allowed = ("sat", "unsat") if wanted == "unknown" else (wanted,)
+            if any(result not in allowed for result, _ in runs):
+                total = None
+                break
+            total += min(taken for _, taken in runs)
+        seconds[name] = total
+        if name == "default" and total is None:
+            seconds[name] = len(samples) * timeout   # the default always counts, as the fallback
+    qualified = [(total, name) for name, total in seconds.items() if total is not None]
+    best, winner = min(qualified)
+    if best > MARGIN * seconds["default"]:
+        winner = "default"
+    return {"config": winner, "seconds": seconds, "z3": get_version_string()}
+
+
+def tune_families(families=tuple(FAMILIES), path=PROFILE_FILE, **options):
+    profile = dict(load_profile(path))
+    for family in families:
+        profile[family] = tune(family, **options)
+        save_profile(profile, path)
+        yield family, profile[family]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find the fastest solver configuration for each puzzle family.")
+    parser.add_argument("families", nargs="*", help=f"any of {', '.join(FAMILIES)} (default: all of them)")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=10, help="seconds per run")
+    args = parser.parse_args(argv)
+    for family in args.families:
+        if family not in FAMILIES:
+            parser.error(f"unknown family {family}")
+    for family, entry in tune_families(args.families or FAMILIES, repeats=args.repeats, timeout=args.timeout):
+        print(f"{family}:  {entry['config']}")
+        for name, seconds in sorted(entry["seconds"].items(), key=lambda item: (item[1] is None, item[1])):
+            print(f"   {name:18} {'-' if seconds is None else f'{seconds:.3f}s'}")
+    print(f"Saved to {PROFILE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -36,20 +36,23 @@ def z3_guide_samples():
     section_install_puzzle()
 
 
+# The install puzzle's helpers live at module level so resolver.py can build on them.
+def DependsOn(pack, deps):
+    if is_expr(deps):
+        return Implies(pack, deps)
+    else:
+        return And([Implies(pack, dep) for dep in deps])
+
+
+def Conflict(*packs):
+    return Or([Not(pack) for pack in packs])
+
+
 def section_install_puzzle():
     section("Application:  Install Problem")
     sample()
     print("Code is first presented as fragments; only finished section shown")
 
-    def DependsOn(pack, deps):
-        if is_expr(deps):
-            return Implies(pack, deps)
-        else:
-            return And([Implies(pack, dep) for dep in deps])
-
-    def Conflict(*packs):
-        return Or([Not(pack) for pack in packs])
-
     a, b, c, d, e, f, g, z = Bools('a b c d e f g z')
 
     def install_check(*problem):